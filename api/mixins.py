@@ -0,0 +1,33 @@
+from calendar import timegm
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    Answers GET/HEAD with 304 Not Modified when the client's copy is still current,
+    before the queryset is evaluated or the serializer runs.
+
+    Views implement ``get_validators()`` returning ``(etag, last_modified)``; either may be None.
+    """
+    def get_validators(self):
+        return None, None
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        if etag is not None:
+            # The browsable API and JSON renderings of a resource are different representations.
+            etag = quote_etag(f'{etag}-{request.accepted_renderer.format}')
+        timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            if etag is not None:
+                response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        return response
@@ -1,5 +1,7 @@
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from products.baskets import merge_anonymous_basket
+
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
@@ -11,4 +13,10 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
         token['email'] = user.email
         token['is_staff'] = user.is_staff
 
-        return token
\ No newline at end of file
+        return token
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        # Obtaining a token is a login, so it takes over the visitor's anonymous basket like UserLoginView.
+        merge_anonymous_basket(self.context['request'], self.user)
+        return data
@@ -1,9 +1,20 @@
+import base64
 from datetime import timezone
-
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
 
+from common import idempotency
+from common.cache import cache_lock
+from products import catalog
 from orders.models import OrderStatus, Order
 from products.models import ProductCategory, Product, Basket
 from users.models import User, EmailVerification, EmailVerificationStatus
@@ -139,6 +150,159 @@ class ProductAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
 
+class ProductConditionalGetTests(APITestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.first()
+        self.url_list = reverse('api:product-list')
+        self.url_detail = reverse('api:product-detail', args=[self.product.id])
+
+    def test_list_not_modified(self):
+        response = self.client.get(self.url_list)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url_list, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_list_modified_after_catalog_write(self):
+        etag = self.client.get(self.url_list)['ETag']
+        self.product.stripe_product_price_id = 'price_test'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+
+        response = self.client.get(self.url_list, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_not_modified(self):
+        response = self.client.get(self.url_detail)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url_detail, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_if_modified_since(self):
+        last_modified = self.client.get(self.url_detail)['Last-Modified']
+        response = self.client.get(self.url_detail, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_detail_modified_after_category_write(self):
+        etag = self.client.get(self.url_detail)['ETag']
+        self.product.category.name = 'Renamed category'
+        self.product.category.save()
+
+        response = self.client.get(self.url_detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['category'], 'Renamed category')
+
+
+class ProductSearchTests(APITestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        self.url = reverse('api:product-search')
+
+    def _ids(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(product['id'] for product in response.data['results'])
+
+    def test_search(self):
+        response = self.client.get(self.url, {'q': 'asos'})
+        self.assertEqual(self._ids(response), [3, 6])
+
+    def test_search_with_category_and_price(self):
+        response = self.client.get(self.url, {'q': 'ASOS', 'category': 'Одежда'})
+        self.assertEqual(self._ids(response), [3])
+
+        response = self.client.get(self.url, {'q': 'ASOS', 'max_price': '3000'})
+        self.assertEqual(self._ids(response), [6])
+
+    def test_search_index_follows_writes(self):
+        product = Product.objects.get(id=4)
+        product.name = 'Зеленый рюкзак Puma'
+        product.stripe_product_price_id = 'price_test'
+        product.save()
+
+        self.assertEqual(self._ids(self.client.get(self.url, {'q': 'Puma'})), [4])
+        self.assertEqual(self._ids(self.client.get(self.url, {'q': 'Nike'})), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'Checks the SQLite FTS5 query')
+    def test_search_matches_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self._ids(self.client.get(self.url, {'q': 'ASOS'}))
+
+        # The page and its count each run the full-text match exactly once.
+        self.assertEqual({query['sql'].count('MATCH') for query in queries if 'MATCH' in query['sql']}, {1})
+
+    def test_search_invalid_params(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(self.url, {'q': 'ASOS', 'min_price': '100', 'max_price': '10'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProductSuggestTests(APITestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('api:product-suggest')
+
+    def test_suggest_word_prefixes(self):
+        response = self.client.get(self.url, {'q': 'рюкзак ni'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'],
+                         [{'type': 'product', 'id': 4, 'name': 'Черный рюкзак Nike Heritage'}])
+
+        response = self.client.get(self.url, {'q': 'обу'})
+        self.assertEqual(response.data['results'], [{'type': 'category', 'id': 1, 'name': 'Обувь'}])
+
+    def test_suggest_without_queries_once_built(self):
+        self.client.get(self.url, {'q': 'a'})
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'q': 'asos', 'limit': 1})
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_suggest_follows_catalog_writes(self):
+        self.client.get(self.url, {'q': 'a'})
+        product = Product.objects.get(id=4)
+        product.name = 'Зеленый рюкзак Puma'
+        product.stripe_product_price_id = 'price_test'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        category = ProductCategory.objects.get(id=1)
+        category.name = 'Ботинки'
+        with self.captureOnCommitCallbacks(execute=True):
+            category.save()
+
+        self.assertEqual([result['id'] for result in self.client.get(self.url, {'q': 'pum'}).data['results']], [4])
+        self.assertEqual(self.client.get(self.url, {'q': 'nike'}).data['results'], [])
+        self.assertEqual(self.client.get(self.url, {'q': 'обу'}).data['results'], [])
+        self.assertEqual([result['id'] for result in self.client.get(self.url, {'q': 'бот'}).data['results']], [1])
+
+
+class CategoryFacetsTests(APITestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+
+    def test_facets(self):
+        response = self.client.get(reverse('api:product-facets'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        clothes = next(facet for facet in response.data if facet['category'] == 2)
+        self.assertEqual(clothes['product_count'], 2)
+        self.assertEqual(clothes['in_stock_count'], 2)
+        self.assertEqual(sum(bucket['product_count'] for bucket in clothes['price_buckets']), 2)
+
+
 class BasketAPITests(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpass')
@@ -184,6 +348,249 @@ class BasketAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+class BasketSummaryTests(APITestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='password')
+        for product_id, quantity in ((1, 2), (3, 1), (4, 3)):
+            Basket.objects.create(user=self.user, product_id=product_id, quantity=quantity)
+        self.client.force_authenticate(user=self.user)
+
+    def test_list_computes_totals_once(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('api:basket-list'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual({row['total_quantity'] for row in response.data}, {6})
+        self.assertEqual({row['total_sum'] for row in response.data}, {Decimal('22590.00')})
+
+    def test_summary(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('api:basket-summary'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'total_quantity': 6, 'total_sum': Decimal('22590.00')})
+
+    def test_bulk(self):
+        operations = [
+            {'op': 'set', 'product_id': 1, 'quantity': 5},
+            {'op': 'add', 'product_id': 2, 'quantity': 2},
+            {'op': 'add', 'product_id': 2},
+            {'op': 'remove', 'product_id': 3},
+            {'op': 'set', 'product_id': 4, 'quantity': 0},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('api:basket-bulk'), {'operations': operations}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        statements = [query['sql'] for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        # Validation, locking read, delete, update, insert, list and summary.
+        self.assertEqual(len(statements), 7)
+        self.assertEqual(
+            dict(Basket.objects.filter(user=self.user).values_list('product_id', 'quantity')),
+            {1: 5, 2: 3},
+        )
+        self.assertEqual(response.data['summary']['total_quantity'], 8)
+        self.assertEqual([row['product']['id'] for row in response.data['baskets']], [1, 2])
+
+    def test_bulk_rejects_missing_products(self):
+        operations = [{'op': 'set', 'product_id': 1, 'quantity': 1}, {'op': 'add', 'product_id': 999}]
+        response = self.client.post(reverse('api:basket-bulk'), {'operations': operations}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Basket.objects.get(user=self.user, product_id=1).quantity, 2)
+
+
+class BasketDeletedProductTests(APITransactionTestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='password')
+        self.client.force_authenticate(user=self.user)
+
+    def test_product_deleted_after_ids_were_cached(self):
+        with mock.patch.object(catalog, 'product_exists', return_value=True):
+            response = self.client.post(reverse('api:basket-list'), {'product_id': 999})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Basket.objects.exists())
+
+
+class OrderSnapshotAPITests(APITestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='password')
+        for product_id, quantity in ((1, 2), (3, 1)):
+            Basket.objects.create(user=self.user, product_id=product_id, quantity=quantity)
+        self.client.force_authenticate(user=self.user)
+        self.data = {'first_name': 'Ivan', 'last_name': 'Ivanov', 'email': 'ivan@example.com', 'address': 'Moscow'}
+
+    def test_create_snapshots_basket(self):
+        response = self.client.post(reverse('api:order-list'), self.data)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(id=response.data['id'])
+        self.assertEqual([(item.product_id, item.quantity) for item in order.items.order_by('product_id')],
+                         [(1, 2), (3, 1)])
+        self.assertEqual(order.total_sum, Decimal('15570.00'))
+        self.assertFalse(Basket.objects.filter(user=self.user).exists())
+
+    def test_create_with_empty_basket(self):
+        Basket.objects.all().delete()
+        response = self.client.post(reverse('api:order-list'), self.data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_prefetches_items(self):
+        for _ in range(3):
+            self.client.post(reverse('api:order-list'), self.data)
+            Basket.objects.merge(self.user, {1: 2, 3: 1})
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('api:order-list'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([len(order['items']) for order in response.data['results']], [2, 2, 2])
+
+    def test_list_rejects_malformed_cursors(self):
+        self.client.post(reverse('api:order-list'), self.data)
+        payloads = ['[]', '{"p": "ab", "r": false}', '{"p": [{}, 1], "r": false}', '{"p": [1, 1], "r": "yes"}',
+                    '{"p": ["yesterday", 1], "r": false}', '{"p": ["2026-10-18T10:00:00+00:00", "x"], "r": false}']
+
+        for payload in payloads:
+            cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+            response = self.client.get(reverse('api:order-list'), {'cursor': cursor})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, payload)
+
+    def test_list_follows_cursor(self):
+        for _ in range(4):
+            self.client.post(reverse('api:order-list'), self.data)
+            Basket.objects.merge(self.user, {1: 2, 3: 1})
+
+        response = self.client.get(self.client.get(reverse('api:order-list')).data['next'])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([order['id'] for order in response.data['results']],
+                         [Order.objects.filter(initiator=self.user).order_by('id').first().id])
+
+
+class OrderIdempotencyTests(APITestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='password')
+        Basket.objects.create(user=self.user, product_id=1, quantity=2)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('api:order-list')
+        self.data = {'first_name': 'Ivan', 'last_name': 'Ivanov', 'email': 'ivan@example.com', 'address': 'Moscow'}
+
+    def test_retry_replays_first_response(self):
+        first = self.client.post(self.url, self.data, HTTP_IDEMPOTENCY_KEY='order-1')
+        Basket.objects.create(user=self.user, product_id=3, quantity=1)
+
+        retry = self.client.post(self.url, self.data, HTTP_IDEMPOTENCY_KEY='order-1')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((retry.status_code, retry.content), (first.status_code, first.content))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        # The retry did not check the new basket out.
+        self.assertTrue(Basket.objects.filter(user=self.user).exists())
+
+    def test_keys_are_scoped_by_user(self):
+        self.client.post(self.url, self.data, HTTP_IDEMPOTENCY_KEY='order-1')
+        other = User.objects.create_user(username='other')
+        Basket.objects.create(user=other, product_id=1, quantity=1)
+        self.client.force_authenticate(user=other)
+
+        response = self.client.post(self.url, self.data, HTTP_IDEMPOTENCY_KEY='order-1')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.filter(initiator=other).count(), 1)
+
+    def test_without_key(self):
+        self.client.post(self.url, self.data)
+        Basket.objects.create(user=self.user, product_id=1, quantity=1)
+
+        self.client.post(self.url, self.data)
+
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_for_another_request(self):
+        self.client.post(self.url, self.data, HTTP_IDEMPOTENCY_KEY='order-1')
+        Basket.objects.create(user=self.user, product_id=3, quantity=1)
+
+        response = self.client.post(self.url, {**self.data, 'address': 'Kazan'}, HTTP_IDEMPOTENCY_KEY='order-1')
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_fingerprint_of_parsed_multipart_form(self):
+        requests = [RequestFactory().post(self.url, data) for data in (self.data, self.data, {**self.data, 'x': 1})]
+        for request in requests:
+            request.POST
+
+        fingerprints = [idempotency._fingerprint(request) for request in requests]
+
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        self.assertNotEqual(fingerprints[0], fingerprints[2])
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_duplicate_of_request_in_progress(self):
+        request = SimpleNamespace(method='POST', path=self.url, user=self.user)
+
+        with cache_lock(idempotency._cache_key(request, 'order-1')):
+            response = self.client.post(self.url, self.data, HTTP_IDEMPOTENCY_KEY='order-1')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderStatsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper', password='password')
+        for status_choice in (OrderStatus.CREATED, OrderStatus.CREATED, OrderStatus.PAID):
+            Order.objects.create(initiator=self.user, first_name='Ivan', last_name='Ivanov', email='ivan@example.com',
+                                 address='Moscow', total_sum=Decimal('100.00'), status=status_choice)
+        self.client.force_authenticate(user=self.user)
+
+    def test_single_lookup(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('api:order-stats'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_orders'], 3)
+        self.assertEqual(response.data['total_spent'], Decimal('300.00'))
+        self.assertEqual(response.data['pending_orders'], 2)
+        self.assertEqual(response.data['orders_by_status']['PAID'], 1)
+
+    def test_without_orders(self):
+        self.client.force_authenticate(user=User.objects.create_user(username='new'))
+        response = self.client.get(reverse('api:order-stats'))
+        self.assertEqual(response.data['total_orders'], 0)
+
+
+class CacheStatsTests(APITestCase):
+    def test_admin_only(self):
+        self.client.force_authenticate(user=User.objects.create_user(username='shopper'))
+        response = self.client.get(reverse('api:cache-stats'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_local_tier_counters(self):
+        self.client.force_authenticate(user=User.objects.create_user(username='admin', is_staff=True))
+        response = self.client.get(reverse('api:cache-stats'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        if hasattr(cache, 'local_stats'):
+            self.assertEqual(set(response.data), {'pid', 'hits', 'misses', 'entries'})
+        else:
+            self.assertEqual(response.data, {})
+
+
 class OrderAPITests(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='testpass')
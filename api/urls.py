@@ -9,7 +9,8 @@ from rest_framework_simplejwt.views import (
 
 from api.serializers import CustomTokenObtainPairSerializer
 from api.views import UserViewSet, EmailVerificationViewSet, BasketViewSet, OrderViewSet, ProductListCreateAPIView, \
-    ProductRetrieveUpdateDestroyAPIView, OrderStatsAPIView, ProductCreateUpdateDestroyAPIView
+    ProductRetrieveUpdateDestroyAPIView, OrderStatsAPIView, ProductCreateUpdateDestroyAPIView, CacheStatsAPIView, \
+    ProductSearchAPIView, ProductSuggestAPIView, CategoryFacetsAPIView
 
 app_name = 'api'
 
@@ -28,8 +29,12 @@ urlpatterns = [
     path('auth/token/verify/', TokenVerifyView.as_view(), name='token_verify'),
     path('', include(router.urls)),
     path('products/', ProductListCreateAPIView.as_view(), name='product-list'),
+    path('products/search/', ProductSearchAPIView.as_view(), name='product-search'),
+    path('products/suggest/', ProductSuggestAPIView.as_view(), name='product-suggest'),
+    path('products/facets/', CategoryFacetsAPIView.as_view(), name='product-facets'),
     path('products/<int:pk>/', ProductRetrieveUpdateDestroyAPIView.as_view(), name='product-detail'),
     path('order-stats/', OrderStatsAPIView.as_view(), name='order-stats'),
+    path('cache-stats/', CacheStatsAPIView.as_view(), name='cache-stats'),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('api/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
@@ -2,18 +2,29 @@ from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema_view, extend_schema, OpenApiParameter, OpenApiExample, OpenApiResponse
 from rest_framework import status, viewsets, generics, permissions
 from rest_framework.decorators import action
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
-from rest_framework.exceptions import PermissionDenied, ValidationError
-from django.shortcuts import get_object_or_404
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Greatest
 from rest_framework.views import APIView
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
+from api.mixins import ConditionalGetMixin
+from common.idempotency import idempotent
 from api.permissions import IsAdminOrReadOnly, IsProductOwnerOrAdmin, IsOrderOwnerOrAdmin
-from orders.models import Order, OrderStatus, OrderItem
+from orders import reservations, stats as order_stats
+from orders.checkout import CheckoutError, checkout
+from orders.models import Order, OrderStatus
 from orders.serializers import OrderSerializer
+from products import catalog, facets
 from products.models import Product, Basket
-from products.serializers import BasketSerializer, ProductSerializer
+from products.baskets import get_basket_store
+from products.search import search_products
+from products.suggest import suggest
+from products.serializers import BasketBulkSerializer, BasketSerializer, ProductSearchSerializer, ProductSerializer
 from users.models import EmailVerificationStatus, EmailVerification, User
 from users.serializers import EmailVerificationSerializer, UserSerializer
 
@@ -28,7 +39,10 @@ from users.serializers import EmailVerificationSerializer, UserSerializer
                 "application/json": {
                     "total_orders": 5,
                     "total_spent": 499.95,
-                    "pending_orders": 2
+                    "pending_orders": 2,
+                    "orders_by_status": {
+                        "CREATED": 2, "PAID": 1, "ON_WAY": 0, "DELIVERED": 2, "CANCELED": 0
+                    }
                 }
             }
         ),
@@ -47,17 +61,33 @@ class OrderStatsAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        user_orders = Order.objects.filter(initiator=request.user)
-
+        user_stats = order_stats.get_stats(request.user)
         stats = {
-            'total_orders': user_orders.count(),
-            'total_spent': sum(order.basket_history['total_sum'] for order in user_orders),
-            'pending_orders': user_orders.filter(status=OrderStatus.CREATED).count(),
+            'total_orders': user_stats.total_orders,
+            'total_spent': user_stats.total_spent,
+            'pending_orders': user_stats.created_orders,
+            'orders_by_status': {
+                status_choice.name: getattr(user_stats, order_stats.status_field(status_choice))
+                for status_choice in OrderStatus
+            },
         }
 
         return Response(stats, status=status.HTTP_200_OK)
 
 
+@extend_schema(
+    summary="Local cache statistics",
+    description="Hit/miss counters of the in-process cache tier of the worker serving the request",
+)
+class CacheStatsAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        local_stats = getattr(cache, 'local_stats', None)
+        return Response(local_stats() if local_stats else {}, status=status.HTTP_200_OK)
+
+
 class ProductCreateUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
     authentication_classes = [JWTAuthentication]
     queryset = Product.objects.select_related('category')
@@ -83,21 +113,36 @@ class ProductCreateUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
         instance.save()
 
 
-class ProductListCreateAPIView(generics.ListCreateAPIView):
+class ProductListCreateAPIView(ConditionalGetMixin, generics.ListCreateAPIView):
     queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAdminOrReadOnly]
+    keyset_ordering = ('id',)
 
     def get_queryset(self):
-        return super().get_queryset().select_related('category').prefetch_related('category__products')
+        return super().get_queryset().select_related('category')
 
+    def get_validators(self):
+        # Stock moves only touch the modification time, not the catalog version.
+        modified = catalog.get_last_modified()
+        return f'catalog-{catalog.get_version()}-{modified.timestamp()}', modified
 
-class ProductRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView):
+
+class ProductRetrieveUpdateDestroyAPIView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     authentication_classes = [JWTAuthentication]
     queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
 
+    def get_validators(self):
+        # The serialized product embeds its category name, so a category change counts too.
+        modified = Product.objects.filter(pk=self.kwargs['pk']).values_list(
+            Greatest('updated_at', 'category__updated_at'), flat=True,
+        ).first()
+        if modified is None:
+            return None, None
+        return f'product-{self.kwargs["pk"]}-{modified.timestamp()}', modified
+
     def get_permissions(self):
         if self.request.method == 'GET':
             return [permissions.AllowAny()]
@@ -106,6 +151,71 @@ class ProductRetrieveUpdateDestroyAPIView(generics.RetrieveUpdateDestroyAPIView)
         return [IsAdminUser()]  # DELETE only for admins
 
 
+@extend_schema(
+    summary="Search products",
+    description="Full-text search over product names and descriptions, most relevant first",
+    parameters=[ProductSearchSerializer],
+)
+class ProductSearchAPIView(generics.ListAPIView):
+    serializer_class = ProductSerializer
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.AllowAny]
+    # Results are ordered by rank, which cursors over ids cannot follow.
+    pagination_class = LimitOffsetPagination
+
+    def get_queryset(self):
+        params = ProductSearchSerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        filters = params.validated_data
+
+        queryset = Product.objects.select_related('category')
+        if 'category' in filters:
+            queryset = queryset.filter(category__name=filters['category'])
+        if 'min_price' in filters:
+            queryset = queryset.filter(price__gte=filters['min_price'])
+        if 'max_price' in filters:
+            queryset = queryset.filter(price__lte=filters['max_price'])
+        return search_products(filters['q'], queryset).order_by('-rank', 'id')
+
+
+@extend_schema(
+    summary="Category facets",
+    description="Product and in-stock counts per category, with a price histogram for each",
+)
+class CategoryFacetsAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        category_facets = facets.get_facets()
+        return Response([
+            {'category': category.id, 'name': category.name, **category_facets[category.id]}
+            for category in catalog.get_categories() if category.id in category_facets
+        ], status=status.HTTP_200_OK)
+
+
+@extend_schema(
+    summary="Suggest products",
+    description="As-you-type suggestions of product and category names starting with q",
+    parameters=[
+        OpenApiParameter(name='q', type=OpenApiTypes.STR, location=OpenApiParameter.QUERY, required=True),
+        OpenApiParameter(name='limit', type=OpenApiTypes.INT, location=OpenApiParameter.QUERY),
+    ],
+)
+class ProductSuggestAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [permissions.AllowAny]
+    max_limit = 20
+
+    def get(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), self.max_limit)
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer'})
+        results = suggest(request.query_params.get('q', ''), max(limit, 1))
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
 class BasketViewSet(viewsets.GenericViewSet,
                     generics.mixins.ListModelMixin,
                     generics.mixins.RetrieveModelMixin,
@@ -118,27 +228,96 @@ class BasketViewSet(viewsets.GenericViewSet,
     permission_classes = [IsAuthenticated]
     pagination_class = None
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # The API works on the Basket table, bring it up to date with the basket store.
+        get_basket_store().flush(request.user)
+
     def get_queryset(self):
         return Basket.objects.filter(
             user=self.request.user
         ).select_related('product', 'product__category')
 
     def perform_create(self, serializer):
-        product_id = self.request.data.get('product_id')
-        product = get_object_or_404(Product, id=product_id)
-        basket, _ = Basket.create_or_update(product.id, self.request.user)
-        serializer.instance = basket
+        try:
+            # Products are validated against the cached ids, which can still hold one deleted a moment ago.
+            with transaction.atomic():
+                serializer.instance = Basket.objects.add(
+                    self.request.user, serializer.validated_data['product_id'],
+                    serializer.validated_data.get('quantity', 1),
+                )
+        except IntegrityError:
+            raise NotFound('Product not found')
+        get_basket_store().discard(self.request.user)
 
     def perform_update(self, serializer):
         if 'quantity' in serializer.validated_data:
             if serializer.validated_data['quantity'] <= 0:
                 raise ValidationError({'quantity': 'Must be positive number'})
         serializer.save()
+        get_basket_store().discard(self.request.user)
 
     def perform_destroy(self, instance):
-        if instance.is_purchased:
-            raise ValidationError({'error': 'Cannot delete purchased items'})
         instance.delete()
+        get_basket_store().discard(self.request.user)
+
+    @extend_schema(
+        summary="Basket summary",
+        description="Total quantity and sum of the authenticated user's basket",
+        responses={
+            200: OpenApiResponse(
+                description="Successful response",
+                examples={
+                    "application/json": {
+                        "total_quantity": 3,
+                        "total_sum": 299.97
+                    }
+                }
+            ),
+        }
+    )
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        return Response(self.get_queryset().summary(), status=status.HTTP_200_OK)
+
+    @extend_schema(
+        summary="Bulk basket update",
+        description="Apply a list of set/add/remove operations in one transaction and return the new basket",
+        request=BasketBulkSerializer,
+        examples=[
+            OpenApiExample(
+                'Sync after offline edits',
+                value={
+                    "operations": [
+                        {"op": "set", "product_id": 1, "quantity": 2},
+                        {"op": "add", "product_id": 3, "quantity": 1},
+                        {"op": "remove", "product_id": 4}
+                    ]
+                },
+                request_only=True,
+            ),
+        ],
+    )
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        serializer = BasketBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            Basket.objects.apply(request.user, [
+                (operation['op'], operation['product_id'], operation['quantity'])
+                for operation in serializer.validated_data['operations']
+            ])
+        except IntegrityError:
+            raise NotFound('Product not found')
+        get_basket_store().discard(request.user)
+
+        baskets = self.get_queryset()
+        summary = baskets.summary()
+        context = {**self.get_serializer_context(), 'basket_summary': summary}
+        return Response({
+            'baskets': BasketSerializer(baskets, many=True, context=context).data,
+            'summary': summary,
+        }, status=status.HTTP_200_OK)
 
 
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
@@ -230,6 +409,13 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        category = self.request.query_params.get('category')
+        if self.action == 'list' and category:
+            queryset = queryset.filter(category__name=category)
+        return queryset
+
 @extend_schema_view(
     list=extend_schema(
         summary="List all orders",
@@ -251,12 +437,25 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         summary="Retrieve order details",
         description="Returns complete details for a specific order",
     ),
+    create=extend_schema(
+        summary="Check out the basket",
+        description="Creates an order of the authenticated user's basket",
+        parameters=[
+            OpenApiParameter(
+                name='Idempotency-Key',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.HEADER,
+                description="Retries with the same key get the first response instead of another order",
+            ),
+        ],
+    ),
 )
 class OrderViewSet(viewsets.ModelViewSet):
     queryset = Order.objects.all().select_related('initiator').prefetch_related('items')
     serializer_class = OrderSerializer
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
+    keyset_ordering = ('-created', '-id')
 
     def get_queryset(self):
         return Order.objects.filter(
@@ -268,13 +467,23 @@ class OrderViewSet(viewsets.ModelViewSet):
             return [IsAuthenticated(), IsOrderOwnerOrAdmin()]
         return [IsAuthenticated()]
 
-    def perform_create(self, serializer):
-        baskets = Basket.objects.filter(user=self.request.user, is_purchased=False)
-        if not baskets.exists():
-            raise ValidationError({"error": "No items in basket to order"})
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    @idempotent
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
+    @idempotent
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
 
-        order = serializer.save(initiator=self.request.user)
-        self._create_order_items(order, baskets)
+    def perform_create(self, serializer):
+        try:
+            serializer.instance, _ = checkout(self.request.user, **serializer.validated_data)
+        except CheckoutError as error:
+            raise ValidationError({"error": str(error)})
 
     def perform_update(self, serializer):
         instance = serializer.instance
@@ -283,20 +492,6 @@ class OrderViewSet(viewsets.ModelViewSet):
         serializer.save()
 
     def perform_destroy(self, instance):
-        if instance.status != OrderStatus.CREATED:
+        # Canceling gives the order's reserved stock back.
+        if not reservations.cancel(instance):
             raise ValidationError({"error": "Only CREATED orders can be canceled"})
-        instance.status = OrderStatus.CANCELED
-        instance.save()
-
-    def _create_order_items(self, order, baskets):
-        order_items = []
-        for basket in baskets:
-            order_items.append(OrderItem(
-                order=order,
-                product=basket.product,
-                quantity=basket.quantity,
-                price=basket.product.price
-            ))
-            basket.is_purchased = True
-            basket.save()
-        OrderItem.objects.bulk_create(order_items)
@@ -0,0 +1,92 @@
+import hashlib
+import math
+import random
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+
+@contextmanager
+def cache_lock(key, timeout=10, wait=0, poll=0.05):
+    """
+    Distributed lock built on the cache's atomic ``add`` (SET NX on Redis).
+
+    Yields whether the lock was acquired within ``wait`` seconds; ``timeout`` frees it should
+    the holder die. Only the holder's own token is ever released.
+    """
+    key = f'lock:{key}'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    acquired = cache.add(key, token, timeout)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(poll)
+        acquired = cache.add(key, token, timeout)
+    try:
+        yield acquired
+    finally:
+        if acquired and cache.get(key) == token:
+            cache.delete(key)
+
+
+def get_or_compute(key, compute, timeout=300, stale_timeout=60, beta=1.0, lock_timeout=10):
+    """
+    Return the cached value of ``key``, computing it at most once across workers.
+
+    Entries remember their logical expiry and how long they took to compute. They are refreshed
+    early with a probability that grows as expiry nears (XFetch; ``beta`` > 1 refreshes sooner),
+    by the single caller that wins the lock, while the others keep serving the current value for
+    up to ``stale_timeout`` more seconds. On a cold miss callers wait for the winner instead of
+    all recomputing. ``timeout=None`` keeps the entry until its key changes or it is evicted.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        value, expires, delta = entry
+        if expires is None or time.time() - delta * beta * math.log(1 - random.random()) < expires:
+            return value
+        with cache_lock(key, lock_timeout) as acquired:
+            if acquired:
+                return _compute(key, compute, timeout, stale_timeout)
+        return value
+
+    with cache_lock(key, lock_timeout, wait=lock_timeout):
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+        return _compute(key, compute, timeout, stale_timeout)
+
+
+def get_many_or_compute(keys, compute, timeout=300):
+    """
+    Batch variant for immutable, versioned entries: ``keys`` maps cache keys to ids and
+    ``compute(ids)`` returns ``{id: value}`` for the missing ones. Callers missing the same set
+    of keys share one computation.
+    """
+    found = cache.get_many(list(keys))
+    values = {keys[key]: value for key, value in found.items()}
+    missing = [key for key in keys if key not in found]
+    if not missing:
+        return values
+
+    digest = hashlib.md5('|'.join(sorted(map(str, missing))).encode()).hexdigest()
+    with cache_lock(f'batch:{digest}', wait=10):
+        found = cache.get_many(missing)
+        values.update({keys[key]: value for key, value in found.items()})
+        missing = [key for key in missing if key not in found]
+        if missing:
+            computed = compute([keys[key] for key in missing])
+            cache.set_many({key: computed[keys[key]] for key in missing if keys[key] in computed}, timeout)
+            values.update(computed)
+    return values
+
+
+def _compute(key, compute, timeout, stale_timeout):
+    start = time.time()
+    value = compute()
+    delta = time.time() - start
+    if timeout is None:
+        cache.set(key, (value, None, delta), None)
+    else:
+        cache.set(key, (value, time.time() + timeout, delta), timeout + stale_timeout)
+    return value
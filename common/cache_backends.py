@@ -0,0 +1,260 @@
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django_redis.cache import RedisCache
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# How long the first local read of a process waits for its invalidation listener to subscribe.
+SUBSCRIBE_TIMEOUT = 1
+
+
+class LocalLRU:
+    """Bounded, thread-safe in-process LRU whose entries expire after ``timeout`` seconds."""
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.listener_pid = None
+        self.listener_lock = threading.Lock()
+        # Set while the listener is subscribed; entries are only kept locally when it is.
+        self.subscribed = threading.Event()
+        # Bumped by every invalidation, see set().
+        self.generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return _MISSING
+            self.hits += 1
+            payload = entry[1]
+            self._data.move_to_end(key)
+        # Values are kept pickled so callers can never mutate the shared copy.
+        return pickle.loads(payload)
+
+    def set(self, key, value, generation=None):
+        """
+        Store ``value``; given the ``generation`` read before ``value`` was fetched, only if no
+        invalidation happened since, it could have replaced ``value`` in Redis already.
+        """
+        payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._data[key] = (time.monotonic() + self.timeout, payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+class TwoTierRedisCache(RedisCache):
+    """
+    django_redis cache fronted by a per-process LRU for keys starting with LOCAL_KEY_PREFIXES.
+
+    Writes to such keys are published on INVALIDATION_CHANNEL and every worker drops its local
+    copy; LOCAL_TIMEOUT bounds staleness should an invalidation message ever be missed. A value
+    read from Redis is not kept locally when an invalidation arrived during the read, else a
+    reader could cache the ``catalog:version`` a concurrent bump just replaced, nor while the
+    process is not subscribed to the channel, as the invalidations it misses then would leave
+    the local copy stale for up to LOCAL_TIMEOUT.
+    """
+
+    def __init__(self, server, params):
+        super().__init__(server, params)
+        options = params.get('OPTIONS', {})
+        self._local_prefixes = tuple(options.get('LOCAL_KEY_PREFIXES', ()))
+        self._channel = options.get('INVALIDATION_CHANNEL', 'cache:invalidate')
+        # Django builds a cache instance per thread, the local tier is shared by the whole process.
+        with _local_tiers_lock:
+            self._local = _local_tiers.setdefault((server, self._channel), LocalLRU(
+                options.get('LOCAL_MAX_ENTRIES', 1024), options.get('LOCAL_TIMEOUT', 60),
+            ))
+
+    def local_stats(self):
+        return {
+            'pid': os.getpid(),
+            'hits': self._local.hits,
+            'misses': self._local.misses,
+            'entries': len(self._local),
+        }
+
+    def get(self, key, default=None, version=None, client=None):
+        if not self._is_local(key):
+            return super().get(key, default, version, client)
+
+        self._ensure_listener()
+        local_key = self._local_key(key, version)
+        value = self._local.get(local_key)
+        if value is not _MISSING:
+            return value
+
+        generation = self._local.generation
+        value = super().get(key, _MISSING, version, client)
+        if value is _MISSING:
+            return default
+        self._fill(local_key, value, generation)
+        return value
+
+    def get_many(self, keys, version=None, client=None):
+        result = {}
+        remote = []
+        local_keys = {key for key in keys if self._is_local(key)}
+        if local_keys:
+            self._ensure_listener()
+        for key in keys:
+            value = self._local.get(self._local_key(key, version)) if key in local_keys else _MISSING
+            if value is _MISSING:
+                remote.append(key)
+            else:
+                result[key] = value
+
+        if remote:
+            generation = self._local.generation
+            fetched = super().get_many(remote, version=version, client=client)
+            for key, value in fetched.items():
+                if key in local_keys:
+                    self._fill(self._local_key(key, version), value, generation)
+            result.update(fetched)
+        return result
+
+    def set(self, key, *args, version=None, **kwargs):
+        result = super().set(key, *args, version=version, **kwargs)
+        self._invalidate([key], version)
+        return result
+
+    def add(self, key, *args, version=None, **kwargs):
+        added = super().add(key, *args, version=version, **kwargs)
+        if added:
+            self._invalidate([key], version)
+        return added
+
+    def set_many(self, data, *args, version=None, **kwargs):
+        result = super().set_many(data, *args, version=version, **kwargs)
+        self._invalidate(list(data), version)
+        return result
+
+    def delete(self, key, *args, version=None, **kwargs):
+        result = super().delete(key, *args, version=version, **kwargs)
+        self._invalidate([key], version)
+        return result
+
+    def delete_many(self, keys, *args, version=None, **kwargs):
+        result = super().delete_many(keys, *args, version=version, **kwargs)
+        self._invalidate(list(keys), version)
+        return result
+
+    def incr(self, key, *args, version=None, **kwargs):
+        result = super().incr(key, *args, version=version, **kwargs)
+        self._invalidate([key], version)
+        return result
+
+    def decr(self, key, *args, version=None, **kwargs):
+        result = super().decr(key, *args, version=version, **kwargs)
+        self._invalidate([key], version)
+        return result
+
+    def touch(self, key, *args, version=None, **kwargs):
+        result = super().touch(key, *args, version=version, **kwargs)
+        self._invalidate([key], version)
+        return result
+
+    def clear(self):
+        result = super().clear()
+        self._local.clear()
+        self._publish('*')
+        return result
+
+    def _is_local(self, key):
+        return bool(self._local_prefixes) and str(key).startswith(self._local_prefixes)
+
+    def _local_key(self, key, version):
+        return str(self.make_key(key, version=version))
+
+    def _fill(self, local_key, value, generation):
+        if self._local.subscribed.is_set():
+            self._local.set(local_key, value, generation)
+
+    def _invalidate(self, keys, version):
+        local_keys = [self._local_key(key, version) for key in keys if self._is_local(key)]
+        if local_keys:
+            self._local.delete(*local_keys)
+            self._publish(*local_keys)
+
+    def _publish(self, *local_keys):
+        try:
+            self.client.get_client(write=True).publish(self._channel, '\n'.join(local_keys))
+        except Exception:
+            logger.exception('Could not publish cache invalidation on %s', self._channel)
+
+    def _ensure_listener(self):
+        # One listener per process; checked by pid so forked workers start their own.
+        local = self._local
+        if local.listener_pid == os.getpid():
+            return
+        with local.listener_lock:
+            if local.listener_pid == os.getpid():
+                return
+            local.subscribed.clear()
+            local.clear()
+            local.listener_pid = os.getpid()
+            threading.Thread(target=self._listen, name='cache-invalidation', daemon=True).start()
+            # Nothing is kept locally before the listener subscribed; wait so the first reads can be.
+            local.subscribed.wait(SUBSCRIBE_TIMEOUT)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.get_client(write=False).pubsub()
+                pubsub.subscribe(self._channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        # Redis confirmed the subscription, no invalidation can be missed from now on.
+                        self._local.subscribed.set()
+                        continue
+                    if message['type'] != 'message':
+                        continue
+                    keys = message['data'].decode().split('\n')
+                    if '*' in keys:
+                        self._local.clear()
+                    else:
+                        self._local.delete(*keys)
+            except Exception:
+                logger.exception('Cache invalidation listener failed, reconnecting')
+            # Anything cached while we were not listening may have missed an invalidation.
+            self._local.subscribed.clear()
+            self._local.clear()
+            time.sleep(1)
@@ -0,0 +1,97 @@
+"""
+Idempotency keys for views that must not run twice for one client request.
+
+A client sends the same ``Idempotency-Key`` header (or, from an HTML form, the
+``idempotency_key`` field) with every retry of a request. The first response is stored in the
+cache for IDEMPOTENCY_KEY_TIMEOUT seconds and replayed for the retries; a retry arriving while
+the first request is still running waits for it on a lock instead of running the view again.
+Keys are scoped by user and request path, and responses to anonymous users are not stored.
+A key reused with a different request body is rejected with 422 rather than replayed.
+"""
+import hashlib
+from functools import wraps
+from http import HTTPStatus
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.http.request import RawPostDataException
+
+from common.cache import cache_lock
+
+HEADER = 'Idempotency-Key'
+FORM_FIELD = 'idempotency_key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+def idempotent(handler):
+    """Decorate a view method (Django or DRF) to honour idempotency keys."""
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        # Read before request.POST, which may consume the body of a multipart request.
+        fingerprint = _fingerprint(request)
+        key = request.headers.get(HEADER) or request.POST.get(FORM_FIELD)
+        if not key or not request.user.is_authenticated:
+            return handler(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'error': f'{HEADER} cannot be longer than {MAX_KEY_LENGTH} characters'},
+                                status=HTTPStatus.BAD_REQUEST)
+
+        cache_key = _cache_key(request, key)
+        stored = cache.get(cache_key)
+        if stored is None:
+            with cache_lock(cache_key, settings.IDEMPOTENCY_LOCK_TIMEOUT,
+                            wait=settings.IDEMPOTENCY_WAIT_TIMEOUT) as acquired:
+                stored = cache.get(cache_key)
+                if stored is None:
+                    if not acquired:
+                        return JsonResponse({'error': 'A request with this idempotency key is still in progress'},
+                                            status=HTTPStatus.CONFLICT)
+                    response = _render(view, request, handler(view, request, *args, **kwargs))
+                    # Server errors are not stored, so a retry gets another chance.
+                    if response.status_code < HTTPStatus.INTERNAL_SERVER_ERROR:
+                        cache.set(cache_key, (fingerprint, *_serialize(response)), settings.IDEMPOTENCY_KEY_TIMEOUT)
+                    return response
+        if stored[0] != fingerprint:
+            return JsonResponse({'error': f'{HEADER} was already used for a different request'},
+                                status=HTTPStatus.UNPROCESSABLE_ENTITY)
+        return _replay(stored[1:])
+    return wrapper
+
+
+def _cache_key(request, key):
+    digest = hashlib.sha256(f'{request.method}:{request.path}:{key}'.encode()).hexdigest()
+    return f'idempotency:{request.user.pk}:{digest}'
+
+
+def _fingerprint(request):
+    try:
+        body = request.body
+    except RawPostDataException:
+        # A multipart body that was parsed already; files are not part of the fingerprint.
+        body = urlencode(sorted(request.POST.lists()), doseq=True).encode()
+    return hashlib.sha256(body).hexdigest()
+
+
+def _render(view, request, response):
+    # DRF responses are only given their renderer by the view's dispatch, after this returns.
+    if hasattr(view, 'finalize_response'):
+        response = view.finalize_response(request, response)
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    return response
+
+
+def _serialize(response):
+    return response.status_code, list(response.items()), response.content
+
+
+def _replay(stored):
+    status_code, headers, content = stored
+    response = HttpResponse(content, status=status_code)
+    for header, value in headers:
+        response[header] = value
+    response[REPLAYED_HEADER] = 'true'
+    return response
@@ -0,0 +1,38 @@
+class StoredValuesMixin:
+    """
+    Remembers the values of ``tracked_fields`` (attnames) as last loaded from or saved to the
+    database, so save and delete signals can tell what the row holds without reading it again.
+    """
+
+    tracked_fields = ()
+    _stored_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_stored_values()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        self._remember_stored_values(fields)
+
+    def save_base(self, *args, **kwargs):
+        super().save_base(*args, **kwargs)
+        self._remember_stored_values(kwargs.get('update_fields'))
+
+    def stored_copy(self):
+        """An unsaved instance holding the tracked values as stored, or None when they are not known."""
+        if self._stored_values is None:
+            return None
+        return type(self)(pk=self.pk, **self._stored_values)
+
+    def _remember_stored_values(self, fields=None):
+        if fields is None:
+            loaded = not self.get_deferred_fields().intersection(self.tracked_fields)
+            self._stored_values = {field: getattr(self, field) for field in self.tracked_fields} if loaded else None
+        elif self._stored_values is not None:
+            written = {self._meta.get_field(field).attname for field in fields}
+            self._stored_values.update(
+                {field: getattr(self, field) for field in self.tracked_fields if field in written},
+            )
@@ -0,0 +1,238 @@
+import base64
+import binascii
+import json
+from bisect import bisect_left, bisect_right
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q, QuerySet
+from django.http import Http404
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_cursor(position, reverse=False):
+    payload = json.dumps({'p': position, 'r': reverse}, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """``(position, reverse)`` of a cursor; raises InvalidPage for anything encode_cursor cannot make."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError, binascii.Error):
+        raise InvalidPage('Invalid cursor')
+    # Cursors come from clients, so the shape of the payload is checked too.
+    if not isinstance(payload, dict):
+        raise InvalidPage('Invalid cursor')
+    position, reverse = payload.get('p'), payload.get('r')
+    if not isinstance(position, list) or not isinstance(reverse, bool):
+        raise InvalidPage('Invalid cursor')
+    if not all(isinstance(value, (str, int, float)) for value in position):
+        raise InvalidPage('Invalid cursor')
+    return position, reverse
+
+
+class KeysetPage:
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<Keyset page of {len(self.object_list)} items>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Seek pagination over a stable, unique ordering such as ('id',) or ('-created', '-id').
+
+    Each page is a single indexed range scan with no OFFSET and no COUNT(*). The object list
+    may also be an ascending list of primary keys, which is then paginated in memory.
+    """
+    keyset = True
+
+    def __init__(self, object_list, per_page, ordering=('id',)):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+
+    def page(self, cursor=None):
+        position, reverse = decode_cursor(cursor) if cursor else (None, False)
+        if position is not None:
+            position = self._parse_position(position)
+
+        if isinstance(self.object_list, QuerySet):
+            rows, has_more = self._seek_queryset(position, reverse)
+        else:
+            rows, has_more = self._seek_sequence(position, reverse)
+
+        if reverse:
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        next_cursor = encode_cursor(self._position(rows[-1])) if rows and has_next else None
+        previous_cursor = encode_cursor(self._position(rows[0]), reverse=True) if rows and has_previous else None
+        return KeysetPage(rows, self, next_cursor, previous_cursor)
+
+    def _parse_position(self, position):
+        """``position`` with every value converted to its ordering field's type."""
+        if len(position) != len(self.fields):
+            raise InvalidPage('Invalid cursor')
+        try:
+            if isinstance(self.object_list, QuerySet):
+                opts = self.object_list.model._meta
+                return [opts.get_field(name).to_python(value) for (name, _), value in zip(self.fields, position)]
+            # A sequence of primary keys.
+            return [int(position[0])]
+        except (TypeError, ValueError, ValidationError):
+            raise InvalidPage('Invalid cursor')
+
+    def _position(self, obj):
+        if isinstance(self.object_list, QuerySet):
+            return [getattr(obj, field) for field, _ in self.fields]
+        return [obj]
+
+    def _seek_queryset(self, position, reverse):
+        ordering = [f'-{field}' if descending != reverse else field for field, descending in self.fields]
+        queryset = self.object_list.order_by(*ordering)
+        if position is not None:
+            condition = Q()
+            for index, (field, descending) in enumerate(self.fields):
+                lookup = 'lt' if descending != reverse else 'gt'
+                equal = {name: position[i] for i, (name, _) in enumerate(self.fields[:index])}
+                condition |= Q(**equal, **{f'{field}__{lookup}': position[index]})
+            queryset = queryset.filter(condition)
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+        return rows, has_more
+
+    def _seek_sequence(self, position, reverse):
+        items = self.object_list
+        if reverse:
+            end = bisect_left(items, position[0])
+            start = max(end - self.per_page, 0)
+            return list(items[start:end]), start > 0
+
+        start = bisect_right(items, position[0]) if position is not None else 0
+        return list(items[start:start + self.per_page]), start + self.per_page < len(items)
+
+
+class KeysetPaginationMixin:
+    """
+    ListView mixin paginating by ``?cursor=``. Requests carrying the view's ``page_kwarg``
+    (``/page/<int:page>/`` or ``?page=``) keep the classic offset pagination.
+    """
+    keyset_ordering = ('id',)
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.page_kwarg in self.kwargs or self.page_kwarg in self.request.GET:
+            if isinstance(queryset, QuerySet):
+                queryset = queryset.order_by(*self.keyset_ordering)
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = KeysetPaginator(queryset, page_size, ordering=self.keyset_ordering)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidPage as e:
+            raise Http404(str(e))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+
+class KeysetPagination(BasePagination):
+    """
+    Default API pagination: opaque ``?cursor=`` links over the view's ``keyset_ordering``.
+    Sending ``?offset=`` opts into LimitOffsetPagination for clients that still need it.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    offset_query_param = 'offset'
+    ordering = ('id',)
+    offset_pagination_class = LimitOffsetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.offset_paginator = None
+        if self.offset_query_param in request.query_params:
+            self.offset_paginator = self.offset_pagination_class()
+            return self.offset_paginator.paginate_queryset(queryset, request, view)
+
+        ordering = getattr(view, 'keyset_ordering', self.ordering)
+        paginator = KeysetPaginator(queryset, self.page_size, ordering=ordering)
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidPage:
+            raise NotFound('Invalid cursor')
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        if self.offset_paginator is not None:
+            return self.offset_paginator.get_paginated_response(data)
+        return Response({
+            'next': self._get_link(self.page.next_cursor),
+            'previous': self._get_link(self.page.previous_cursor),
+            'results': data,
+        })
+
+    def _get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(remove_query_param(url, self.offset_query_param), self.cursor_query_param, cursor)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Opaque pagination cursor taken from the next/previous links.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.offset_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Opt into offset pagination (with limit) instead of cursors.',
+                'schema': {'type': 'integer'},
+            },
+        ]
@@ -0,0 +1,102 @@
+"""
+Stripe calls behind a small interface, so the catalog syncer (products.stripe_sync) and
+checkout sessions (orders.payments) can run against the real API or, in tests and benchmarks,
+against FakeStripeClient. The client in use is settings.STRIPE_CLIENT.
+"""
+import functools
+import itertools
+import threading
+import time
+
+import stripe
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+# Each thread keeps one keep-alive session to Stripe; without a timeout a slow Stripe holds a
+# web worker for the library's default of 80 seconds.
+stripe.default_http_client = stripe.http_client.RequestsClient(
+    timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+)
+stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+
+
+class StripeClient:
+    def create_product(self, name):
+        return stripe.Product.create(name=name)['id']
+
+    def create_price(self, product_id, unit_amount, currency):
+        return stripe.Price.create(product=product_id, unit_amount=unit_amount, currency=currency)['id']
+
+    def create_checkout_session(self, **params):
+        session = stripe.checkout.Session.create(**params)
+        return {'id': session.id, 'url': session.url}
+
+    def expire_checkout_session(self, session_id):
+        stripe.checkout.Session.expire(session_id)
+
+    def retrieve_checkout_session(self, session_id):
+        session = stripe.checkout.Session.retrieve(session_id)
+        return {'id': session.id, 'url': session.url, 'status': session.status}
+
+
+class FakeStripeClient:
+    """In-memory Stripe; ``latency`` seconds are slept per call to stand in for the network."""
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.products = {}
+        self.prices = {}
+        self.sessions = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create_product(self, name):
+        return self._create('prod', self.products, {'name': name})
+
+    def create_price(self, product_id, unit_amount, currency):
+        if product_id not in self.products:
+            raise stripe.error.InvalidRequestError(f'No such product: {product_id}', 'product')
+        return self._create('price', self.prices, {
+            'product': product_id, 'unit_amount': unit_amount, 'currency': currency,
+        })
+
+    def create_checkout_session(self, **params):
+        session_id = self._create('cs', self.sessions, {'status': 'open', **params})
+        return {'id': session_id, 'url': f'https://checkout.stripe.com/c/pay/{session_id}'}
+
+    def expire_checkout_session(self, session_id):
+        time.sleep(self.latency)
+        with self._lock:
+            session = self._session(session_id)
+            if session['status'] != 'open':
+                raise stripe.error.InvalidRequestError(f'Only open sessions can be expired: {session_id}', None)
+            session['status'] = 'expired'
+
+    def retrieve_checkout_session(self, session_id):
+        time.sleep(self.latency)
+        with self._lock:
+            session = self._session(session_id)
+        return {'id': session_id, 'url': f'https://checkout.stripe.com/c/pay/{session_id}', 'status': session['status']}
+
+    def _session(self, session_id):
+        if session_id not in self.sessions:
+            raise stripe.error.InvalidRequestError(f'No such checkout session: {session_id}', 'id')
+        return self.sessions[session_id]
+
+    def _create(self, prefix, objects, fields):
+        time.sleep(self.latency)
+        with self._lock:
+            object_id = f'{prefix}_fake{next(self._ids)}'
+            objects[object_id] = fields
+        return object_id
+
+
+def get_stripe_client():
+    return _get_client(settings.STRIPE_CLIENT)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_client(path):
+    # One client per process, so a FakeStripeClient keeps its objects from call to call like Stripe.
+    return import_string(path)()
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+def caches_for_tests():
+    """CACHES with each cache's "TEST" entry applied, as DATABASES does for test databases."""
+    caches = {}
+    for alias, params in settings.CACHES.items():
+        test = params.get('TEST', {})
+        caches[alias] = {
+            **params, **test,
+            'OPTIONS': {**params.get('OPTIONS', {}), **test.get('OPTIONS', {})},
+        }
+    return caches
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests against the test caches, which they flush between tests with cache.clear(),
+    instead of the Redis database the site's caches and baskets live in.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._test_caches = override_settings(CACHES=caches_for_tests())
+        self._test_caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_caches.disable()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,50 @@
+"""
+Checkout: turning a user's basket into an order.
+
+The whole checkout is one transaction: one read of the basket rows with their products, one
+insert of the order, one bulk insert of its items, one delete of the checked-out basket rows
+and the stock reservation, a conditional decrement per product (see orders.reservations).
+"""
+from django.db import transaction
+
+from orders import reservations
+from orders.models import Order, OrderItem
+from products.baskets import BasketList, get_basket_store
+from products.models import Basket
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def checkout(user, **order_fields):
+    """
+    Create an order of ``user``'s basket and empty it. Returns the order and the checked-out
+    baskets, with their products, as a BasketList. Raises CheckoutError when the basket is
+    empty or a product is out of stock.
+    """
+    store = get_basket_store()
+    store.flush(user)
+    with transaction.atomic():
+        baskets = BasketList(
+            Basket.objects.filter(user=user).select_related('product').select_for_update(of=('self',))
+        )
+        if not baskets:
+            raise CheckoutError('No items in basket to order')
+
+        order = Order.objects.create(initiator=user, total_sum=baskets.total_sum(), **order_fields)
+        try:
+            reservations.reserve(order, {basket.product_id: basket.quantity for basket in baskets})
+        except reservations.OutOfStockError as error:
+            name = next(basket.product.name for basket in baskets if basket.product_id == error.product_id)
+            raise CheckoutError(f'Not enough stock: {name}') from error
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=basket.product, product_name=basket.product.name,
+                      quantity=basket.quantity, price=basket.product.price)
+            for basket in baskets
+        ])
+        Basket.objects.filter(id__in=[basket.id for basket in baskets]).delete()
+    # Not discard(), which would flush the checked-out products back should the basket have
+    # changed since the flush above.
+    store.consume(user, {basket.product_id: basket.quantity for basket in baskets})
+    return order, baskets
@@ -0,0 +1,116 @@
+"""
+Stripe webhook events.
+
+The webhook view only verifies an event and stores it as a StripeEvent keyed by the Stripe
+event id, so a redelivered event is stored once and Stripe gets its 200 at once. The
+events are then handled in batches by orders.tasks.process_stripe_events; an event is
+marked processed in the transaction that handles it, so it is handled exactly once.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from orders import reservations
+from orders.models import Order, OrderStatus, StripeEvent
+
+logger = logging.getLogger(__name__)
+
+
+def record(payload):
+    """Store a verified event payload; a redelivered event is ignored."""
+    event = json.loads(payload)
+    StripeEvent.objects.bulk_create(
+        [StripeEvent(id=event['id'], type=event['type'], payload=event)], ignore_conflicts=True,
+    )
+
+
+def process_pending(batch_size=None):
+    """Handle stored events in batches until none are left; returns how many were handled."""
+    batch_size = batch_size or settings.STRIPE_EVENT_BATCH_SIZE
+    pending = StripeEvent.objects.filter(processed_at__isnull=True, attempts__lt=settings.STRIPE_EVENT_MAX_ATTEMPTS)
+    handled, failures = 0, set()
+    while True:
+        with transaction.atomic():
+            # Concurrent workers skip each other's batches instead of waiting on them.
+            batch = pending.exclude(id__in=failures).select_for_update(skip_locked=True).order_by('received_at')
+            events = list(batch[:batch_size])
+            if not events:
+                return handled
+            processed, failed = _handle_batch(events)
+            StripeEvent.objects.filter(id__in=processed).update(processed_at=timezone.now())
+            for event_id, error in failed.items():
+                StripeEvent.objects.filter(id=event_id).update(attempts=F('attempts') + 1, last_error=error)
+            # Failed events are retried by the next run, not this one.
+            failures.update(failed)
+            handled += len(processed)
+
+
+def _handle_batch(events):
+    processed, failed, order_ids = [], {}, {}
+    for event in events:
+        try:
+            order_ids[event.id] = _order_id(event)
+        except (KeyError, TypeError, ValueError) as error:
+            logger.exception('Could not read the order of Stripe event %s', event.id)
+            failed[event.id] = repr(error)
+    # Locked, as reservations.cancel locks them, so a payment cannot interleave with a cancel of the
+    # same order; in id order, so concurrent batches cannot deadlock.
+    orders = Order.objects.select_for_update().in_bulk(sorted(filter(None, order_ids.values())))
+
+    for event in events:
+        if event.id in failed:
+            continue
+        handler = HANDLERS.get(event.type)
+        order = orders.get(order_ids[event.id])
+        try:
+            # A savepoint per event, so one failure does not undo the rest of the batch.
+            with transaction.atomic():
+                if handler is not None and order is not None:
+                    handler(order)
+        except Exception as error:
+            logger.exception('Could not handle Stripe event %s', event.id)
+            failed[event.id] = repr(error)
+        else:
+            processed.append(event.id)
+    return processed, failed
+
+
+def _order_id(event):
+    order_id = (event.payload['data']['object'].get('metadata') or {}).get('order_id')
+    return int(order_id) if order_id else None
+
+
+def _session_completed(order):
+    if order.status == OrderStatus.CREATED:
+        order.update_after_payment()
+    elif order.status == OrderStatus.CANCELED:
+        # Paid after its reservation was released; the stock has to be checked by hand.
+        logger.warning('Order %s was paid after it had been canceled', order.id)
+
+
+def _session_expired(order):
+    reservations.cancel(order)
+
+
+HANDLERS = {
+    'checkout.session.completed': _session_completed,
+    'checkout.session.expired': _session_expired,
+}
+
+
+def sign_payload(payload, secret=None, timestamp=None):
+    """
+    The Stripe-Signature header Stripe would send with ``payload`` (str), so tests and
+    benchmarks can post webhook events without Stripe.
+    """
+    secret = secret or settings.STRIPE_WEBHOOK_SECRET
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
@@ -0,0 +1,56 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from orders.checkout import checkout
+from products.models import Basket, Product, ProductCategory
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Measure checkout latency and statement count for baskets of 1, 10 and 100 line items.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        sizes, repeat = options['sizes'], options['repeat']
+
+        # Everything runs in a transaction that is rolled back, so seeded rows never persist.
+        with transaction.atomic():
+            user = User.objects.create_user(username='benchmark-checkout')
+            # Enough stock that nothing sells out, which would add facet updates to the last run.
+            products = self._seed(max(sizes), stock=repeat * len(sizes) + 2)
+            # The first order also creates the user's stats row, keep it out of the timings.
+            self._checkout(user, products[:1])
+
+            for size in sizes:
+                timings, statements = [], 0
+                for _ in range(repeat):
+                    elapsed, statements = self._checkout(user, products[:size])
+                    timings.append(elapsed)
+                self.stdout.write(f'{size:>4} items: {statistics.median(timings):8.3f} ms | {statements} statements')
+
+            transaction.set_rollback(True)
+
+    def _seed(self, size, stock):
+        category, _ = ProductCategory.objects.get_or_create(name='Benchmark')
+        return Product.objects.bulk_create(
+            Product(name=f'Benchmark product {i}', price=100, quantity=stock, category=category,
+                    stripe_product_price_id='price_benchmark') for i in range(size)
+        )
+
+    @staticmethod
+    def _checkout(user, products):
+        Basket.objects.bulk_create(Basket(user=user, product=product, quantity=1) for product in products)
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            checkout(user, first_name='Benchmark', last_name='Benchmark', email='benchmark@example.com',
+                     address='Benchmark')
+            elapsed = (time.perf_counter() - start) * 1000
+        statements = [query for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        return elapsed, len(statements)
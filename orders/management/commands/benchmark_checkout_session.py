@@ -0,0 +1,76 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from common.stripe_client import FakeStripeClient
+from orders.models import Order, OrderItem, StockReservation
+from orders.payments import checkout_session_url
+from products.models import Product, ProductCategory
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Measure creating and reusing Stripe Checkout sessions for orders of 1, 10 and 100 items, '
+            'against a fake Stripe with the given latency.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100])
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--latency', type=float, default=300, help='Milliseconds per Stripe call.')
+
+    def handle(self, *args, **options):
+        client = FakeStripeClient(latency=options['latency'] / 1000)
+
+        # Everything runs in a transaction that is rolled back, so seeded rows never persist.
+        with transaction.atomic():
+            user = User.objects.create_user(username='benchmark-checkout-session')
+            category, _ = ProductCategory.objects.get_or_create(name='Benchmark')
+            products = Product.objects.bulk_create(
+                Product(name=f'Benchmark product {i}', price=100, quantity=1, category=category)
+                for i in range(max(options['sizes']))
+            )
+
+            for size in options['sizes']:
+                created, reused = [], []
+                for _ in range(options['repeat']):
+                    order = self._order(user, products[:size])
+                    created.append(self._measure(order, client))
+                    reused.append(self._measure(order, client))
+                self.stdout.write(self._row(size, 'new', created))
+                self.stdout.write(self._row(size, 'reused', reused))
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _order(user, products):
+        order = Order.objects.create(initiator=user, first_name='Benchmark', last_name='Benchmark',
+                                     email='benchmark@example.com', address='Benchmark', total_sum=100 * len(products))
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, product_name=product.name, price=product.price)
+            for product in products
+        )
+        # Only orders still holding their stock can be paid.
+        StockReservation.objects.bulk_create(
+            StockReservation(order=order, product=product, quantity=1, expires_at=timezone.now())
+            for product in products
+        )
+        return order
+
+    @staticmethod
+    def _measure(order, client):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            checkout_session_url(order, client)
+            elapsed = (time.perf_counter() - start) * 1000
+        statements = [query for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        return elapsed, len(statements)
+
+    @staticmethod
+    def _row(size, kind, measurements):
+        timings = [elapsed for elapsed, _ in measurements]
+        return (f'{size:>4} items, {kind:>6} session: {statistics.median(timings):8.3f} ms | '
+                f'{measurements[-1][1]} statements')
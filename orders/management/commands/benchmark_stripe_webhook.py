@@ -0,0 +1,65 @@
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+
+from orders import events
+from orders.models import Order
+from orders.views import stripe_webhook_view
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Measure Stripe webhook throughput with locally signed checkout.session.completed events.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=1000)
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        count = options['events']
+        factory = RequestFactory()
+
+        # Everything runs in a transaction that is rolled back, so seeded rows never persist. It also
+        # keeps the view's on_commit enqueue from running, so ingestion and processing are timed apart.
+        with transaction.atomic():
+            user = User.objects.create_user(username='benchmark-webhook')
+            orders = Order.objects.bulk_create(
+                Order(initiator=user, first_name='Benchmark', last_name='Benchmark', email='benchmark@example.com',
+                      address='Benchmark', total_sum=100) for _ in range(count)
+            )
+            payloads = [self._payload(order) for order in orders]
+            # Every event is delivered twice, as Stripe may do.
+            deliveries = [(payload, events.sign_payload(payload)) for payload in payloads + payloads]
+
+            requests = [
+                factory.post('/webhook/stripe/', data=payload, content_type='application/json',
+                             HTTP_STRIPE_SIGNATURE=signature)
+                for payload, signature in deliveries
+            ]
+            start = time.perf_counter()
+            for request in requests:
+                if stripe_webhook_view(request).status_code != 200:
+                    raise CommandError('The webhook rejected a locally signed event, check STRIPE_WEBHOOK_SECRET')
+            self._report('received', len(deliveries), time.perf_counter() - start)
+
+            start = time.perf_counter()
+            handled = events.process_pending(options['batch_size'])
+            self._report('processed', handled, time.perf_counter() - start)
+
+            transaction.set_rollback(True)
+
+    def _report(self, action, count, elapsed):
+        self.stdout.write(f'{action:>9}: {count} events in {elapsed:.3f} s | {count / elapsed:8.1f} events/s')
+
+    @staticmethod
+    def _payload(order):
+        return json.dumps({
+            'id': f'evt_{uuid.uuid4().hex}',
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'data': {'object': {'object': 'checkout.session', 'metadata': {'order_id': str(order.id)}}},
+        })
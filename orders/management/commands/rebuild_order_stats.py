@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from orders import stats
+from orders.models import UserOrderStats
+
+
+class Command(BaseCommand):
+    help = 'Recount per-user order statistics (order counts by status and total spent) from scratch.'
+
+    def handle(self, *args, **options):
+        stats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt order statistics of {UserOrderStats.objects.count()} users.'))
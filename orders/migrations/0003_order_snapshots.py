@@ -0,0 +1,64 @@
+# Generated by Django 4.2.20 on 2026-10-18 18:17
+
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_basket_history(apps, schema_editor):
+    # Turn the stored basket_history JSON into OrderItem rows; it never recorded product ids.
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    for order in Order.objects.exclude(basket_history={}).iterator():
+        items = [
+            OrderItem(order=order, product_name=item['product_name'], quantity=item['quantity'],
+                      price=Decimal(str(item['price'])))
+            for item in order.basket_history.get('purchased_items', [])
+        ]
+        OrderItem.objects.bulk_create(items)
+        order.total_sum = sum((item.price * item.quantity for item in items), Decimal(0))
+        order.save(update_fields=['total_sum'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_basket_created_idx'),
+        ('orders', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_name', models.CharField(max_length=256)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items',
+                                            to='orders.order')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                              to='products.product')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_sum',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(copy_basket_history, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='order',
+            name='basket_history',
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.SmallIntegerField(choices=[(0, 'Created'), (1, 'Paid'), (2, 'On way'), (3, 'Delivered'), (4, 'Canceled')], default=0),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['initiator', '-created', '-id'], name='order_initiator_created_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.20 on 2026-10-18 18:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def rebuild_order_stats(apps, schema_editor):
+    from orders import stats
+
+    stats.rebuild(apps.get_model('orders', 'Order'), apps.get_model('orders', 'UserOrderStats'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('orders', '0003_order_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserOrderStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='order_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_orders', models.IntegerField(default=0)),
+                ('total_spent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('created_orders', models.IntegerField(default=0)),
+                ('paid_orders', models.IntegerField(default=0)),
+                ('on_way_orders', models.IntegerField(default=0)),
+                ('delivered_orders', models.IntegerField(default=0)),
+                ('canceled_orders', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(rebuild_order_stats, migrations.RunPython.noop),
+    ]
@@ -1,62 +1,128 @@
-from products.models import Basket
-from users.models import User
+from django.db import models, transaction
 
+from common.models import StoredValuesMixin
 
-from enum import Enum
-from django.db import models
-from django.utils.functional import cached_property
 
-class OrderStatus(Enum):
-    CREATED = 0
-    PAID = 1
-    ON_WAY = 2
-    DELIVERED = 3
-    CANCELED = 4
+class OrderStatus(models.IntegerChoices):
+    CREATED = 0, 'Created'
+    PAID = 1, 'Paid'
+    ON_WAY = 2, 'On way'
+    DELIVERED = 3, 'Delivered'
+    CANCELED = 4, 'Canceled'
 
-    @classmethod
-    def choices(cls):
-        return [(status.value, status.name) for status in cls]
 
-class Order(models.Model):
+class ReservationStatus(models.IntegerChoices):
+    ACTIVE = 0, 'Active'
+    CONFIRMED = 1, 'Confirmed'
+    RELEASED = 2, 'Released'
+
+
+class Order(StoredValuesMixin, models.Model):
     first_name = models.CharField(max_length=64)
     last_name = models.CharField(max_length=64)
     email = models.EmailField(max_length=128)
     address = models.CharField(max_length=256)
-    basket_history = models.JSONField(default=dict)
+    # Sum of the order's items, denormalized so listing orders needs no join.
+    total_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created = models.DateTimeField(auto_now_add=True)
-    status = models.SmallIntegerField(choices=OrderStatus.choices(), default=OrderStatus.CREATED)
+    status = models.SmallIntegerField(choices=OrderStatus.choices, default=OrderStatus.CREATED)
     initiator = models.ForeignKey(to='users.User', on_delete=models.CASCADE)
+    stripe_session_id = models.CharField(max_length=256, blank=True)
+    # The pending Stripe Checkout session, reused while it is open (see orders.payments).
+    stripe_session_url = models.TextField(blank=True)
+    stripe_session_expires_at = models.DateTimeField(null=True, blank=True)
+
+    # What the order contributes to its initiator's stats, see orders.signals.
+    tracked_fields = ('status', 'total_sum')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=('initiator', '-created', '-id'), name='order_initiator_created_idx'),
+        ]
 
     def __str__(self):
         return f'Order #{self.id}. {self.first_name} {self.last_name}'
 
-    @cached_property
-    def basket_history(self):
-        baskets = Basket.objects.filter(user=self.initiator)
-        return {
-            'purchased_items': [basket.de_json() for basket in baskets],
-            'total_sum': float(baskets.total_sum()),
-        }
-
-    def update_after_payment(self):
-        self.status = OrderStatus.PAID
-        self.save()
+    def save(self, *args, **kwargs):
+        # UserOrderStats are adjusted by orders.signals in the same transaction.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
-        baskets = Basket.objects.filter(user=self.initiator)
-        self.basket_history = {
-            'purchased_items': [basket.de_json() for basket in baskets],
-            'total_sum': float(baskets.total_sum()),
-        }
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
 
-        baskets.update(is_purchased=True)
-        self.save()
+    def update_after_payment(self):
+        # The basket was already emptied at checkout (see orders.checkout).
+        with transaction.atomic():
+            self.status = OrderStatus.PAID
+            self.save(update_fields=['status'])
+            self.reservations.filter(status=ReservationStatus.ACTIVE).update(status=ReservationStatus.CONFIRMED)
 
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
-    product = models.ForeignKey('products.Product', on_delete=models.CASCADE)
+    # Kept when the product is deleted, product_name and price describe the item on their own.
+    product = models.ForeignKey('products.Product', on_delete=models.SET_NULL, null=True, blank=True)
+    product_name = models.CharField(max_length=256)
     quantity = models.PositiveIntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
     def __str__(self):
-        return f'{self.quantity} x {self.product.name} for order #{self.order.id}'
\ No newline at end of file
+        return f'{self.quantity} x {self.product_name} for order #{self.order_id}'
+
+    def sum(self):
+        return self.price * self.quantity
+
+
+class StockReservation(models.Model):
+    """Stock taken off a product for an unpaid order, managed by orders.reservations."""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey('products.Product', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    status = models.SmallIntegerField(choices=ReservationStatus.choices, default=ReservationStatus.ACTIVE)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=('status', 'expires_at'), name='reservation_status_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'Резерв: {self.quantity} x {self.product_id} для заказа #{self.order_id}'
+
+
+class UserOrderStats(models.Model):
+    """A user's order counters, maintained by orders.stats on every order write."""
+    user = models.OneToOneField(to='users.User', on_delete=models.CASCADE, primary_key=True,
+                                related_name='order_stats')
+    total_orders = models.IntegerField(default=0)
+    total_spent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    created_orders = models.IntegerField(default=0)
+    paid_orders = models.IntegerField(default=0)
+    on_way_orders = models.IntegerField(default=0)
+    delivered_orders = models.IntegerField(default=0)
+    canceled_orders = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f'Статистика заказов: {self.user_id}'
+
+
+class StripeEvent(models.Model):
+    """A verified Stripe webhook event, stored on receipt and handled by orders.events."""
+    id = models.CharField(max_length=255, primary_key=True)
+    type = models.CharField(max_length=128)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=('received_at',), condition=models.Q(processed_at__isnull=True),
+                         name='stripe_event_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.type} {self.id}'
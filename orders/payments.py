@@ -0,0 +1,132 @@
+"""
+Stripe Checkout sessions for paying orders.
+
+The line items come from the order's items and their products in one query, priced as the
+items were ordered. The session is saved on the order, and while it is open, paying the order
+again (a retried request, the pay button of an unpaid order) redirects to it instead of making
+the web worker wait on Stripe for another. Only one session of an order is ever payable: one
+made while another request stored its own, or the order was canceled, is expired again. Stripe
+calls go through common.stripe_client, with pooled connections and timeouts.
+"""
+import logging
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from common.stripe_client import get_stripe_client
+from orders import reservations
+from orders.models import Order, OrderStatus
+from products.models import STRIPE_CURRENCY
+
+logger = logging.getLogger(__name__)
+
+# A session closer than this (seconds) to expiring is not worth sending the customer to.
+SESSION_MIN_LIFETIME = 5 * 60
+# Stripe takes an expires_at 30 minutes to 24 hours after the session is created; the margins
+# cover rounding down to whole seconds and the time the request takes.
+SESSION_LIFETIME_RANGE = (30 * 60 + 60, 24 * 60 * 60 - 60)
+
+SESSION_FIELDS = ['stripe_session_id', 'stripe_session_url', 'stripe_session_expires_at']
+
+
+class PaymentError(Exception):
+    pass
+
+
+def line_items(order):
+    return [
+        {**_price(item), 'quantity': item.quantity}
+        for item in order.items.select_related('product').order_by('id')
+    ]
+
+
+def _price(item):
+    product = item.product
+    if product is not None and product.stripe_product_price_id and product.stripe_synced_price == item.price:
+        return {'price': product.stripe_product_price_id}
+    return {'price_data': {
+        'currency': STRIPE_CURRENCY,
+        'unit_amount': round(item.price * 100),
+        'product_data': {'name': item.product_name},
+    }}
+
+
+def checkout_session_url(order, client=None):
+    """
+    URL of a Stripe Checkout session paying ``order``; its open session if it has one. Raises
+    PaymentError when the order cannot be paid anymore.
+    """
+    now = timezone.now()
+    if order.stripe_session_url and order.stripe_session_expires_at > now + timedelta(seconds=SESSION_MIN_LIFETIME):
+        return order.stripe_session_url
+
+    client = client or get_stripe_client()
+    replaced = order.stripe_session_id
+    low, high = SESSION_LIFETIME_RANGE
+    expires_at = now + timedelta(seconds=min(max(settings.STOCK_RESERVATION_TIMEOUT, low), high))
+    # A session must not be payable after the stock is given back, so the reservation is held for
+    # as long as the session is open, which Stripe's minimum can make longer than it was.
+    with transaction.atomic():
+        if not Order.objects.select_for_update().filter(pk=order.pk, status=OrderStatus.CREATED).exists():
+            raise PaymentError(f'Order {order.id} is not awaiting payment')
+        if not reservations.hold(order, expires_at):
+            raise PaymentError(f'Order {order.id} no longer holds its stock')
+    session = client.create_checkout_session(
+        line_items=line_items(order),
+        metadata={'order_id': order.id},
+        mode='payment',
+        expires_at=int(expires_at.timestamp()),
+        success_url='{}{}'.format(settings.DOMAIN_NAME, reverse('orders:order_success')),
+        cancel_url='{}{}?order_id={}'.format(settings.DOMAIN_NAME, reverse('orders:order_canceled'), order.id),
+    )
+
+    # The order was not locked during the Stripe call: it may have been canceled since, or another
+    # request (the pay button in a second tab) may have stored a session of its own.
+    try:
+        with transaction.atomic():
+            current = Order.objects.select_for_update().get(pk=order.pk)
+            if current.status != OrderStatus.CREATED:
+                raise PaymentError(f'Order {order.id} is not awaiting payment')
+            if current.stripe_session_id != replaced:
+                _discard_session(client, session['id'])
+                for field in SESSION_FIELDS:
+                    setattr(order, field, getattr(current, field))
+                return order.stripe_session_url
+            # Only one session of an order may be payable; one already completed is being paid for.
+            if not expire_checkout_session(current, client):
+                raise PaymentError(f'Order {order.id} is being paid for')
+            order.stripe_session_id, order.stripe_session_url = session['id'], session['url']
+            order.stripe_session_expires_at = expires_at
+            order.save(update_fields=SESSION_FIELDS)
+    except (PaymentError, stripe.error.StripeError):
+        _discard_session(client, session['id'])
+        raise
+    return order.stripe_session_url
+
+
+def _discard_session(client, session_id):
+    """Expire a session that was never stored on its order, so it cannot be paid."""
+    try:
+        client.expire_checkout_session(session_id)
+    except stripe.error.StripeError:
+        logger.exception('Could not expire unused checkout session %s', session_id)
+
+
+def expire_checkout_session(order, client=None):
+    """
+    Expire ``order``'s Stripe session so it can no longer be paid. Returns False when the
+    session was already completed, the order is being paid for.
+    """
+    if not order.stripe_session_id:
+        return True
+    client = client or get_stripe_client()
+    try:
+        client.expire_checkout_session(order.stripe_session_id)
+    except stripe.error.InvalidRequestError:
+        # Only sessions still open can be expired.
+        return client.retrieve_checkout_session(order.stripe_session_id)['status'] != 'complete'
+    return True
@@ -0,0 +1,128 @@
+"""
+Stock reservations: stock taken off products for an order until it is paid.
+
+Checkout reserves each line with a conditional ``UPDATE ... SET quantity = quantity - n
+WHERE quantity >= n``, one product at a time in product id order. Concurrent checkouts only
+wait on the product rows they share and always lock them in the same order, so they cannot
+deadlock, and no checkout can take more than is in stock. A reservation is confirmed when
+its order is paid (Order.update_after_payment) and released, giving the stock back, when
+the order's Stripe session expires or is canceled (see orders.tasks).
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from orders import payments
+from orders.models import Order, OrderStatus, ReservationStatus, StockReservation
+from products import catalog, facets
+from products.models import Product
+
+logger = logging.getLogger(__name__)
+
+
+class OutOfStockError(Exception):
+    def __init__(self, product_id):
+        super().__init__(f'Product {product_id} is out of stock')
+        self.product_id = product_id
+
+
+def reserve(order, quantities):
+    """
+    Take ``{product_id: quantity}`` off stock for ``order``. Must run in the transaction that
+    creates the order, so an OutOfStockError rolls back the lines already reserved.
+    """
+    now = timezone.now()
+    for product_id, quantity in sorted(quantities.items()):
+        reserved = Product.objects.filter(id=product_id, quantity__gte=quantity).update(
+            quantity=F('quantity') - quantity, updated_at=now,
+        )
+        if not reserved:
+            raise OutOfStockError(product_id)
+    StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity,
+                         expires_at=now + timedelta(seconds=settings.STOCK_RESERVATION_TIMEOUT))
+        for product_id, quantity in quantities.items()
+    ])
+    _stock_changed({product_id: -quantity for product_id, quantity in quantities.items()})
+
+
+def hold(order, until):
+    """Keep ``order``'s active reservations until ``until``; returns how many there are."""
+    return order.reservations.filter(status=ReservationStatus.ACTIVE).update(expires_at=until)
+
+
+def release(reservations):
+    """Give the stock of the active ``reservations`` back and mark them released."""
+    with transaction.atomic():
+        # Locking the reservations makes a second release of the same rows find nothing to do.
+        reservations = list(reservations.filter(status=ReservationStatus.ACTIVE).select_for_update())
+        quantities = defaultdict(int)
+        for reservation in reservations:
+            quantities[reservation.product_id] += reservation.quantity
+        now = timezone.now()
+        for product_id, quantity in sorted(quantities.items()):
+            Product.objects.filter(id=product_id).update(quantity=F('quantity') + quantity, updated_at=now)
+        StockReservation.objects.filter(id__in=[reservation.id for reservation in reservations]).update(
+            status=ReservationStatus.RELEASED,
+        )
+        _stock_changed(quantities)
+
+
+def cancel(order):
+    """Release ``order``'s reservations and cancel it, unless it is no longer awaiting payment."""
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(pk=order.pk)
+        if order.status != OrderStatus.CREATED:
+            return False
+        release(order.reservations.all())
+        order.status = OrderStatus.CANCELED
+        order.save(update_fields=['status'])
+    return True
+
+
+def release_expired(grace=0, limit=500):
+    """
+    Cancel up to ``limit`` unpaid orders whose reservations expired more than ``grace``
+    seconds ago, expiring their Stripe sessions first. Returns the number of orders canceled.
+    """
+    expired = StockReservation.objects.filter(
+        status=ReservationStatus.ACTIVE, expires_at__lt=timezone.now() - timedelta(seconds=grace),
+    ).values_list('order_id', flat=True).distinct()
+    canceled = 0
+    for order in Order.objects.filter(id__in=list(expired[:limit])):
+        # A session still open could be paid after the stock is given back and sold again.
+        try:
+            if not payments.expire_checkout_session(order):
+                continue
+        except stripe.error.StripeError:
+            logger.exception('Could not expire the checkout session of order %s', order.id)
+            continue
+        canceled += cancel(order)
+    return canceled
+
+
+def _stock_changed(deltas):
+    """
+    Do for ``{product_id: delta}`` stock changes what products.signals would for a save, short
+    of a new catalog version: stock moves on every checkout, and a version bump would throw away
+    every cached catalog page. Only the moved products' cached payloads are dropped, and the
+    facet counts when a product sold out or came back.
+    """
+    if not deltas:
+        return
+    facets_changed = False
+    # The rows are still locked by our updates, so these are the quantities we will commit.
+    for product in Product.objects.filter(id__in=deltas).only('id', 'category_id', 'price', 'quantity'):
+        new = facets.state(product)
+        product.quantity -= deltas[product.id]
+        old = facets.state(product)
+        facets.apply(old, new)
+        facets_changed |= old != new
+    product_ids = list(deltas)
+    transaction.on_commit(lambda: catalog.invalidate_stock(product_ids, facets=facets_changed))
@@ -1,16 +1,26 @@
 from rest_framework import serializers
-from products.serializers import BasketSerializer
+
+from orders.models import Order
+
+
+class OrderItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(read_only=True)
+    product_name = serializers.CharField(read_only=True)
+    quantity = serializers.IntegerField(read_only=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+
 
 class OrderSerializer(serializers.Serializer):
-    id = serializers.IntegerField()
+    id = serializers.IntegerField(read_only=True)
     first_name = serializers.CharField(max_length=64)
     last_name = serializers.CharField(max_length=64)
     email = serializers.EmailField()
     address = serializers.CharField(max_length=256)
-    basket_history = BasketSerializer(many=True, read_only=True)
-    status = serializers.IntegerField()
-    created = serializers.DateTimeField()
-    initiator = serializers.IntegerField()
+    items = OrderItemSerializer(many=True, read_only=True)
+    total_sum = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    status = serializers.IntegerField(read_only=True)
+    created = serializers.DateTimeField(read_only=True)
+    initiator = serializers.IntegerField(source='initiator_id', read_only=True)
 
     def validate_email(self, value):
         if not value or '@' not in value:
@@ -22,7 +32,11 @@ class OrderSerializer(serializers.Serializer):
             raise serializers.ValidationError("Address cannot be empty")
         return value
 
-    def validate_basket_history(self, value):
-        if not value or len(value) == 0:
-            raise serializers.ValidationError("Basket history must contain at least one item.")
-        return value
+    def create(self, validated_data):
+        return Order.objects.create(**validated_data)
+
+    def update(self, instance, validated_data):
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
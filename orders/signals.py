@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from orders import stats
+from orders.models import Order
+
+
+@receiver(pre_save, sender=Order)
+def remember_stats_state(sender, instance, **kwargs):
+    # What the row counts for now is what it was loaded or last saved with, the instance may
+    # already hold the new values. The row is only read for instances built by hand.
+    stored = instance.stored_copy()
+    if stored is None and instance.pk is not None:
+        row = Order.objects.filter(pk=instance.pk).values(*Order.tracked_fields).first()
+        stored = Order(**row) if row else None
+    instance._stats_state = stats.state(stored) if stored else None
+
+
+@receiver(post_save, sender=Order)
+def update_stats(sender, instance, **kwargs):
+    stats.apply(instance.initiator_id, getattr(instance, '_stats_state', None), stats.state(instance))
+
+
+@receiver(post_delete, sender=Order)
+def remove_from_stats(sender, instance, **kwargs):
+    stats.apply(instance.initiator_id, old=stats.state(instance.stored_copy() or instance))
@@ -0,0 +1,84 @@
+"""
+Per-user order statistics.
+
+UserOrderStats rows are adjusted with F() deltas whenever an order is saved or deleted (see
+orders.signals) and rebuilt from scratch by ``manage.py rebuild_order_stats``.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from orders.models import Order, OrderStatus, UserOrderStats
+
+
+def status_field(status):
+    return f'{OrderStatus(status).name.lower()}_orders'
+
+
+def state(order):
+    """What an order contributes to its initiator's stats: (status, total_sum)."""
+    return order.status, Decimal(order.total_sum)
+
+
+def apply(user_id, old=None, new=None):
+    """Move one order's contribution from ``old`` to ``new`` state; either may be None."""
+    if old == new:
+        return
+    changes = {}
+    for order_state, sign in ((old, -1), (new, 1)):
+        if order_state is None:
+            continue
+        status, total_sum = order_state
+        for field, delta in (('total_orders', sign), ('total_spent', sign * total_sum), (status_field(status), sign)):
+            changes[field] = changes.get(field, 0) + delta
+    changes = {field: delta for field, delta in changes.items() if delta}
+    if not changes:
+        return
+    if _adjust(user_id, changes):
+        return
+    # No row yet, count the user's orders as they are now, this one included.
+    row = next(iter(_count(Order.objects.filter(initiator_id=user_id))), {'initiator_id': user_id})
+    try:
+        with transaction.atomic():
+            UserOrderStats.objects.create(user_id=row.pop('initiator_id'), **row)
+    except IntegrityError:
+        # Created concurrently by a transaction that could not see this order, apply its delta.
+        _adjust(user_id, changes)
+
+
+def _adjust(user_id, changes):
+    return UserOrderStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta for field, delta in changes.items()},
+    )
+
+
+def _count(orders):
+    return orders.values('initiator_id').annotate(
+        total_orders=Count('id'),
+        total_spent=Coalesce(Sum('total_sum'), Value(Decimal(0))),
+        **{status_field(status): Count('id', filter=Q(status=status)) for status in OrderStatus},
+    ).order_by()
+
+
+def rebuild(order_model=Order, stats_model=UserOrderStats, user_ids=None):
+    """
+    Recount stats with a single aggregate query, for every user or only ``user_ids``;
+    migrations pass their historical models.
+    """
+    orders = order_model.objects.all()
+    stats = stats_model.objects.all()
+    if user_ids is not None:
+        orders = orders.filter(initiator_id__in=user_ids)
+        stats = stats.filter(user_id__in=user_ids)
+    rows = _count(orders)
+
+    with transaction.atomic():
+        stats.delete()
+        stats_model.objects.bulk_create([stats_model(user_id=row.pop('initiator_id'), **row) for row in rows])
+
+
+def get_stats(user):
+    """``user``'s UserOrderStats, unsaved and empty if they have no orders."""
+    return UserOrderStats.objects.filter(user=user).first() or UserOrderStats(user=user)
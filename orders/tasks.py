@@ -0,0 +1,30 @@
+from celery import shared_task
+from django.conf import settings
+
+from orders import events, payments, reservations
+from orders.models import Order, OrderStatus
+
+
+@shared_task(ignore_result=True)
+def release_order(order_id, expire_session=True):
+    """
+    Cancel an unpaid order and give its reserved stock back. Unless Stripe already expired it,
+    the order's checkout session is expired first, so it can no longer be paid.
+    """
+    order = Order.objects.filter(id=order_id, status=OrderStatus.CREATED).first()
+    if order is None:
+        return
+    if expire_session and not payments.expire_checkout_session(order):
+        return
+    reservations.cancel(order)
+
+
+@shared_task(ignore_result=True)
+def release_expired_reservations():
+    # Stripe sessions expire with their reservations; the grace leaves room for late payment webhooks.
+    reservations.release_expired(grace=settings.STOCK_RESERVATION_GRACE)
+
+
+@shared_task(ignore_result=True)
+def process_stripe_events():
+    events.process_pending()
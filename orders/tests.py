@@ -0,0 +1,582 @@
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from http import HTTPStatus
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from common.stripe_client import FakeStripeClient, get_stripe_client
+from orders import events, payments, reservations, stats
+from orders.checkout import CheckoutError, checkout
+from orders.models import Order, OrderStatus, ReservationStatus, StockReservation, StripeEvent, UserOrderStats
+from orders.tasks import release_order
+from products import catalog, facets
+from products.models import Basket, CategoryFacet, Product
+from users.models import User
+
+
+class OrderSnapshotTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='password')
+        for product_id, quantity in ((1, 2), (3, 1)):
+            Basket.objects.create(user=self.user, product_id=product_id, quantity=quantity)
+        self.order, _ = checkout(self.user, first_name='Ivan', last_name='Ivanov', email='ivan@example.com',
+                                 address='Moscow')
+        self.client.force_login(self.user)
+
+    def test_snapshot_survives_basket_and_product_changes(self):
+        expected = Order.objects.get(id=self.order.id).total_sum
+        Basket.objects.create(user=self.user, product_id=1, quantity=5)
+        Product.objects.filter(id=1).update(price=1, name='Renamed')
+
+        order = Order.objects.get(id=self.order.id)
+        self.assertEqual(order.total_sum, expected)
+        self.assertEqual(order.total_sum, sum(item.sum() for item in order.items.all()))
+        self.assertNotIn('Renamed', [item.product_name for item in order.items.all()])
+
+    def test_update_after_payment(self):
+        # Added after checkout, so not part of the paid order.
+        Basket.objects.create(user=self.user, product_id=4, quantity=1)
+
+        self.order.update_after_payment()
+
+        self.assertEqual(Order.objects.get(id=self.order.id).status, OrderStatus.PAID)
+        self.assertTrue(Basket.objects.filter(user=self.user, product_id=4).exists())
+        self.assertEqual(self.order.items.count(), 2)
+
+    def test_order_detail(self):
+        # Session, user, order and its items.
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('orders:order', kwargs={'pk': self.order.id}))
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        for item in self.order.items.all():
+            self.assertContains(response, item.product_name)
+
+    def test_order_detail_of_another_user(self):
+        self.client.force_login(User.objects.create_user(username='other'))
+        response = self.client.get(reverse('orders:order', kwargs={'pk': self.order.id}))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_order_list(self):
+        response = self.client.get(reverse('orders:orders_list'))
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(list(response.context['object_list']), [self.order])
+        self.assertContains(response, self.order.id)
+
+
+class CheckoutTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+    order_fields = {'first_name': 'Ivan', 'last_name': 'Ivanov', 'email': 'ivan@example.com', 'address': 'Moscow'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='password')
+
+    def fill_basket(self, product_ids, quantity=2):
+        Basket.objects.bulk_create([
+            Basket(user=self.user, product_id=product_id, quantity=quantity) for product_id in product_ids
+        ])
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            checkout(self.user, **self.order_fields)
+        return len([query for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))])
+
+    def test_checkout(self):
+        self.fill_basket([1, 3])
+
+        order, baskets = checkout(self.user, **self.order_fields)
+
+        self.assertEqual(order.total_sum, Decimal('18960.00'))
+        self.assertEqual(list(order.items.order_by('product_id').values_list('product_id', 'quantity', 'price')),
+                         [(1, 2, Decimal('6090.00')), (3, 2, Decimal('3390.00'))])
+        self.assertFalse(Basket.objects.filter(user=self.user).exists())
+        self.assertEqual(dict(Product.objects.filter(id__in=[1, 3]).values_list('id', 'quantity')), {1: 98, 3: 98})
+        self.assertEqual([item['quantity'] for item in payments.line_items(order)], [2, 2])
+
+    def test_statements_grow_only_by_stock_updates(self):
+        # The first order also creates the user's UserOrderStats row.
+        self.fill_basket([1])
+        self.count_queries()
+        self.fill_basket([1])
+        single = self.count_queries()
+        self.fill_basket([1, 2, 3, 4, 5, 6])
+
+        # One conditional stock update per product, everything else is set-based.
+        self.assertEqual(self.count_queries(), single + 5)
+
+    def test_empty_basket(self):
+        with self.assertRaises(CheckoutError):
+            checkout(self.user, **self.order_fields)
+        self.assertFalse(Order.objects.exists())
+
+    def test_out_of_stock(self):
+        self.fill_basket([1, 3])
+        Product.objects.filter(id=3).update(quantity=1)
+
+        with self.assertRaises(CheckoutError):
+            checkout(self.user, **self.order_fields)
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Basket.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(Product.objects.get(id=1).quantity, 100)
+
+    def test_sold_out_product_leaves_in_stock_facet(self):
+        facets.rebuild()
+        self.fill_basket([1], quantity=100)
+
+        checkout(self.user, **self.order_fields)
+
+        counts = CategoryFacet.objects.filter(product_count__gt=0).order_by('category_id', 'price_bucket').values_list(
+            'category_id', 'price_bucket', 'product_count', 'in_stock_count',
+        )
+        maintained = list(counts)
+        facets.rebuild()
+        self.assertEqual(maintained, list(counts))
+
+
+class StockReservationTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper')
+        Basket.objects.bulk_create([Basket(user=self.user, product_id=product_id, quantity=2) for product_id in (1, 3)])
+        self.order, _ = checkout(self.user, first_name='Ivan', last_name='Ivanov', email='ivan@example.com',
+                                 address='Moscow')
+
+    def stock(self):
+        return dict(Product.objects.filter(id__in=[1, 3]).values_list('id', 'quantity'))
+
+    def test_checkout_reserves_stock(self):
+        self.assertEqual(self.stock(), {1: 98, 3: 98})
+        self.assertEqual(
+            sorted(self.order.reservations.values_list('product_id', 'quantity', 'status')),
+            [(1, 2, ReservationStatus.ACTIVE), (3, 2, ReservationStatus.ACTIVE)],
+        )
+
+    def test_cancel_releases_stock_once(self):
+        self.assertTrue(reservations.cancel(self.order))
+        self.assertFalse(reservations.cancel(self.order))
+
+        self.assertEqual(self.stock(), {1: 100, 3: 100})
+        self.assertEqual(Order.objects.get(id=self.order.id).status, OrderStatus.CANCELED)
+        self.assertEqual(UserOrderStats.objects.get(user=self.user).canceled_orders, 1)
+
+    def test_paid_order_keeps_stock(self):
+        self.order.update_after_payment()
+
+        self.assertFalse(reservations.cancel(self.order))
+        statuses = set(self.order.reservations.values_list('status', flat=True))
+        self.assertEqual(statuses, {ReservationStatus.CONFIRMED})
+        self.assertEqual(self.stock(), {1: 98, 3: 98})
+
+    def test_release_expired(self):
+        self.assertEqual(reservations.release_expired(), 0)
+        self.order.reservations.update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(reservations.release_expired(grace=60 * 10), 0)
+        self.assertEqual(reservations.release_expired(), 1)
+        self.assertEqual(self.stock(), {1: 100, 3: 100})
+
+    def test_stock_moves_keep_catalog_version(self):
+        version = catalog.get_version()
+        self.assertEqual(catalog.get_products([1])[0].quantity, 98)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reservations.cancel(self.order)
+
+        self.assertEqual(catalog.get_version(), version)
+        self.assertEqual(catalog.get_products([1])[0].quantity, 100)
+
+    def test_out_of_stock_reserves_nothing(self):
+        Basket.objects.merge(self.user, {1: 50, 3: 50})
+        Product.objects.filter(id=3).update(quantity=10)
+
+        with self.assertRaises(CheckoutError):
+            checkout(self.user, first_name='Ivan', last_name='Ivanov', email='ivan@example.com', address='Moscow')
+
+        self.assertEqual(self.stock(), {1: 98, 3: 10})
+        self.assertEqual(StockReservation.objects.count(), 2)
+
+
+@override_settings(STRIPE_CLIENT='common.stripe_client.FakeStripeClient')
+class ReleaseOrderTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper')
+        Basket.objects.create(user=self.user, product_id=1, quantity=2)
+        self.order, _ = checkout(self.user, first_name='Ivan', last_name='Ivanov', email='ivan@example.com',
+                                 address='Moscow')
+        payments.checkout_session_url(self.order)
+        self.session = get_stripe_client().sessions[self.order.stripe_session_id]
+
+    def test_canceled_page_queues_release(self):
+        self.client.force_login(self.user)
+        url = reverse('orders:order_canceled')
+
+        with mock.patch.object(release_order, 'delay') as delay:
+            self.client.get(url, {'order_id': self.order.id})
+            self.client.force_login(User.objects.create_user(username='other'))
+            self.client.get(url, {'order_id': self.order.id})
+
+        delay.assert_called_once_with(self.order.id)
+
+    def test_release_expires_session(self):
+        release_order(self.order.id)
+
+        self.assertEqual(self.session['status'], 'expired')
+        self.assertEqual(Order.objects.get(id=self.order.id).status, OrderStatus.CANCELED)
+        self.assertEqual(Product.objects.get(id=1).quantity, 100)
+
+    def test_release_expired_expires_session(self):
+        self.order.reservations.update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(reservations.release_expired(), 1)
+
+        self.assertEqual(self.session['status'], 'expired')
+        self.assertEqual(Order.objects.get(id=self.order.id).status, OrderStatus.CANCELED)
+
+    def test_session_lifetime_is_valid_for_stripe(self):
+        lifetime = self.session['expires_at'] - timezone.now().timestamp()
+
+        self.assertGreater(lifetime, 30 * 60)
+        self.assertLess(lifetime, 24 * 60 * 60)
+
+    def test_completed_session_is_not_released(self):
+        self.session['status'] = 'complete'
+
+        release_order(self.order.id)
+
+        self.assertEqual(Order.objects.get(id=self.order.id).status, OrderStatus.CREATED)
+        self.assertEqual(Product.objects.get(id=1).quantity, 98)
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class ParallelCheckoutTestCase(TransactionTestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def test_parallel_checkouts_do_not_oversell(self):
+        Product.objects.filter(id__in=[1, 3]).update(quantity=5)
+        users = [User.objects.create_user(username=f'shopper{index}') for index in range(12)]
+        # Half of the baskets list the products in the other order.
+        for index, user in enumerate(users):
+            for product_id in ((1, 3) if index % 2 else (3, 1)):
+                Basket.objects.create(user=user, product_id=product_id, quantity=1)
+        outcomes = []
+
+        def buy(user):
+            try:
+                checkout(user, first_name='Ivan', last_name='Ivanov', email='ivan@example.com', address='Moscow')
+                outcomes.append(True)
+            except CheckoutError:
+                outcomes.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes.count(True), 5)
+        self.assertEqual(dict(Product.objects.filter(id__in=[1, 3]).values_list('id', 'quantity')), {1: 0, 3: 0})
+        self.assertEqual(StockReservation.objects.count(), 10)
+
+
+class UserOrderStatsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper')
+        self.orders = [
+            Order.objects.create(initiator=self.user, first_name='Ivan', last_name='Ivanov',
+                                 email='ivan@example.com', address='Moscow', total_sum=total_sum)
+            for total_sum in (Decimal('100.00'), Decimal('250.50'), Decimal('10.00'))
+        ]
+
+    def assertMatchesRebuild(self):
+        maintained = list(UserOrderStats.objects.values())
+        stats.rebuild()
+        self.assertEqual(maintained, list(UserOrderStats.objects.values()))
+
+    def test_maintained_on_create_and_status_change(self):
+        self.orders[0].update_after_payment()
+        self.orders[1].status = OrderStatus.CANCELED
+        self.orders[1].save()
+
+        user_stats = UserOrderStats.objects.get(user=self.user)
+        self.assertEqual(user_stats.total_orders, 3)
+        self.assertEqual(user_stats.total_spent, Decimal('360.50'))
+        self.assertEqual((user_stats.created_orders, user_stats.paid_orders, user_stats.canceled_orders), (1, 1, 1))
+        self.assertMatchesRebuild()
+
+    def test_status_change_reads_no_order_row(self):
+        order = Order.objects.get(pk=self.orders[1].pk)
+        order.status = OrderStatus.CANCELED
+        with CaptureQueriesContext(connection) as queries:
+            order.save()
+        # An order built by hand has no loaded values and is read once.
+        Order(pk=self.orders[2].pk, initiator=self.user, first_name='Ivan', last_name='Ivanov',
+              email='ivan@example.com', address='Moscow', total_sum=Decimal('20.00'),
+              created=self.orders[2].created).save()
+
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT "orders_order"')])
+        user_stats = UserOrderStats.objects.get(user=self.user)
+        self.assertEqual((user_stats.canceled_orders, user_stats.total_spent), (1, Decimal('370.50')))
+        self.assertMatchesRebuild()
+
+    def test_maintained_on_delete(self):
+        self.orders[2].delete()
+
+        user_stats = UserOrderStats.objects.get(user=self.user)
+        self.assertEqual((user_stats.total_orders, user_stats.total_spent), (2, Decimal('350.50')))
+        self.assertMatchesRebuild()
+
+    def test_missing_row_counts_existing_orders(self):
+        UserOrderStats.objects.all().delete()
+
+        Order.objects.create(initiator=self.user, first_name='Ivan', last_name='Ivanov',
+                             email='ivan@example.com', address='Moscow', total_sum=Decimal('5.00'))
+
+        user_stats = UserOrderStats.objects.get(user=self.user)
+        self.assertEqual((user_stats.total_orders, user_stats.total_spent), (4, Decimal('365.50')))
+
+    def test_row_created_concurrently_gets_delta(self):
+        adjust = stats._adjust
+
+        def created_meanwhile(user_id, changes):
+            # The first update finds no row, then another worker creates it.
+            mocked.side_effect = adjust
+            return 0
+
+        with mock.patch.object(stats, '_adjust', side_effect=created_meanwhile) as mocked:
+            self.orders[0].delete()
+
+        user_stats = UserOrderStats.objects.get(user=self.user)
+        self.assertEqual((user_stats.total_orders, user_stats.total_spent), (2, Decimal('260.50')))
+        self.assertMatchesRebuild()
+
+    def test_rebuild_command(self):
+        UserOrderStats.objects.all().delete()
+        out = StringIO()
+
+        call_command('rebuild_order_stats', stdout=out)
+
+        self.assertIn('1 users', out.getvalue())
+        self.assertEqual(UserOrderStats.objects.get(user=self.user).created_orders, 3)
+
+
+class CheckoutSessionTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper')
+        Basket.objects.bulk_create([Basket(user=self.user, product_id=product_id, quantity=2) for product_id in (1, 3)])
+        self.order, _ = checkout(self.user, first_name='Ivan', last_name='Ivanov', email='ivan@example.com',
+                                 address='Moscow')
+        self.stripe = FakeStripeClient()
+
+    def test_line_items(self):
+        Product.objects.filter(id=1).update(stripe_product_price_id='price_test', stripe_synced_price=F('price'))
+
+        with self.assertNumQueries(1):
+            line_items = payments.line_items(self.order)
+
+        self.assertEqual(line_items[0], {'price': 'price_test', 'quantity': 2})
+        # Not synced at the ordered price, so priced inline.
+        self.assertEqual(line_items[1]['price_data']['unit_amount'], 339000)
+
+    def test_open_session_is_reused(self):
+        url = payments.checkout_session_url(self.order, self.stripe)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(payments.checkout_session_url(self.order, self.stripe), url)
+        order = Order.objects.get(id=self.order.id)
+        self.assertEqual(payments.checkout_session_url(order, self.stripe), url)
+        self.assertEqual(list(self.stripe.sessions), [order.stripe_session_id])
+
+    def test_reservation_is_held_while_session_is_open(self):
+        payments.checkout_session_url(self.order, self.stripe)
+
+        expiries = set(self.order.reservations.values_list('expires_at', flat=True))
+        self.assertEqual(expiries, {Order.objects.get(id=self.order.id).stripe_session_expires_at})
+
+    def test_order_without_stock_cannot_be_paid(self):
+        self.order.reservations.update(status=ReservationStatus.RELEASED)
+
+        with self.assertRaises(payments.PaymentError):
+            payments.checkout_session_url(self.order, self.stripe)
+        self.assertFalse(self.stripe.sessions)
+
+    def test_expiring_session_is_replaced(self):
+        url = payments.checkout_session_url(self.order, self.stripe)
+        self.order.stripe_session_expires_at = timezone.now() + timedelta(minutes=1)
+
+        self.assertNotEqual(payments.checkout_session_url(self.order, self.stripe), url)
+        self.assertEqual(len(self.stripe.sessions), 2)
+
+    def test_concurrent_pay_requests_leave_one_payable_session(self):
+        create = self.stripe.create_checkout_session
+        urls = []
+
+        def second_tab_pays_meanwhile(**params):
+            session = create(**params)
+            if not urls:
+                urls.append(None)
+                urls[0] = payments.checkout_session_url(Order.objects.get(id=self.order.id), self.stripe)
+            return session
+
+        with mock.patch.object(self.stripe, 'create_checkout_session', side_effect=second_tab_pays_meanwhile):
+            url = payments.checkout_session_url(self.order, self.stripe)
+
+        order = Order.objects.get(id=self.order.id)
+        self.assertEqual(url, urls[0])
+        self.assertEqual(order.stripe_session_url, url)
+        self.assertEqual([session_id for session_id, session in self.stripe.sessions.items()
+                          if session['status'] == 'open'], [order.stripe_session_id])
+
+    def test_order_canceled_during_stripe_call(self):
+        create = self.stripe.create_checkout_session
+
+        def canceled_meanwhile(**params):
+            session = create(**params)
+            reservations.cancel(self.order)
+            return session
+
+        with mock.patch.object(self.stripe, 'create_checkout_session', side_effect=canceled_meanwhile):
+            with self.assertRaises(payments.PaymentError):
+                payments.checkout_session_url(self.order, self.stripe)
+
+        self.assertEqual([session['status'] for session in self.stripe.sessions.values()], ['expired'])
+        self.assertFalse(Order.objects.get(id=self.order.id).stripe_session_id)
+
+    @override_settings(STRIPE_CLIENT='common.stripe_client.FakeStripeClient')
+    def test_pay_view(self):
+        self.client.force_login(self.user)
+        url = reverse('orders:order_pay', kwargs={'pk': self.order.id})
+
+        response = self.client.post(url)
+
+        self.assertEqual(response.status_code, HTTPStatus.SEE_OTHER)
+        self.assertEqual(response.url, Order.objects.get(id=self.order.id).stripe_session_url)
+
+        self.order.update_after_payment()
+        self.assertEqual(self.client.post(url).status_code, HTTPStatus.NOT_FOUND)
+
+    @override_settings(STRIPE_CLIENT='common.stripe_client.FakeStripeClient')
+    def test_resubmitted_order_form_is_handled_once(self):
+        self.client.force_login(self.user)
+        Basket.objects.create(user=self.user, product_id=1, quantity=1)
+        response = self.client.get(reverse('orders:order_create'))
+        data = {'first_name': 'Ivan', 'last_name': 'Ivanov', 'email': 'ivan@example.com', 'address': 'Moscow',
+                'idempotency_key': response.context['idempotency_key']}
+
+        first = self.client.post(reverse('orders:order_create'), data)
+        retry = self.client.post(reverse('orders:order_create'), data)
+
+        self.assertEqual(first.status_code, HTTPStatus.SEE_OTHER)
+        self.assertEqual((retry.status_code, retry['Location']), (first.status_code, first['Location']))
+        # The order of setUp and the one of the form.
+        self.assertEqual(Order.objects.filter(initiator=self.user).count(), 2)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper')
+        Basket.objects.create(user=self.user, product_id=1, quantity=2)
+        self.order, _ = checkout(self.user, first_name='Ivan', last_name='Ivanov', email='ivan@example.com',
+                                 address='Moscow')
+
+    def post(self, event_id, event_type='checkout.session.completed', signature=None):
+        payload = json.dumps({
+            'id': event_id, 'object': 'event', 'type': event_type,
+            'data': {'object': {'object': 'checkout.session', 'metadata': {'order_id': str(self.order.id)}}},
+        })
+        return self.client.post(reverse('stripe_webhook'), data=payload, content_type='application/json',
+                                HTTP_STRIPE_SIGNATURE=signature or events.sign_payload(payload))
+
+    def test_redelivered_event_is_stored_once(self):
+        for _ in range(2):
+            self.assertEqual(self.post('evt_1').status_code, HTTPStatus.OK)
+
+        event = StripeEvent.objects.get()
+        self.assertEqual((event.id, event.type), ('evt_1', 'checkout.session.completed'))
+
+    def test_bad_signature(self):
+        response = self.post('evt_1', signature=events.sign_payload('{}'))
+
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_completed_event_pays_order_once(self):
+        self.post('evt_1')
+        self.post('evt_2')
+
+        self.assertEqual(events.process_pending(), 2)
+        self.assertEqual(events.process_pending(), 0)
+        self.assertEqual(Order.objects.get(id=self.order.id).status, OrderStatus.PAID)
+        self.assertEqual(UserOrderStats.objects.get(user=self.user).paid_orders, 1)
+        self.assertFalse(StripeEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_expired_event_releases_stock(self):
+        self.post('evt_1', event_type='checkout.session.expired')
+
+        events.process_pending()
+
+        self.assertEqual(Order.objects.get(id=self.order.id).status, OrderStatus.CANCELED)
+        self.assertEqual(Product.objects.get(id=1).quantity, 100)
+
+    def test_completed_event_after_cancel_leaves_order_canceled(self):
+        reservations.cancel(self.order)
+        self.post('evt_1')
+
+        events.process_pending()
+
+        self.assertEqual(Order.objects.get(id=self.order.id).status, OrderStatus.CANCELED)
+
+    def test_malformed_event_does_not_block_others(self):
+        payload = json.dumps({
+            'id': 'evt_bad', 'object': 'event', 'type': 'checkout.session.completed',
+            'data': {'object': {'object': 'checkout.session', 'metadata': {'order_id': 'abc'}}},
+        })
+        self.client.post(reverse('stripe_webhook'), data=payload, content_type='application/json',
+                         HTTP_STRIPE_SIGNATURE=events.sign_payload(payload))
+        self.post('evt_1')
+
+        self.assertEqual(events.process_pending(), 1)
+
+        self.assertEqual(Order.objects.get(id=self.order.id).status, OrderStatus.PAID)
+        self.assertEqual(StripeEvent.objects.get(id='evt_bad').attempts, 1)
+
+    def test_failed_event_is_retried(self):
+        self.post('evt_1')
+
+        def fail(order):
+            raise RuntimeError('Stripe is down')
+
+        with mock.patch.dict(events.HANDLERS, {'checkout.session.completed': fail}):
+            self.assertEqual(events.process_pending(), 0)
+        event = StripeEvent.objects.get()
+        self.assertEqual((event.attempts, event.processed_at), (1, None))
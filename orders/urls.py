@@ -1,7 +1,8 @@
 from django.urls import path
 
 from orders.views import (CanceledTemplateView, OrderCreateView,
-                          OrderDetailView, OrderListView, SuccessTemplateView)
+                          OrderDetailView, OrderListView, OrderPayView,
+                          SuccessTemplateView)
 
 app_name = 'orders'
 
@@ -9,6 +10,7 @@ urlpatterns = [
     path('order-create/', OrderCreateView.as_view(), name='order_create'),
     path('', OrderListView.as_view(), name='orders_list'),
     path('order/<int:pk>/', OrderDetailView.as_view(), name='order'),
+    path('order/<int:pk>/pay/', OrderPayView.as_view(), name='order_pay'),
     path('order-success/', SuccessTemplateView.as_view(), name='order_success'),
     path('order-canceled/', CanceledTemplateView.as_view(), name='order_canceled'),
 ]
@@ -1,20 +1,26 @@
+import uuid
 from http import HTTPStatus
 
 import stripe
 from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
 from django.http import HttpResponse, HttpResponseRedirect
 from django.urls import reverse, reverse_lazy
 from django.views.decorators.csrf import csrf_exempt
-from django.views.generic.base import TemplateView
-from django.views.generic.detail import DetailView
+from django.views.generic.base import TemplateView, View
+from django.views.generic.detail import DetailView, SingleObjectMixin
 from django.views.generic.edit import CreateView
 from django.views.generic.list import ListView
 
+from common.idempotency import idempotent
+from common.pagination import KeysetPaginationMixin
 from common.views import TitleMixin
+from orders import events, payments, reservations
+from orders.checkout import CheckoutError, checkout
 from orders.forms import OrderForm
-from orders.models import Order
-from products.models import Basket
+from orders.models import Order, OrderStatus
+from orders.tasks import process_stripe_events, release_order
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
@@ -27,12 +33,22 @@ class SuccessTemplateView(TitleMixin, TemplateView):
 class CanceledTemplateView(TemplateView):
     template_name = 'orders/canceled.html'
 
+    def get(self, request, *args, **kwargs):
+        order_id = request.GET.get('order_id', '')
+        if request.user.is_authenticated and order_id.isdigit():
+            order = Order.objects.filter(id=order_id, initiator=request.user, status=OrderStatus.CREATED).first()
+            if order is not None:
+                release_order.delay(order.id)
+        return super().get(request, *args, **kwargs)
 
-class OrderListView(LoginRequiredMixin, TitleMixin, ListView):
+
+class OrderListView(LoginRequiredMixin, TitleMixin, KeysetPaginationMixin, ListView):
     template_name = 'orders/orders.html'
     title = 'Store - Заказы'
     queryset = Order.objects.all()
-    ordering = ('-created')
+    ordering = ('-created', '-id')
+    keyset_ordering = ('-created', '-id')
+    paginate_by = 10
 
     def get_queryset(self):
         queryset = super(OrderListView, self).get_queryset()
@@ -43,9 +59,14 @@ class OrderDetailView(LoginRequiredMixin, DetailView):
     template_name = 'orders/order.html'
     model = Order
 
+    def get_queryset(self):
+        return Order.objects.filter(initiator=self.request.user).prefetch_related('items')
+
     def get_context_data(self, **kwargs):
         context = super(OrderDetailView, self).get_context_data(**kwargs)
         context['title'] = f'Store - Заказ #{self.object.id}'
+        context['awaiting_payment'] = self.object.status == OrderStatus.CREATED
+        context['idempotency_key'] = uuid.uuid4().hex
         return context
 
 
@@ -55,31 +76,57 @@ class OrderCreateView(LoginRequiredMixin, TitleMixin, CreateView):
     success_url = reverse_lazy('orders:order_create')
     title = 'Store - Оформление заказа'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Sent back with the form, so a resubmitted form is handled once (see common.idempotency).
+        context['idempotency_key'] = uuid.uuid4().hex
+        return context
+
+    @idempotent
     def post(self, request, *args, **kwargs):
-        super(OrderCreateView, self).post(request, *args, **kwargs)
-        baskets = Basket.objects.filter(user=self.request.user)
-        checkout_session = stripe.checkout.Session.create(
-            line_items=baskets.stripe_products(),
-            metadata={'order_id': self.object.id},
-            mode='payment',
-            success_url='{}{}'.format(settings.DOMAIN_NAME, reverse('orders:order_success')),
-            cancel_url='{}{}'.format(settings.DOMAIN_NAME, reverse('orders:order_canceled')),
-        )
-        return HttpResponseRedirect(checkout_session.url, status=HTTPStatus.SEE_OTHER)
+        return super().post(request, *args, **kwargs)
 
     def form_valid(self, form):
-        form.instance.initiator = self.request.user
-        return super(OrderCreateView, self).form_valid(form)
+        try:
+            self.object, baskets = checkout(self.request.user, **form.cleaned_data)
+        except CheckoutError as error:
+            form.add_error(None, str(error))
+            return self.form_invalid(form)
+
+        try:
+            url = payments.checkout_session_url(self.object)
+        except (stripe.error.StripeError, payments.PaymentError):
+            reservations.cancel(self.object)
+            raise
+        return HttpResponseRedirect(url, status=HTTPStatus.SEE_OTHER)
+
+
+class OrderPayView(LoginRequiredMixin, SingleObjectMixin, View):
+    """Send the customer to pay an unpaid order, to its open Stripe session if it has one."""
+    http_method_names = ['post']
+
+    def get_queryset(self):
+        return Order.objects.filter(initiator=self.request.user, status=OrderStatus.CREATED)
+
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        order = self.get_object()
+        try:
+            url = payments.checkout_session_url(order)
+        except payments.PaymentError:
+            # Its stock is gone, the order can only be canceled.
+            reservations.cancel(order)
+            url = reverse('orders:order_canceled')
+        return HttpResponseRedirect(url, status=HTTPStatus.SEE_OTHER)
 
 
 @csrf_exempt
 def stripe_webhook_view(request):
     payload = request.body
-    sig_header = request.META['HTTP_STRIPE_SIGNATURE']
-    event = None
+    sig_header = request.META.get('HTTP_STRIPE_SIGNATURE', '')
 
     try:
-        event = stripe.Webhook.construct_event(
+        stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
     except ValueError:
@@ -89,20 +136,9 @@ def stripe_webhook_view(request):
         # Invalid signature
         return HttpResponse(status=400)
 
-    # Handle the checkout.session.completed event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-
-        # Fulfill the purchase...
-        fulfill_order(session)
-
-    # Passed signature verification
+    # Answer at once, the event is handled by a worker (see orders.events).
+    events.record(payload)
+    transaction.on_commit(process_stripe_events.delay)
     return HttpResponse(status=200)
 
-
-def fulfill_order(session):
-    order_id = int(session.metadata.order_id)
-    order = Order.objects.get(id=order_id)
-    order.update_after_payment()
-
 # stripe listen --forward-to 127.0.0.1:8000/webhook/stripe/
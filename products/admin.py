@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from .models import Product, ProductCategory, Basket
+from .search import search_products
 
 @admin.register(ProductCategory)
 class ProductCategoryAdmin(admin.ModelAdmin):
@@ -11,23 +12,29 @@ class ProductCategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'price', 'quantity', 'display_image', 'stripe_product_price_id')
-    list_filter = ('category',)
+    list_display = ('name', 'category', 'price', 'quantity', 'display_image', 'stripe_sync_status')
+    list_filter = ('category', 'stripe_sync_status')
     search_fields = ('name', 'description')
     list_editable = ('price', 'quantity')  # Allow quick editing
-    readonly_fields = ('stripe_product_price_id', 'image_preview')
+    readonly_fields = ('stripe_product_price_id', 'stripe_sync_status', 'image_preview')
     fieldsets = (
         (None, {
             'fields': ('name', 'category', 'description')
         }),
         ('Pricing & Inventory', {
-            'fields': ('price', 'quantity', 'stripe_product_price_id')
+            'fields': ('price', 'quantity', 'stripe_product_price_id', 'stripe_sync_status')
         }),
         ('Images', {
             'fields': ('image', 'image_preview')
         }),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of an icontains scan over search_fields.
+        if not search_term:
+            return queryset, False
+        return search_products(search_term, queryset), False
+
     def display_image(self, obj):
         if obj.image:
             return format_html('<img src="{}" width="50" height="50" />', obj.image.url)
@@ -38,20 +45,13 @@ class ProductAdmin(admin.ModelAdmin):
         return self.display_image(obj)
     image_preview.short_description = 'Current Image'
 
-    def save_model(self, request, obj, form, change):
-        """Ensure Stripe product price is created if missing"""
-        if not obj.stripe_product_price_id:
-            stripe_product_price = obj.create_stripe_product_price()
-            obj.stripe_product_price_id = stripe_product_price['id']
-        super().save_model(request, obj, form, change)
-
 
 @admin.register(Basket)
 class BasketAdmin(admin.ModelAdmin):
-    list_display = ('user', 'product', 'quantity', 'created_timestamp')
+    list_display = ('user', 'product', 'quantity', 'created_timestamp', 'updated_at')
     list_filter = ('user', 'created_timestamp')
     search_fields = ('user__username', 'product__name')
-    readonly_fields = ('created_timestamp',)
+    readonly_fields = ('created_timestamp', 'updated_at')
     autocomplete_fields = ('user', 'product')
 
     def get_queryset(self, request):
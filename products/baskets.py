@@ -0,0 +1,358 @@
+"""
+Basket stores: where a user's basket lives between checkouts.
+
+DatabaseBasketStore reads and writes the Basket table directly. RedisBasketStore keeps each
+basket in a Redis hash of product id -> quantity and writes changed baskets back to the
+Basket table in batches (see products.tasks.flush_baskets). Anything that reads the table
+for a user, such as checkout, calls ``flush(user)`` first; anything that writes the table
+directly calls ``discard(user)`` afterwards, except checkout, which ``consume``s the products
+it ordered. The store in use is set by BASKET_STORE.
+
+Visitors who are not logged in get an AnonymousBasketStore basket that lives only in a Redis
+hash, under the token of a signed cookie, until login merges it into the Basket table.
+"""
+from abc import ABC, abstractmethod
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+
+from common.cache import get_or_compute
+from products import catalog
+from products.models import Basket, BasketCollectionMixin, Product
+
+
+class BasketList(BasketCollectionMixin, list):
+    pass
+
+
+class BasketStore(ABC):
+    # Summaries are dropped on every write through the store; the timeout bounds anything else.
+    summary_timeout = 60 * 5
+
+    @abstractmethod
+    def get(self, user):
+        """``user``'s baskets, with their products, ordered by product id."""
+
+    def summary(self, user):
+        """``{'total_quantity', 'total_sum'}`` of ``user``'s basket, cached per user."""
+        return get_or_compute(self._summary_key(user.pk), lambda: self._summary(user), timeout=self.summary_timeout)
+
+    @abstractmethod
+    def add(self, user, product_id, quantity=1):
+        """Add ``quantity`` of a product to ``user``'s basket; returns the new quantity."""
+
+    @abstractmethod
+    def remove(self, user, product_id):
+        """Remove a product from ``user``'s basket."""
+
+    @abstractmethod
+    def clear(self, user):
+        """Empty ``user``'s basket."""
+
+    def flush(self, user=None):
+        """Write pending changes of ``user`` (or of every user) to the Basket table."""
+
+    def discard(self, user):
+        """Forget any copy of ``user``'s basket held outside the Basket table."""
+        self._forget_summary(user)
+
+    def consume(self, user, quantities):
+        """
+        Take ``{product_id: quantity}`` out of ``user``'s basket once checkout has deleted their
+        flushed rows from the Basket table; anything added since stays in the basket.
+        """
+        self._forget_summary(user)
+
+    def forget(self, user_ids):
+        """Like ``discard``, for many users at once and without flushing them first."""
+        cache.delete_many([self._summary_key(user_id) for user_id in user_ids])
+
+    @abstractmethod
+    def _summary(self, user):
+        """``{'total_quantity', 'total_sum'}`` of ``user``'s basket, uncached."""
+
+    def _summary_key(self, user_id):
+        return f'basket-summary:{user_id}'
+
+    def _forget_summary(self, user):
+        # Only once the caller's transaction commits: a summary computed before that would be
+        # cached from the old rows.
+        key = self._summary_key(user.pk)
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+class DatabaseBasketStore(BasketStore):
+    def get(self, user):
+        return Basket.objects.filter(user=user).select_related('product').order_by('product_id')
+
+    def add(self, user, product_id, quantity=1):
+        quantity = Basket.objects.add(user, product_id, quantity).quantity
+        self._forget_summary(user)
+        return quantity
+
+    def remove(self, user, product_id):
+        Basket.objects.filter(user=user, product_id=product_id).delete()
+        self._forget_summary(user)
+
+    def clear(self, user):
+        Basket.objects.filter(user=user).delete()
+        self._forget_summary(user)
+
+    def _summary(self, user):
+        return Basket.objects.filter(user=user).summary()
+
+
+class RedisBasketStore(BasketStore):
+    key_prefix = 'basket'
+    dirty_key = 'basket:dirty'
+    # Marks a hash as loaded from the Basket table, so an empty basket is not reloaded.
+    loaded_field = 'loaded'
+    flush_batch_size = 500
+
+    def __init__(self, cache_alias='default', timeout=None):
+        self.cache_alias = cache_alias
+        self.timeout = timeout or settings.BASKET_STORE_TIMEOUT
+
+    @property
+    def redis(self):
+        return get_redis_connection(self.cache_alias)
+
+    def get(self, user):
+        quantities = self._load(user)
+        products = catalog.get_products(sorted(quantities))
+        return BasketList(
+            Basket(user=user, product=product, quantity=quantities[product.id]) for product in products
+        )
+
+    def add(self, user, product_id, quantity=1):
+        self._load(user)
+        with self.redis.pipeline() as pipe:
+            pipe.hincrby(self._key(user.pk), product_id, quantity)
+            self._mark_dirty(pipe, user.pk)
+            quantity = pipe.execute()[0]
+        self._forget_summary(user)
+        return quantity
+
+    def remove(self, user, product_id):
+        self._load(user)
+        with self.redis.pipeline() as pipe:
+            pipe.hdel(self._key(user.pk), product_id)
+            self._mark_dirty(pipe, user.pk)
+            pipe.execute()
+        self._forget_summary(user)
+
+    def clear(self, user):
+        with self.redis.pipeline() as pipe:
+            pipe.delete(self._key(user.pk))
+            pipe.srem(self.dirty_key, user.pk)
+            pipe.execute()
+        Basket.objects.filter(user=user).delete()
+        self._forget_summary(user)
+
+    def flush(self, user=None):
+        if user is not None:
+            if self.redis.srem(self.dirty_key, user.pk):
+                self._write([user.pk])
+            return
+        while True:
+            user_ids = [int(user_id) for user_id in self.redis.spop(self.dirty_key, self.flush_batch_size)]
+            if not user_ids:
+                return
+            self._write(user_ids)
+
+    def discard(self, user):
+        self.flush(user)
+        self.redis.delete(self._key(user.pk))
+        super().discard(user)
+
+    def forget(self, user_ids):
+        if user_ids:
+            self.redis.delete(*[self._key(user_id) for user_id in user_ids])
+        super().forget(user_ids)
+
+    def consume(self, user, quantities):
+        key = self._key(user.pk)
+
+        def decrement(pipe):
+            # An expired hash is reloaded from the table, where the rows are gone already.
+            if not pipe.hexists(key, self.loaded_field):
+                return
+            pipe.multi()
+            for product_id, quantity in quantities.items():
+                pipe.hincrby(key, product_id, -quantity)
+
+        # Decremented rather than deleted, so a concurrent add of the same product is kept.
+        self.redis.transaction(decrement, key)
+        super().consume(user, quantities)
+
+    def _summary(self, user):
+        baskets = self.get(user)
+        return {'total_quantity': baskets.total_quantity(), 'total_sum': baskets.total_sum()}
+
+    def _key(self, user_id):
+        return f'{self.key_prefix}:{user_id}'
+
+    def _mark_dirty(self, pipe, user_id):
+        pipe.hset(self._key(user_id), self.loaded_field, 1)
+        pipe.expire(self._key(user_id), self.timeout)
+        pipe.sadd(self.dirty_key, user_id)
+
+    def _load(self, user):
+        """``{product_id: quantity}`` of ``user``'s basket, filling the hash from the table on a miss."""
+        key = self._key(user.pk)
+        stored = self.redis.hgetall(key)
+        if stored.pop(self.loaded_field.encode(), None) is not None:
+            return {int(product_id): int(quantity) for product_id, quantity in stored.items() if int(quantity) > 0}
+
+        quantities = dict(Basket.objects.filter(user=user).values_list('product_id', 'quantity'))
+        with self.redis.pipeline() as pipe:
+            # HSETNX keeps increments that raced with this load.
+            for product_id, quantity in quantities.items():
+                pipe.hsetnx(key, product_id, quantity)
+            pipe.hset(key, self.loaded_field, 1)
+            pipe.expire(key, self.timeout)
+            pipe.execute()
+        return self._load(user) if stored else quantities
+
+    def _write(self, user_ids):
+        try:
+            with self.redis.pipeline() as pipe:
+                for user_id in user_ids:
+                    pipe.hgetall(self._key(user_id))
+                hashes = pipe.execute()
+
+            baskets = {}
+            for user_id, stored in zip(user_ids, hashes):
+                # An expired hash has nothing left to write.
+                if stored.pop(self.loaded_field.encode(), None) is not None:
+                    baskets[user_id] = {int(pk): int(quantity) for pk, quantity in stored.items() if int(quantity) > 0}
+
+            product_ids = {pk for quantities in baskets.values() for pk in quantities}
+            existing = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+            with transaction.atomic():
+                for user_id, quantities in baskets.items():
+                    Basket.objects.filter(user_id=user_id).exclude(product_id__in=quantities).delete()
+                Basket.objects.bulk_create(
+                    [
+                        Basket(user_id=user_id, product_id=pk, quantity=quantity)
+                        for user_id, quantities in baskets.items()
+                        for pk, quantity in quantities.items() if pk in existing
+                    ],
+                    update_conflicts=True, unique_fields=['user', 'product'], update_fields=['quantity', 'updated_at'],
+                )
+        except Exception:
+            # Leave them for the next flush.
+            self.redis.sadd(self.dirty_key, *user_ids)
+            raise
+
+
+class AnonymousBasketStore:
+    """Anonymous baskets as Redis hashes of product id -> quantity, changed field by field."""
+    cookie_name = 'basket'
+    cookie_salt = 'products.baskets.AnonymousBasketStore'
+    key_prefix = 'anonymous-basket'
+
+    def __init__(self, cache_alias='default', timeout=None):
+        self.cache_alias = cache_alias
+        self.timeout = timeout or settings.BASKET_STORE_TIMEOUT
+
+    @property
+    def redis(self):
+        return get_redis_connection(self.cache_alias)
+
+    def get_token(self, request):
+        return request.get_signed_cookie(self.cookie_name, default=None, salt=self.cookie_salt)
+
+    def new_token(self):
+        return uuid4().hex
+
+    def set_token(self, response, token):
+        response.set_signed_cookie(self.cookie_name, token, salt=self.cookie_salt, max_age=self.timeout,
+                                   httponly=True, samesite='Lax')
+
+    def quantities(self, token):
+        """``{product_id: quantity}`` of the basket under ``token``."""
+        if not token:
+            return {}
+        return self._decode(self.redis.hgetall(self._key(token)))
+
+    def get(self, token):
+        quantities = self.quantities(token)
+        return BasketList(
+            Basket(product=product, quantity=quantities[product.id])
+            for product in catalog.get_products(sorted(quantities))
+        )
+
+    def summary(self, token):
+        baskets = self.get(token)
+        return {'total_quantity': baskets.total_quantity(), 'total_sum': baskets.total_sum()}
+
+    def add(self, token, product_id, quantity=1):
+        with self.redis.pipeline() as pipe:
+            pipe.hincrby(self._key(token), product_id, quantity)
+            pipe.expire(self._key(token), self.timeout)
+            return pipe.execute()[0]
+
+    def remove(self, token, product_id):
+        if not token:
+            return
+        with self.redis.pipeline() as pipe:
+            pipe.hdel(self._key(token), product_id)
+            pipe.expire(self._key(token), self.timeout)
+            pipe.execute()
+
+    def pop(self, token):
+        """Remove the basket under ``token`` and return its quantities."""
+        if not token:
+            return {}
+        with self.redis.pipeline() as pipe:
+            pipe.hgetall(self._key(token))
+            pipe.delete(self._key(token))
+            stored, _ = pipe.execute()
+        return self._decode(stored)
+
+    def _key(self, token):
+        return f'{self.key_prefix}:{token}'
+
+    @staticmethod
+    def _decode(stored):
+        return {int(product_id): int(quantity) for product_id, quantity in stored.items()}
+
+
+def get_basket_store():
+    return import_string(settings.BASKET_STORE)()
+
+
+def delete_stale_baskets(before, chunk_size=1000):
+    """
+    Delete baskets last updated before ``before``, ``chunk_size`` rows per statement so no delete
+    holds its locks for long. Returns the number of rows deleted.
+    """
+    store = get_basket_store()
+    store.flush()
+    deleted = 0
+    stale = Basket.objects.filter(updated_at__lt=before).order_by('updated_at')
+    while True:
+        rows = list(stale.values_list('id', 'user_id')[:chunk_size])
+        if not rows:
+            return deleted
+        deleted += Basket.objects.filter(id__in=[pk for pk, _ in rows]).delete()[0]
+        store.forget({user_id for _, user_id in rows})
+
+
+def merge_anonymous_basket(request, user):
+    """Move the visitor's anonymous basket into ``user``'s basket with one bulk upsert."""
+    anonymous = AnonymousBasketStore()
+    quantities = anonymous.pop(anonymous.get_token(request))
+    if not quantities:
+        return
+    # Products may have been deleted while the basket sat in the cache.
+    existing = set(Product.objects.filter(id__in=quantities).values_list('id', flat=True))
+    store = get_basket_store()
+    store.flush(user)
+    Basket.objects.merge(user, {pk: quantity for pk, quantity in quantities.items() if pk in existing})
+    store.discard(user)
@@ -0,0 +1,140 @@
+"""
+Evaluated catalog data cached under a global catalog version.
+
+Every Product/ProductCategory write bumps the version (see products.signals), so readers
+switch to fresh keys at once and entries of older versions are simply never read again.
+Stock moves of checkouts and reservations are too frequent for that; they only drop the
+entries that hold stock (see invalidate_stock).
+"""
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Max
+from django.utils import timezone
+
+from common.cache import get_many_or_compute, get_or_compute
+from products.models import Product, ProductCategory
+
+VERSION_KEY = 'catalog:version'
+MODIFIED_KEY = 'catalog:modified'
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a lost version key can never resurrect entries of an older version.
+        cache.add(VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version(*changes):
+    """Start a new catalog version, recording ``changes`` as (model_name, pk) pairs."""
+    cache.set(MODIFIED_KEY, timezone.now(), timeout=None)
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns() // 1000, timeout=None)
+        version = cache.get(VERSION_KEY)
+    if changes:
+        cache.set(make_key('changes', version=version), changes, timeout=settings.CATALOG_CACHE_TIMEOUT)
+    return version
+
+
+def get_changes(since, until, limit=1000):
+    """
+    The (model_name, pk) pairs changed after version ``since`` up to ``until``, or None when
+    any version in between is unaccounted for and callers must start over from scratch.
+    """
+    if not 0 <= until - since <= limit:
+        return None
+    keys = [make_key('changes', version=version) for version in range(since + 1, until + 1)]
+    found = cache.get_many(keys)
+    if len(found) != len(keys):
+        return None
+    return {change for changes in found.values() for change in changes}
+
+
+def invalidate_stock(product_ids, facets=False):
+    """Drop the cached payloads of products whose stock moved and, with ``facets``, the facet counts."""
+    version = get_version()
+    keys = [make_key('product', pk, version=version) for pk in product_ids]
+    if facets:
+        keys.append(make_key('facets', version=version))
+    cache.delete_many(keys)
+    cache.set(MODIFIED_KEY, timezone.now(), timeout=None)
+
+
+def get_last_modified():
+    """
+    When the catalog last changed. Tracked on every version bump, so deletions count too, and
+    stock move; seeded from the newest ``updated_at`` should the key be lost.
+    """
+    modified = cache.get(MODIFIED_KEY)
+    if modified is None:
+        timestamps = [
+            Product.objects.aggregate(modified=Max('updated_at'))['modified'],
+            ProductCategory.objects.aggregate(modified=Max('updated_at'))['modified'],
+        ]
+        cache.add(MODIFIED_KEY, max(filter(None, timestamps), default=timezone.now()), timeout=None)
+        modified = cache.get(MODIFIED_KEY)
+    return modified
+
+
+def make_key(*parts, version=None):
+    version = get_version() if version is None else version
+    return ':'.join(['catalog', str(version), *map(str, parts)])
+
+
+def get_categories():
+    rows = get_or_compute(
+        make_key('categories'),
+        lambda: list(ProductCategory.objects.order_by('id').values()),
+        timeout=settings.CATALOG_CACHE_TIMEOUT,
+    )
+    return [_load(ProductCategory, row) for row in rows]
+
+
+def get_product_ids(category_id=None):
+    """Ascending ids of all products, or of one category's products."""
+    queryset = Product.objects.order_by('id')
+    if category_id:
+        queryset = queryset.filter(category_id=category_id)
+    return get_or_compute(
+        make_key('products', category_id or 'all'),
+        lambda: list(queryset.values_list('id', flat=True)),
+        timeout=settings.CATALOG_CACHE_TIMEOUT,
+    )
+
+
+def product_exists(pk):
+    ids = get_product_ids()
+    position = bisect_left(ids, pk)
+    return position < len(ids) and ids[position] == pk
+
+
+def get_products(ids):
+    """Products for ``ids`` in the given order; only ids missing from the cache are read from the DB."""
+    version = get_version()
+    payloads = get_many_or_compute(
+        {make_key('product', pk, version=version): pk for pk in ids},
+        lambda missing: {row['id']: row for row in Product.objects.filter(id__in=missing).values()},
+        timeout=settings.CATALOG_CACHE_TIMEOUT,
+    )
+
+    categories = {category.id: category for category in get_categories()}
+    products = []
+    for pk in ids:
+        if pk in payloads:
+            product = _load(Product, payloads[pk])
+            if product.category_id in categories:
+                product.category = categories[product.category_id]
+            products.append(product)
+    return products
+
+
+def _load(model, row):
+    return model.from_db(DEFAULT_DB_ALIAS, list(row), list(row.values()))
@@ -1,6 +1,53 @@
-from products.models import Basket
+from django.utils.functional import cached_property
+
+from products.baskets import AnonymousBasketStore, get_basket_store
+
+
+class BasketContext:
+    """
+    A user's basket as templates see it. Nothing is read until a template uses it; totals
+    come from the store's cached summary, and items are only loaded when iterated. Visitors
+    who are not logged in see their anonymous basket.
+    """
+    def __init__(self, request):
+        self.request = request
+        self.store = get_basket_store()
+
+    def __bool__(self):
+        return self.total_quantity > 0
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @cached_property
+    def items(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return list(self.anonymous.get(self.anonymous.get_token(self.request)))
+        return list(self.store.get(user))
+
+    @cached_property
+    def summary(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return self.anonymous.summary(self.anonymous.get_token(self.request))
+        return self.store.summary(user)
+
+    @cached_property
+    def anonymous(self):
+        return AnonymousBasketStore()
+
+    @property
+    def total_quantity(self):
+        return self.summary['total_quantity']
+
+    @property
+    def total_sum(self):
+        return self.summary['total_sum']
 
 
 def baskets(request):
-    user = request.user
-    return {'baskets': Basket.objects.filter(user=user) if user.is_authenticated else []}
+    return {'baskets': BasketContext(request)}
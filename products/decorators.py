@@ -0,0 +1,87 @@
+import hashlib
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.paginator import InvalidPage
+from django.http import HttpResponse
+
+from common.cache import get_or_compute
+from common.pagination import decode_cursor, encode_cursor
+from products import catalog
+
+
+def _normalize_cursor(value):
+    return encode_cursor(*decode_cursor(value))
+
+
+def _normalize_page(value):
+    page = int(value)
+    if page < 1:
+        raise ValueError(value)
+    return str(page)
+
+
+# The query parameters that select what a catalog page shows, with their normal forms; any
+# other parameter (utm_source, a cache buster) leaves the page as it is.
+PAGE_QUERY_PARAMS = {
+    'cursor': _normalize_cursor,
+    'page': _normalize_page,
+}
+
+
+class _Uncacheable(Exception):
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def cache_catalog_page(view_func):
+    """
+    Full-page cache for GET requests, keyed by route, page parameters and catalog version.
+
+    Catalog writes bump the version, so cached pages never go stale. The pages are shared by
+    all visitors, logged in or not, and must not carry per-visitor data: the user menu and
+    the basket sidebar are loaded separately from products:user_menu and products:baskets.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = _page_key(request) if request.method in ('GET', 'HEAD') else None
+        if key is None:
+            return view_func(request, *args, **kwargs)
+
+        rendered = []
+
+        def render():
+            response = view_func(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            if (response.status_code != 200 or response.streaming or response.cookies
+                    or request.META.get('CSRF_COOKIE_USED')):
+                raise _Uncacheable(response)
+            rendered.append(response)
+            return response.content, response['Content-Type']
+
+        try:
+            content, content_type = get_or_compute(key, render, timeout=settings.CATALOG_CACHE_TIMEOUT)
+        except _Uncacheable as uncacheable:
+            return uncacheable.response
+        # The worker that rendered the page returns its own response, with its context.
+        return rendered[0] if rendered else HttpResponse(content, content_type=content_type)
+
+    return wrapper
+
+
+def _page_key(request):
+    """The page's cache key, or None when its query parameters are invalid and it is not cached."""
+    match = request.resolver_match
+    params = []
+    for name, normalize in PAGE_QUERY_PARAMS.items():
+        value = request.GET.get(name)
+        if value:
+            try:
+                params.append((name, normalize(value)))
+            except (TypeError, ValueError, InvalidPage):
+                return None
+    page = '{}?{}'.format(match.view_name, urlencode(sorted(match.kwargs.items()) + params))
+    return catalog.make_key('page', hashlib.md5(page.encode()).hexdigest())
@@ -0,0 +1,97 @@
+"""
+Category facets: product and in-stock counts per category and price bucket.
+
+CategoryFacet rows are adjusted with F() deltas on every Product write (see products.signals)
+and rebuilt from scratch by ``manage.py rebuild_facets``. Reads go through the catalog cache.
+"""
+from bisect import bisect_right
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+
+from common.cache import get_or_compute
+from products import catalog
+from products.models import CategoryFacet, Product
+
+
+def price_bucket(price):
+    return bisect_right(settings.CATALOG_PRICE_BUCKETS, price)
+
+
+def bucket_range(bucket):
+    bounds = settings.CATALOG_PRICE_BUCKETS
+    return (bounds[bucket - 1] if bucket > 0 else None), (bounds[bucket] if bucket < len(bounds) else None)
+
+
+def state(product):
+    """What a product contributes to the facets: (category_id, price bucket, in stock)."""
+    return product.category_id, price_bucket(product.price), product.quantity > 0
+
+
+def apply(old=None, new=None):
+    """Move one product's contribution from ``old`` to ``new`` state; either may be None."""
+    if old == new:
+        return
+    for facet_state, delta in ((old, -1), (new, 1)):
+        if facet_state is None:
+            continue
+        category_id, bucket, in_stock = facet_state
+        changes = {'product_count': delta, 'in_stock_count': delta if in_stock else 0}
+        if _adjust(category_id, bucket, changes) or delta < 0:
+            continue
+        try:
+            with transaction.atomic():
+                CategoryFacet.objects.create(category_id=category_id, price_bucket=bucket, **changes)
+        except IntegrityError:
+            # Created concurrently, apply the delta to that row.
+            _adjust(category_id, bucket, changes)
+
+
+def _adjust(category_id, bucket, changes):
+    return CategoryFacet.objects.filter(category_id=category_id, price_bucket=bucket).update(
+        **{field: F(field) + value for field, value in changes.items()},
+    )
+
+
+def rebuild(product_model=Product, facet_model=CategoryFacet):
+    """Recount all facets with a single aggregate query; migrations pass their historical models."""
+    bucket = Case(
+        *[When(price__lt=bound, then=Value(index)) for index, bound in enumerate(settings.CATALOG_PRICE_BUCKETS)],
+        default=Value(len(settings.CATALOG_PRICE_BUCKETS)),
+        output_field=IntegerField(),
+    )
+    rows = product_model.objects.annotate(bucket=bucket).values('category_id', 'bucket').annotate(
+        product_count=Count('id'),
+        in_stock_count=Count('id', filter=Q(quantity__gt=0)),
+    ).order_by()
+
+    with transaction.atomic():
+        facet_model.objects.all().delete()
+        facet_model.objects.bulk_create([
+            facet_model(category_id=row['category_id'], price_bucket=row['bucket'],
+                        product_count=row['product_count'], in_stock_count=row['in_stock_count'])
+            for row in rows
+        ])
+
+
+def get_facets():
+    """``{category_id: {'product_count', 'in_stock_count', 'price_buckets'}}`` for the current catalog."""
+    return get_or_compute(catalog.make_key('facets'), _compute, timeout=settings.CATALOG_CACHE_TIMEOUT)
+
+
+def _compute():
+    facets = {}
+    rows = CategoryFacet.objects.filter(product_count__gt=0).order_by('category_id', 'price_bucket')
+    for row in rows.values('category_id', 'price_bucket', 'product_count', 'in_stock_count'):
+        facet = facets.setdefault(row['category_id'], {'product_count': 0, 'in_stock_count': 0, 'price_buckets': []})
+        facet['product_count'] += row['product_count']
+        facet['in_stock_count'] += row['in_stock_count']
+        min_price, max_price = bucket_range(row['price_bucket'])
+        facet['price_buckets'].append({
+            'min_price': min_price,
+            'max_price': max_price,
+            'product_count': row['product_count'],
+            'in_stock_count': row['in_stock_count'],
+        })
+    return facets
@@ -0,0 +1,64 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import transaction
+
+from common.pagination import KeysetPaginator, encode_cursor
+from products.models import Product, ProductCategory
+
+
+class Command(BaseCommand):
+    help = 'Compare offset and keyset pagination latency on the first page and on a deep page.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=int, default=10000, help='Deep page number to compare with page 1.')
+        parser.add_argument('--page-size', type=int, default=settings.REST_FRAMEWORK['PAGE_SIZE'])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        page, page_size, repeat = options['page'], options['page_size'], options['repeat']
+
+        # Everything runs in a transaction that is rolled back, so seeded rows never persist.
+        with transaction.atomic():
+            self._seed(page * page_size)
+            queryset = Product.objects.all()
+
+            for number in (1, page):
+                offset = self._measure(repeat, lambda: list(Paginator(queryset.order_by('id'), page_size)
+                                                            .page(number).object_list))
+                cursor = self._cursor_for(queryset, number, page_size)
+                keyset = self._measure(repeat, lambda: list(KeysetPaginator(queryset, page_size).page(cursor)))
+                self.stdout.write(f'page {number:>6}: offset {offset:8.3f} ms | keyset {keyset:8.3f} ms')
+
+            transaction.set_rollback(True)
+
+    def _seed(self, total):
+        missing = total - Product.objects.count()
+        if missing <= 0:
+            return
+        category, _ = ProductCategory.objects.get_or_create(name='Benchmark')
+        Product.objects.bulk_create(
+            (Product(name=f'Benchmark product {i}', price=100, quantity=1, category=category,
+                     stripe_product_price_id='price_benchmark') for i in range(missing)),
+            batch_size=1000,
+        )
+        self.stdout.write(f'Seeded {missing} products.')
+
+    @staticmethod
+    def _cursor_for(queryset, number, page_size):
+        if number == 1:
+            return None
+        last_id = queryset.order_by('id').values_list('id', flat=True)[(number - 1) * page_size - 1]
+        return encode_cursor([last_id])
+
+    @staticmethod
+    def _measure(repeat, func):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from common.stripe_client import FakeStripeClient
+from products.models import Product, ProductCategory, StripeSyncStatus
+from products.stripe_sync import sync_pending
+
+
+class Command(BaseCommand):
+    help = 'Measure Stripe catalog sync throughput against a fake Stripe with the given latency per call.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=100, help='Milliseconds per Stripe call.')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16])
+
+    def handle(self, *args, **options):
+        client = FakeStripeClient(latency=options['latency'] / 1000)
+
+        # Everything runs in a transaction that is rolled back, so seeded rows never persist.
+        with transaction.atomic():
+            category, _ = ProductCategory.objects.get_or_create(name='Benchmark')
+            products = Product.objects.bulk_create(
+                Product(name=f'Benchmark product {i}', price=100, quantity=1, category=category)
+                for i in range(options['products'])
+            )
+            # Only the benchmark's products are pending, whatever the state of the catalog.
+            pending = Product.objects.filter(stripe_sync_status=StripeSyncStatus.PENDING)
+            held = list(pending.exclude(id__in=[product.id for product in products]).values_list('id', flat=True))
+            Product.objects.filter(id__in=held).update(stripe_sync_status=StripeSyncStatus.FAILED)
+
+            for concurrency in options['concurrency']:
+                # Repriced, so every run creates a price per product and, after the first, no products.
+                Product.objects.filter(id__in=[product.id for product in products]).update(
+                    price=100 + concurrency, stripe_sync_status=StripeSyncStatus.PENDING,
+                )
+                start = time.perf_counter()
+                synced = sync_pending(client, concurrency=concurrency)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f'{concurrency:>3} workers: {synced} products in {elapsed:7.3f} s | '
+                                  f'{synced / elapsed:8.1f} products/s')
+
+            transaction.set_rollback(True)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from products import catalog, facets
+from products.models import CategoryFacet
+
+
+class Command(BaseCommand):
+    help = 'Recount category facets (product counts, in-stock counts and price buckets) from scratch.'
+
+    def handle(self, *args, **options):
+        facets.rebuild()
+        catalog.bump_version()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {CategoryFacet.objects.count()} category facets.'))
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.20 on 2026-10-18 18:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def rebuild_facets(apps, schema_editor):
+    from products import facets
+
+    facets.rebuild(apps.get_model('products', 'Product'), apps.get_model('products', 'CategoryFacet'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_bucket', models.PositiveSmallIntegerField()),
+                ('product_count', models.IntegerField(default=0)),
+                ('in_stock_count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='products.productcategory')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='categoryfacet',
+            constraint=models.UniqueConstraint(fields=('category', 'price_bucket'), name='unique_category_price_bucket'),
+        ),
+        migrations.RunPython(rebuild_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.20 on 2026-10-18 18:07
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_baskets(apps, schema_editor):
+    # Fold duplicate (user, product) rows into the oldest one before the constraint is added.
+    Basket = apps.get_model('products', 'Basket')
+    duplicates = Basket.objects.values('user_id', 'product_id').annotate(
+        rows=Count('id'), first_id=Min('id'), total=Sum('quantity'),
+    ).filter(rows__gt=1)
+    for duplicate in duplicates:
+        baskets = Basket.objects.filter(user_id=duplicate['user_id'], product_id=duplicate['product_id'])
+        baskets.filter(id=duplicate['first_id']).update(quantity=duplicate['total'])
+        baskets.exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_categoryfacet'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_baskets, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='basket',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_basket_user_product'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.20 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_basket_unique_user_product'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='basket',
+            index=models.Index(fields=['created_timestamp'], name='products_basket_created_idx'),
+        ),
+    ]
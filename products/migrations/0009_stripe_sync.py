@@ -0,0 +1,60 @@
+# Generated by Django 4.2.20 on 2026-10-18 18:30
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+search_index = import_module('products.migrations.0005_product_search_index')
+
+
+def mark_synced(apps, schema_editor):
+    # Products with a price were synced when saved, before syncing moved to products.stripe_sync.
+    Product = apps.get_model('products', 'Product')
+    Product.objects.filter(stripe_product_price_id__isnull=False).exclude(stripe_product_price_id='').update(
+        stripe_synced_price=models.F('price'), stripe_sync_status=1,
+    )
+
+
+def rebuild_sqlite_search_index(apps, schema_editor):
+    # SQLite adds these columns by remaking the table, which drops the full-text search triggers.
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in search_index.SQLITE_BACKWARD + search_index.SQLITE_FORWARD:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_basket_created_idx'),
+    ]
+
+    operations = [
+        # Unapplying removes the columns again, so the index is also rebuilt after that.
+        migrations.RunPython(migrations.RunPython.noop, rebuild_sqlite_search_index),
+        migrations.AddField(
+            model_name='product',
+            name='stripe_product_id',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stripe_sync_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stripe_sync_status',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Pending'), (1, 'Synced'), (2, 'Failed')], default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stripe_synced_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('stripe_sync_status', 0)), fields=['id'], name='product_stripe_pending_idx'),
+        ),
+        migrations.RunPython(rebuild_sqlite_search_index, migrations.RunPython.noop),
+        migrations.RunPython(mark_synced, migrations.RunPython.noop),
+    ]
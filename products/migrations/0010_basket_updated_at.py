@@ -0,0 +1,36 @@
+# Generated by Django 4.2.20 on 2026-10-18 18:57
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def copy_created_timestamp(apps, schema_editor):
+    # Existing baskets have not changed since they were created, as far as anyone can tell.
+    Basket = apps.get_model('products', 'Basket')
+    Basket.objects.update(updated_at=F('created_timestamp'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_stripe_sync'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='basket',
+            name='products_basket_created_idx',
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_created_timestamp, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='basket',
+            index=models.Index(fields=['updated_at'], name='products_basket_updated_idx'),
+        ),
+    ]
@@ -1,17 +1,28 @@
-import stripe
-from django.conf import settings
-from django.db import models
+from decimal import Decimal
+
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Count, F, Min, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from urllib.parse import urlparse
 
+from common.models import StoredValuesMixin
 from users.models import User
 from users.storage_backends import MediaStorage
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+STRIPE_CURRENCY = 'rub'
+
+
+class StripeSyncStatus(models.IntegerChoices):
+    PENDING = 0, 'Pending'
+    SYNCED = 1, 'Synced'
+    FAILED = 2, 'Failed'
 
 
 class ProductCategory(models.Model):
     name = models.CharField(max_length=128, unique=True)
     description = models.TextField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = 'category'
@@ -21,18 +32,32 @@ class ProductCategory(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(StoredValuesMixin, models.Model):
     name = models.CharField(max_length=256)
     description = models.TextField(default='')
     price = models.DecimalField(max_digits=8, decimal_places=2)
     quantity = models.PositiveIntegerField(default=0)
     image = models.ImageField(upload_to='products_images', storage=MediaStorage() if MediaStorage else None, null=True, blank=True)
     stripe_product_price_id = models.CharField(max_length=128, null=True, blank=True)
+    # Kept in sync by products.stripe_sync: the Stripe product and the price it was last synced at.
+    stripe_product_id = models.CharField(max_length=128, null=True, blank=True)
+    stripe_synced_price = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
+    stripe_sync_status = models.PositiveSmallIntegerField(choices=StripeSyncStatus.choices,
+                                                          default=StripeSyncStatus.PENDING)
+    stripe_sync_attempts = models.PositiveSmallIntegerField(default=0)
     category = models.ForeignKey(to=ProductCategory, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # What the product contributes to the category facets, see products.signals.
+    tracked_fields = ('category_id', 'price', 'quantity')
 
     class Meta:
         verbose_name = 'product'
         verbose_name_plural = 'products'
+        indexes = [
+            models.Index(fields=('id',), condition=models.Q(stripe_sync_status=StripeSyncStatus.PENDING),
+                         name='product_stripe_pending_idx'),
+        ]
 
     @property
     def image_path(self):
@@ -42,36 +67,157 @@ class Product(models.Model):
         return f'Продукт: {self.name} | Категория: {self.category.name}'
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
-        # Only create a Stripe price if it doesn't already exist
-        if not self.stripe_product_price_id:
-            stripe_product_price = self.create_stripe_product_price()
-            self.stripe_product_price_id = stripe_product_price['id']
+        # Stripe prices cannot change, a new price is synced as a new Stripe price by products.stripe_sync.
+        if self.stripe_synced_price != self.price and self.stripe_sync_status != StripeSyncStatus.PENDING:
+            self.stripe_sync_status = StripeSyncStatus.PENDING
+            self.stripe_sync_attempts = 0
+            if update_fields is not None:
+                update_fields = {*update_fields, 'stripe_sync_status', 'stripe_sync_attempts'}
         super().save(force_insert, force_update, using, update_fields)
 
-    def create_stripe_product_price(self):
-        # Create the Stripe product and price
-        stripe_product = stripe.Product.create(name=self.name)
-        stripe_product_price = stripe.Price.create(
-            product=stripe_product['id'], unit_amount=round(self.price * 100), currency='rub'
-        )
-        return stripe_product_price
+    def stripe_unit_amount(self):
+        return round(self.price * 100)
+
+
+class CategoryFacet(models.Model):
+    """Denormalized product counts per category and price bucket, maintained by products.facets."""
+    category = models.ForeignKey(to=ProductCategory, on_delete=models.CASCADE, related_name='facets')
+    price_bucket = models.PositiveSmallIntegerField()
+    product_count = models.IntegerField(default=0)
+    in_stock_count = models.IntegerField(default=0)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('category', 'price_bucket'), name='unique_category_price_bucket'),
+        ]
+
+    def __str__(self):
+        return f'Фасет: {self.category_id} | Ценовой диапазон: {self.price_bucket}'
 
-class BasketQuerySet(models.QuerySet):
+
+class BasketCollectionMixin:
+    """Totals over any iterable of baskets, whether a queryset or a store's BasketList."""
     def total_sum(self):
         return sum(basket.sum() for basket in self)
 
     def total_quantity(self):
         return sum(basket.quantity for basket in self)
 
-    def stripe_products(self):
-        return [
-            {
-                'price': basket.product.stripe_product_price_id,
-                'quantity': basket.quantity,
-            }
-            for basket in self
-        ]
+
+class BasketQuerySet(BasketCollectionMixin, models.QuerySet):
+    def summary(self):
+        """Total quantity and sum of the baskets in one aggregate query."""
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        return self.aggregate(
+            total_quantity=Coalesce(Sum('quantity'), 0),
+            total_sum=Coalesce(Sum(F('quantity') * F('product__price'), output_field=money), Value(Decimal(0)),
+                               output_field=money),
+        )
+
+    def abandoned_report(self):
+        """Carts, items, value and least recently updated row of the baskets in one aggregate query."""
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        return self.aggregate(
+            carts=Count('user', distinct=True),
+            total_quantity=Coalesce(Sum('quantity'), 0),
+            total_sum=Coalesce(Sum(F('quantity') * F('product__price'), output_field=money), Value(Decimal(0)),
+                               output_field=money),
+            oldest=Min('updated_at'),
+        )
+
+    def add(self, user, product_id, quantity=1):
+        """
+        Add ``quantity`` of a product to the user's basket in a single atomic statement, so
+        concurrent adds can neither lose an increment nor create a duplicate row.
+        """
+        connection = connections[self.db]
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            return self._add_with_fallback(user, product_id, quantity)
+
+        with connection.cursor() as cursor:
+            now = timezone.now()
+            cursor.execute(
+                self._upsert_sql(connection, 1) + ' RETURNING id, quantity',
+                [user.pk, product_id, quantity, now, now],
+            )
+            pk, quantity = cursor.fetchone()
+        return self.model(id=pk, user=user, product_id=product_id, quantity=quantity)
+
+    def merge(self, user, quantities):
+        """Add ``{product_id: quantity}`` to the user's basket with a single multi-row upsert."""
+        if not quantities:
+            return
+        connection = connections[self.db]
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            with transaction.atomic(using=self.db):
+                for product_id, quantity in quantities.items():
+                    self._add_with_fallback(user, product_id, quantity)
+            return
+
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self._upsert_sql(connection, len(quantities)),
+                [value for product_id, quantity in sorted(quantities.items())
+                 for value in (user.pk, product_id, quantity, now, now)],
+            )
+
+    def _upsert_sql(self, connection, row_count):
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        rows = ', '.join(['(%s, %s, %s, %s, %s)'] * row_count)
+        return (
+            f'INSERT INTO {table} (user_id, product_id, quantity, created_timestamp, updated_at) VALUES {rows} '
+            f'ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity, '
+            f'updated_at = EXCLUDED.updated_at'
+        )
+
+    def apply(self, user, operations):
+        """
+        Apply ``(op, product_id, quantity)`` operations ('set', 'add' or 'remove') to the user's
+        basket in order, in one transaction: one locking read, one delete, one bulk update and
+        one bulk insert at most.
+        """
+        now = timezone.now()
+        with transaction.atomic(using=self.db):
+            current = {basket.product_id: basket for basket in self.select_for_update().filter(user=user)}
+            quantities = {product_id: basket.quantity for product_id, basket in current.items()}
+            for op, product_id, quantity in operations:
+                if op == 'add':
+                    quantities[product_id] = quantities.get(product_id, 0) + quantity
+                elif op == 'set' and quantity > 0:
+                    quantities[product_id] = quantity
+                else:
+                    quantities.pop(product_id, None)
+
+            removed = [product_id for product_id in current if product_id not in quantities]
+            changed = []
+            for product_id, basket in current.items():
+                if product_id in quantities and basket.quantity != quantities[product_id]:
+                    basket.quantity, basket.updated_at = quantities[product_id], now
+                    changed.append(basket)
+            created = [
+                self.model(user=user, product_id=product_id, quantity=quantity)
+                for product_id, quantity in quantities.items() if product_id not in current
+            ]
+
+            if removed:
+                self.filter(user=user, product_id__in=removed).delete()
+            if changed:
+                self.bulk_update(changed, ['quantity', 'updated_at'])
+            if created:
+                # A row added concurrently for the same product is overwritten, not duplicated.
+                self.bulk_create(created, update_conflicts=True, unique_fields=['user', 'product'],
+                                 update_fields=['quantity', 'updated_at'])
+
+    def _add_with_fallback(self, user, product_id, quantity):
+        baskets = self.filter(user=user, product_id=product_id)
+        if not baskets.update(quantity=F('quantity') + quantity, updated_at=timezone.now()):
+            try:
+                with transaction.atomic(using=self.db):
+                    return self.create(user=user, product_id=product_id, quantity=quantity)
+            except IntegrityError:
+                baskets.update(quantity=F('quantity') + quantity, updated_at=timezone.now())
+        return baskets.get()
 
 
 class Basket(models.Model):
@@ -79,9 +225,19 @@ class Basket(models.Model):
     product = models.ForeignKey(to=Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField(default=0)
     created_timestamp = models.DateTimeField(auto_now_add=True)
+    # Set by every write, upserts included; stale baskets are purged by it.
+    updated_at = models.DateTimeField(auto_now=True)
 
     objects = BasketQuerySet.as_manager()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=('user', 'product'), name='unique_basket_user_product'),
+        ]
+        indexes = [
+            models.Index(fields=('updated_at',), name='products_basket_updated_idx'),
+        ]
+
     def __str__(self):
         return f'Корзина для {self.user.username} | Продукт: {self.product.name}'
 
@@ -98,13 +254,6 @@ class Basket(models.Model):
 
     @classmethod
     def create_or_update(cls, product_id, user):
-        baskets = Basket.objects.filter(user=user, product_id=product_id)
-
-        if not baskets.exists():
-            obj = Basket.objects.create(user=user, product_id=product_id, quantity=1)
-            return obj, True  # Renamed `is_crated` to `is_created`
-        else:
-            basket = baskets.first()
-            basket.quantity += 1
-            basket.save()
-            return basket, False
+        # The upsert cannot tell an insert from an update, a quantity of one means a new row.
+        basket = Basket.objects.add(user, product_id)
+        return basket, basket.quantity == 1
@@ -0,0 +1,53 @@
+"""
+Full-text product search backed by the index created in migration 0005.
+
+PostgreSQL ranks a weighted tsvector column (name over description) held in a GIN index;
+SQLite ranks with bm25 over an FTS5 table. Other backends fall back to ``icontains``.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from products.models import Product
+
+POSTGRESQL_QUERY = "websearch_to_tsquery('russian', %s)"
+
+
+def search_products(query, queryset=None):
+    """
+    Filter ``queryset`` (all products by default) down to matches for ``query`` and
+    annotate them with ``rank``, higher meaning more relevant.
+    """
+    queryset = Product.objects.all() if queryset is None else queryset
+    vendor = connections[queryset.db].vendor
+
+    if vendor == 'postgresql':
+        return queryset.alias(
+            matches=RawSQL(f'products_product.search_vector @@ {POSTGRESQL_QUERY}', (query,), BooleanField()),
+        ).filter(matches=True).annotate(
+            rank=RawSQL(f'ts_rank(products_product.search_vector, {POSTGRESQL_QUERY})', (query,), FloatField()),
+        )
+
+    if vendor == 'sqlite':
+        match = _fts5_query(query)
+        if not match:
+            return queryset.none()
+        # One join with the FTS5 table both filters and ranks, the MATCH runs once per query.
+        return queryset.extra(
+            tables=['products_product_fts'],
+            where=['products_product_fts MATCH %s', 'products_product_fts.rowid = products_product.id'],
+            params=[match],
+            # bm25() is lower for better matches; names weigh ten times more than descriptions.
+            select={'rank': '-bm25(products_product_fts, 10.0, 1.0)'},
+        )
+
+    return queryset.filter(
+        Q(name__icontains=query) | Q(description__icontains=query),
+    ).annotate(rank=Value(0.0, FloatField()))
+
+
+def _fts5_query(query):
+    # Quote every word so user input can never be parsed as FTS5 syntax; match word prefixes.
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', query))
@@ -1,4 +1,7 @@
+from decimal import Decimal
+
 from rest_framework import serializers
+from products import catalog
 from products.models import Basket, Product, ProductCategory
 
 
@@ -53,10 +56,45 @@ class ProductSerializer(serializers.Serializer):
         }
 
 
+class ProductSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=256)
+    category = serializers.CharField(required=False)
+    min_price = serializers.DecimalField(required=False, max_digits=10, decimal_places=2, min_value=Decimal(0))
+    max_price = serializers.DecimalField(required=False, max_digits=10, decimal_places=2, min_value=Decimal(0))
+
+    def validate(self, attrs):
+        if 'min_price' in attrs and 'max_price' in attrs and attrs['min_price'] > attrs['max_price']:
+            raise serializers.ValidationError("min_price cannot be greater than max_price")
+        return attrs
+
+
+class BasketOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['set', 'add', 'remove'], default='set')
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'add' and attrs['quantity'] == 0:
+            raise serializers.ValidationError({'quantity': "Quantity must be greater than zero"})
+        return attrs
+
+
+class BasketBulkSerializer(serializers.Serializer):
+    operations = BasketOperationSerializer(many=True, allow_empty=False, max_length=100)
+
+    def validate_operations(self, value):
+        product_ids = {operation['product_id'] for operation in value if operation['op'] != 'remove'}
+        existing = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+        if product_ids - existing:
+            raise serializers.ValidationError(f"Products do not exist: {sorted(product_ids - existing)}")
+        return value
+
+
 class BasketSerializer(serializers.Serializer):
-    id = serializers.IntegerField()
-    product = ProductSerializer()
-    quantity = serializers.IntegerField(min_value=1)
+    id = serializers.IntegerField(read_only=True)
+    product = ProductSerializer(read_only=True)
+    product_id = serializers.IntegerField(write_only=True)
+    quantity = serializers.IntegerField(min_value=1, required=False)
     sum = serializers.FloatField(required=False)
     total_sum = serializers.SerializerMethodField()
     total_quantity = serializers.SerializerMethodField()
@@ -67,18 +105,22 @@ class BasketSerializer(serializers.Serializer):
             raise serializers.ValidationError("Quantity must be greater than zero")
         return value
 
-    def validate_product(self, value):
-        if not Product.objects.filter(id=value.id).exists():
+    def validate_product_id(self, value):
+        if not catalog.product_exists(value):
             raise serializers.ValidationError("Product does not exist")
         return value
 
     def get_total_sum(self, obj):
-        total_sum = Basket.objects.filter(user=obj.user).total_sum()
-        return total_sum
+        return self._summary(obj)['total_sum']
 
     def get_total_quantity(self, obj):
-        total_quantity = Basket.objects.filter(user=obj.user).total_quantity()
-        return total_quantity
+        return self._summary(obj)['total_quantity']
+
+    def _summary(self, obj):
+        # The context is shared by every row of a list, so the summary is computed once per response.
+        if 'basket_summary' not in self.context:
+            self.context['basket_summary'] = Basket.objects.filter(user=obj.user_id).summary()
+        return self.context['basket_summary']
 
     # Get product details
     def get_product_details(self, obj):
@@ -0,0 +1,52 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from products import catalog, facets
+from products.baskets import merge_anonymous_basket
+from products.models import Product, ProductCategory, StripeSyncStatus
+from products.tasks import sync_stripe_products
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductCategory)
+def bump_catalog_version(sender, instance, **kwargs):
+    # Bump after commit so no reader can cache pre-commit rows under the new version.
+    change = (sender._meta.model_name, instance.pk)
+    transaction.on_commit(lambda: catalog.bump_version(change))
+
+
+@receiver(pre_save, sender=Product)
+def remember_facet_state(sender, instance, **kwargs):
+    # What the row counts for now is what it was loaded or last saved with, the instance may
+    # already hold the new values. The row is only read for instances built by hand.
+    stored = instance.stored_copy()
+    if stored is None and instance.pk is not None:
+        row = Product.objects.filter(pk=instance.pk).values(*Product.tracked_fields).first()
+        stored = Product(**row) if row else None
+    instance._facet_state = facets.state(stored) if stored else None
+
+
+@receiver(post_save, sender=Product)
+def update_facets(sender, instance, **kwargs):
+    facets.apply(getattr(instance, '_facet_state', None), facets.state(instance))
+
+
+@receiver(post_save, sender=Product)
+def queue_stripe_sync(sender, instance, raw=False, **kwargs):
+    # The beat schedule also runs the sync, this only saves new products the wait. Fixture loads
+    # are left to it, rather than queuing a task per product.
+    if not raw and instance.stripe_sync_status == StripeSyncStatus.PENDING:
+        transaction.on_commit(sync_stripe_products.delay)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_facets(sender, instance, **kwargs):
+    facets.apply(old=facets.state(instance.stored_copy() or instance))
+
+
+@receiver(user_logged_in)
+def merge_basket_on_login(sender, request, user, **kwargs):
+    if request is not None:
+        merge_anonymous_basket(request, user)
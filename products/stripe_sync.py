@@ -0,0 +1,90 @@
+"""
+Syncing products to the Stripe catalog.
+
+Saving a new or repriced product only marks it pending (Product.save); sync_pending, run by
+products.tasks.sync_stripe_products, then creates its Stripe product and a Stripe price for
+its current price. Stripe prices cannot change, so a repriced product gets a new one. The
+Stripe calls of a batch run on a thread pool of bounded size, outside any transaction. A
+product whose calls fail stays pending for the next run and is marked failed after
+STRIPE_SYNC_MAX_ATTEMPTS attempts.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import stripe
+from django.conf import settings
+from django.db.models import Case, F, When
+
+from common.cache import cache_lock
+from common.stripe_client import get_stripe_client
+from products.models import STRIPE_CURRENCY, Product, StripeSyncStatus
+
+logger = logging.getLogger(__name__)
+
+
+def sync_pending(client=None, batch_size=None, concurrency=None):
+    """
+    Sync pending products batch by batch until none are left; returns how many were synced.
+    Only one run syncs at a time, others return 0 at once.
+    """
+    client = client or get_stripe_client()
+    batch_size = batch_size or settings.STRIPE_SYNC_BATCH_SIZE
+    pending = Product.objects.filter(stripe_sync_status=StripeSyncStatus.PENDING).only(
+        'id', 'name', 'price', 'stripe_product_id',
+    ).order_by('id')
+    lock_timeout = settings.STRIPE_SYNC_LOCK_TIMEOUT
+    # Concurrent runs would read the same pending rows and create duplicate Stripe objects. The
+    # rows are not locked instead, that would block checkouts reserving their stock.
+    with cache_lock('stripe-sync', lock_timeout) as acquired:
+        if not acquired:
+            return 0
+        # No batch is started late enough to still run when the lock expires; the next run goes on.
+        deadline = time.monotonic() + lock_timeout / 2
+        synced, last_id = 0, 0
+        with ThreadPoolExecutor(max_workers=concurrency or settings.STRIPE_SYNC_CONCURRENCY) as pool:
+            while time.monotonic() < deadline:
+                # Paging by id leaves the products that failed in this run to the next one.
+                products = list(pending.filter(id__gt=last_id)[:batch_size])
+                if not products:
+                    break
+                last_id = products[-1].id
+                for product, result in zip(products, pool.map(partial(_create, client), products)):
+                    synced += _save(product, *result)
+        return synced
+
+
+def _create(client, product):
+    stripe_product_id = product.stripe_product_id
+    try:
+        if not stripe_product_id:
+            stripe_product_id = client.create_product(product.name)
+        price_id = client.create_price(stripe_product_id, product.stripe_unit_amount(), STRIPE_CURRENCY)
+    except stripe.error.StripeError as error:
+        return stripe_product_id, None, error
+    return stripe_product_id, price_id, None
+
+
+def _save(product, stripe_product_id, price_id, error):
+    # Saved with update(), the catalog cache does not hold the Stripe fields.
+    if error is None:
+        # A product repriced since it was read stays pending, its new price needs another sync.
+        synced = Product.objects.filter(id=product.id, price=product.price).update(
+            stripe_product_id=stripe_product_id, stripe_product_price_id=price_id,
+            stripe_synced_price=product.price, stripe_sync_status=StripeSyncStatus.SYNCED, stripe_sync_attempts=0,
+        )
+        if not synced:
+            Product.objects.filter(id=product.id).update(stripe_product_id=stripe_product_id)
+        return synced
+
+    logger.warning('Could not sync product %s to Stripe: %s', product.id, error)
+    Product.objects.filter(id=product.id).update(
+        stripe_product_id=stripe_product_id,
+        stripe_sync_attempts=F('stripe_sync_attempts') + 1,
+        stripe_sync_status=Case(
+            When(stripe_sync_attempts__gte=settings.STRIPE_SYNC_MAX_ATTEMPTS - 1, then=StripeSyncStatus.FAILED),
+            default=StripeSyncStatus.PENDING,
+        ),
+    )
+    return 0
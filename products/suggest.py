@@ -0,0 +1,120 @@
+"""
+In-process prefix index of product and category names for as-you-type suggestions.
+
+Every name is indexed under each of its word-start suffixes ("black nike bag" also as
+"nike bag" and "bag") in one sorted list, so a lookup is a bisect plus a short scan. The
+index follows the catalog version: the objects changed since it was built are patched in
+from the catalog cache, and it is only rebuilt from scratch when that history has a gap.
+"""
+import re
+import threading
+from bisect import bisect_left, insort
+
+from django.conf import settings
+
+from common.cache import get_or_compute
+from products import catalog
+from products.models import Product
+
+WORD_START = re.compile(r'\b\w', re.UNICODE)
+# Catalog change records name models, suggestions name kinds.
+KINDS = {'product': 'product', 'productcategory': 'category'}
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.version = None
+        self._keys = []
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def search(self, prefix, limit=10):
+        prefix = _normalize(prefix)
+        if not prefix:
+            return []
+
+        results = []
+        seen = set()
+        keys = self._keys
+        position = bisect_left(keys, (prefix,))
+        while position < len(keys) and len(results) < limit:
+            key, kind, pk = keys[position]
+            if not key.startswith(prefix):
+                break
+            if (kind, pk) not in seen and (kind, pk) in self._names:
+                seen.add((kind, pk))
+                results.append({'type': kind, 'id': pk, 'name': self._names[kind, pk]})
+            position += 1
+        return results
+
+    def sync(self, version):
+        """Bring the index up to ``version`` of the catalog."""
+        if self.version == version:
+            return
+        with self._lock:
+            if self.version == version:
+                return
+            changes = catalog.get_changes(self.version, version) if self.version is not None else None
+            if changes is None:
+                self._rebuild(version)
+            else:
+                self._patch(changes)
+            self.version = version
+
+    def _rebuild(self, version):
+        names = get_or_compute(
+            catalog.make_key('suggest', version=version),
+            lambda: {
+                **{('category', category.id): category.name for category in catalog.get_categories()},
+                **{('product', pk): name for pk, name in Product.objects.values_list('id', 'name')},
+            },
+            timeout=settings.CATALOG_CACHE_TIMEOUT,
+        )
+        # Swap in a complete new list so concurrent lookups never see a half-built one.
+        self._keys = sorted(
+            (key, kind, pk) for (kind, pk), name in names.items() for key in _keys(name)
+        )
+        self._names = names
+
+    def _patch(self, changes):
+        changes = [(KINDS[model_name], pk) for model_name, pk in changes if model_name in KINDS]
+        categories = {category.id: category.name for category in catalog.get_categories()}
+        product_ids = sorted(pk for kind, pk in changes if kind == 'product')
+        products = {product.id: product.name for product in catalog.get_products(product_ids)}
+        current = {'category': categories, 'product': products}
+
+        keys = list(self._keys)
+        names = dict(self._names)
+        for kind, pk in changes:
+            old_name = names.pop((kind, pk), None)
+            if old_name is not None:
+                for key in _keys(old_name):
+                    position = bisect_left(keys, (key, kind, pk))
+                    if position < len(keys) and keys[position] == (key, kind, pk):
+                        del keys[position]
+            new_name = current.get(kind, {}).get(pk)
+            if new_name is not None:
+                names[kind, pk] = new_name
+                for key in _keys(new_name):
+                    insort(keys, (key, kind, pk))
+        self._keys, self._names = keys, names
+
+
+def _normalize(text):
+    return ' '.join(text.lower().split())
+
+
+def _keys(name):
+    name = _normalize(name)
+    return {name[match.start():] for match in WORD_START.finditer(name)}
+
+
+index = PrefixIndex()
+
+
+def suggest(prefix, limit=10):
+    index.sync(catalog.get_version())
+    return index.search(prefix, limit)
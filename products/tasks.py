@@ -0,0 +1,39 @@
+import logging
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from products.baskets import delete_stale_baskets, get_basket_store
+from products.models import Basket
+from products.stripe_sync import sync_pending
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def flush_baskets():
+    get_basket_store().flush()
+
+
+@shared_task
+def purge_stale_baskets():
+    """Report abandoned baskets, then delete those too old to matter."""
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=settings.BASKET_STALE_AFTER)
+    # Deleting flushes the basket store, so the report below sees every basket.
+    deleted = delete_stale_baskets(stale_before, chunk_size=settings.BASKET_PURGE_CHUNK_SIZE)
+    report = Basket.objects.filter(
+        updated_at__lt=now - timedelta(seconds=settings.BASKET_ABANDONED_AFTER),
+        updated_at__gte=stale_before,
+    ).abandoned_report()
+    report['deleted'] = deleted
+    logger.info('Abandoned baskets: %(carts)s carts, %(total_quantity)s items worth %(total_sum)s, '
+                '%(deleted)s stale rows deleted', report)
+    return report
+
+
+@shared_task(ignore_result=True)
+def sync_stripe_products():
+    sync_pending()
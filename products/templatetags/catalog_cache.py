@@ -0,0 +1,48 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+from django.templatetags.cache import CacheNode
+
+from common.cache import get_or_compute
+
+register = template.Library()
+
+
+class ComputedCacheNode(CacheNode):
+    """``{% cache %}`` whose fragments are rendered through get_or_compute, at most once across workers."""
+
+    def render(self, context):
+        timeout = self.expire_time_var.resolve(context)
+        if timeout is not None:
+            try:
+                timeout = int(timeout)
+            except (ValueError, TypeError):
+                raise template.TemplateSyntaxError(f'"cache_fragment" tag got a non-integer timeout value: {timeout!r}')
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        key = make_template_fragment_key(self.fragment_name, vary_on)
+        return get_or_compute(key, lambda: self.nodelist.render(context), timeout=timeout)
+
+
+@register.tag('cache_fragment')
+def do_cache_fragment(parser, token):
+    """
+    Cache the contents of a template fragment, like ``{% cache %}``::
+
+        {% cache_fragment [timeout] [fragment_name] [var1] [var2] ... %}
+            .. some expensive processing ..
+        {% endcache_fragment %}
+
+    A cold or expiring fragment is rendered by a single worker while the others wait for it or
+    keep serving the current copy, instead of all rendering it at once.
+    """
+    nodelist = parser.parse(('endcache_fragment',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    if len(tokens) < 3:
+        raise template.TemplateSyntaxError(f'"{tokens[0]}" tag requires at least 2 arguments.')
+    return ComputedCacheNode(
+        nodelist,
+        parser.compile_filter(tokens[1]),
+        tokens[2],
+        [parser.compile_filter(token) for token in tokens[3:]],
+        None,
+    )
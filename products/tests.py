@@ -1,12 +1,53 @@
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
 from http import HTTPStatus
+from io import StringIO
+from unittest import mock, skipUnless
 
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.management import call_command
+from django.db import connection
+from django.test import (RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+                         skipUnlessDBFeature)
+from django.test.utils import CaptureQueriesContext
+from django_redis import get_redis_connection
+from django_redis.cache import RedisCache
 from django.urls import reverse
+from django.utils import timezone
+import stripe
 
-from products.models import Product, ProductCategory
+from common.cache import cache_lock, get_or_compute
+from common.pagination import decode_cursor, encode_cursor
+from common.cache_backends import _MISSING, LocalLRU, TwoTierRedisCache
+from common.stripe_client import FakeStripeClient
+from orders import reservations
+from orders.checkout import checkout
+from products import catalog, facets
+from products.baskets import (AnonymousBasketStore, BasketStore, RedisBasketStore, delete_stale_baskets,
+                              get_basket_store)
+from products.context_processors import baskets
+from products.models import Basket, CategoryFacet, Product, ProductCategory, StripeSyncStatus
+from products.stripe_sync import sync_pending
+from products.tasks import purge_stale_baskets, sync_stripe_products
+from users.models import User
+
+
+def redis_available():
+    try:
+        return get_redis_connection('default').ping()
+    except Exception:
+        return False
 
 
 class IndexViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_index_view(self):
         response = self.client.get(reverse('index'))
         self.assertEqual(response.status_code, HTTPStatus.OK)
@@ -18,6 +59,7 @@ class ProductListViewTestCase(TestCase):
     fixtures = ['categories.json', 'goods.json']
 
     def setUp(self):
+        cache.clear()
         self.products = Product.objects.all()
 
     def test_product_list_view(self):
@@ -36,7 +78,676 @@ class ProductListViewTestCase(TestCase):
         self.assertEqual(list(response.context_data['object_list']),
                          list(self.products.filter(category_id=category.id)))
 
+    def test_list_next_cursor_page(self):
+        response = self.client.get(reverse('products:index'))
+        next_cursor = response.context_data['page_obj'].next_cursor
+
+        response = self.client.get(reverse('products:index'), {'cursor': next_cursor})
+
+        self._common_tests(response)
+        self.assertEqual(list(response.context_data['object_list']), list(self.products.order_by('id')[3:6]))
+        self.assertTrue(response.context_data['page_obj'].has_previous())
+
+    def test_list_offset_page(self):
+        response = self.client.get(reverse('products:paginator', kwargs={'page': 2}))
+
+        self._common_tests(response)
+        self.assertEqual(list(response.context_data['object_list']), list(self.products.order_by('id')[3:6]))
+
+    def test_list_served_from_catalog_cache(self):
+        first = self.client.get(reverse('products:index'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('products:index'))
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.content, first.content)
+
+    def test_logged_in_users_get_cached_page(self):
+        first = self.client.get(reverse('products:index'))
+        self.client.force_login(User.objects.create_user(username='shopper', password='password'))
+
+        # Only the middleware's session lookup.
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('products:index'))
+
+        self.assertEqual(response.content, first.content)
+        self.assertContains(response, reverse('products:baskets'))
+        self.assertContains(response, reverse('products:user_menu'))
+
+    def test_user_menu(self):
+        user = User.objects.create_user(username='shopper', password='password')
+        self.assertContains(self.client.get(reverse('products:user_menu')), reverse('users:login'))
+
+        self.client.force_login(user)
+        response = self.client.get(reverse('products:user_menu'))
+
+        self.assertContains(response, reverse('users:profile', args=[user.id]))
+
+    def test_page_cached_by_its_query_parameters_only(self):
+        cursor = self.client.get(reverse('products:index')).context_data['page_obj'].next_cursor
+        self.client.get(reverse('products:index'), {'cursor': cursor})
+
+        with self.assertNumQueries(0):
+            self.client.get(reverse('products:index'), {'utm_source': 'newsletter'})
+            self.client.get(reverse('products:index'), {'cursor': cursor + '==', 'ref': 'mail'})
+
+    def test_invalid_query_parameters_not_cached(self):
+        with mock.patch('products.decorators.get_or_compute') as get_or_compute_:
+            response = self.client.get(reverse('products:index'), {'cursor': 'broken'})
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        get_or_compute_.assert_not_called()
+
+    def test_list_reflects_catalog_writes(self):
+        self.client.get(reverse('products:index'))
+        product = self.products.order_by('id').first()
+        product.name = 'Renamed product'
+        product.stripe_product_price_id = 'price_test'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        response = self.client.get(reverse('products:index'))
+
+        self.assertEqual(response.context_data['object_list'][0].name, 'Renamed product')
+
+    def test_product_grid_fragment_shared_by_all_visitors(self):
+        self.client.get(reverse('products:index'))
+        key = make_template_fragment_key('product_grid', [catalog.get_version(), None, '1-2-3'])
+        fragment, _, _ = cache.get(key)
+
+        self.client.force_login(User.objects.create_user(username='shopper', password='password'))
+        response = self.client.get(reverse('products:index'))
+
+        self.assertIn(fragment, response.content.decode())
+
+    def test_expired_product_grid_served_while_another_worker_renders_it(self):
+        key = make_template_fragment_key('product_grid', [catalog.get_version(), None, '1-2-3'])
+        cache.set(key, ('<p>Stale grid</p>', time.time() - 1, 0.1))
+
+        with cache_lock(key) as acquired:
+            self.assertTrue(acquired)
+            response = self.client.get(reverse('products:index'))
+
+        self.assertContains(response, '<p>Stale grid</p>', html=True)
+
+    def test_product_grid_fragment_keyed_by_page_contents(self):
+        cursor = self.client.get(reverse('products:index')).context_data['page_obj'].next_cursor
+        position, reverse_ = decode_cursor(cursor)
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.client.get(reverse('products:index'), {'cursor': cursor})
+            # Another cursor between the same products, and the same page asked for by offset.
+            self.client.get(reverse('products:index'), {'cursor': encode_cursor([position[0] + 0.5], reverse_)})
+            self.client.get(reverse('products:paginator', kwargs={'page': 2}))
+
+        keys = [call.args[0] for call in cache_set.call_args_list if 'product_grid' in call.args[0]]
+        self.assertEqual(keys, [make_template_fragment_key('product_grid', [catalog.get_version(), None, '4-5-6'])])
+
+    def test_list_invalid_cursor(self):
+        response = self.client.get(reverse('products:index'), {'cursor': 'broken'})
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
     def _common_tests(self, response):
         self.assertEqual(response.status_code, HTTPStatus.OK)
         self.assertEqual(response.context_data['title'], 'Store | Products')
         self.assertTemplateUsed(response, 'products/products.html')
+
+
+class BasketSidebarViewTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def test_basket_sidebar(self):
+        user = User.objects.create_user(username='shopper', password='password')
+        product = Product.objects.first()
+        Basket.objects.create(user=user, product=product, quantity=2)
+        self.client.force_login(user)
+
+        response = self.client.get(reverse('products:baskets'))
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTemplateUsed(response, 'products/baskets.html')
+        self.assertContains(response, product.name)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_basket_sidebar_anonymous(self):
+        response = self.client.get(reverse('products:baskets'))
+        self.assertContains(response, 'Корзина пуста.')
+
+
+class BasketAddTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='password')
+        self.client.force_login(self.user)
+
+    def test_basket_add(self):
+        path = reverse('products:basket_add', kwargs={'product_id': 1})
+        self.client.get(path, HTTP_REFERER='/')
+        response = self.client.get(path, HTTP_REFERER='/')
+
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertEqual(list(Basket.objects.filter(user=self.user).values_list('product_id', 'quantity')), [(1, 2)])
+
+    def test_basket_remove(self):
+        Basket.objects.create(user=self.user, product_id=1, quantity=2)
+        other = Basket.objects.create(user=User.objects.create_user(username='other'), product_id=1, quantity=1)
+
+        self.client.get(reverse('products:basket_remove', kwargs={'product_id': 1}), HTTP_REFERER='/')
+
+        self.assertFalse(Basket.objects.filter(user=self.user).exists())
+        self.assertTrue(Basket.objects.filter(id=other.id).exists())
+
+    def test_basket_add_missing_product(self):
+        response = self.client.get(reverse('products:basket_add', kwargs={'product_id': 999}), HTTP_REFERER='/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertFalse(Basket.objects.exists())
+
+
+class BasketAddDeletedProductTestCase(TransactionTestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='password')
+        self.client.force_login(self.user)
+
+    def test_product_deleted_after_ids_were_cached(self):
+        with mock.patch.object(catalog, 'product_exists', return_value=True):
+            response = self.client.get(reverse('products:basket_add', kwargs={'product_id': 999}), HTTP_REFERER='/')
+
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertFalse(Basket.objects.exists())
+
+
+class BasketStoreTestCase(SimpleTestCase):
+    def test_stores_must_implement_all_operations(self):
+        class IncompleteStore(BasketStore):
+            def get(self, user):
+                return []
+
+        with self.assertRaises(TypeError):
+            IncompleteStore()
+
+
+@skipUnless(redis_available(), 'Redis is not available')
+class AnonymousBasketTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='password')
+        Basket.objects.create(user=self.user, product_id=1, quantity=1)
+
+    def add(self, product_id):
+        return self.client.get(reverse('products:basket_add', kwargs={'product_id': product_id}), HTTP_REFERER='/')
+
+    def test_basket_kept_in_cache(self):
+        catalog.get_product_ids()
+        with self.assertNumQueries(0):
+            response = self.add(1)
+            self.add(1)
+            self.add(3)
+
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertIn(AnonymousBasketStore.cookie_name, response.cookies)
+        self.assertEqual(Basket.objects.count(), 1)
+        response = self.client.get(reverse('products:baskets'))
+        self.assertEqual(response.context['baskets'].total_quantity, 3)
+
+        self.client.get(reverse('products:basket_remove', kwargs={'product_id': 1}), HTTP_REFERER='/')
+        self.assertEqual([basket.product_id for basket in baskets(response.wsgi_request)['baskets']], [3])
+
+    def test_changes_fields_of_a_redis_hash(self):
+        store = AnonymousBasketStore(timeout=60)
+        token = store.new_token()
+        self.addCleanup(store.redis.delete, store._key(token))
+
+        self.assertEqual(store.add(token, 1), 1)
+        self.assertEqual(store.add(token, 1, 2), 3)
+        store.add(token, 3)
+        store.redis.expire(store._key(token), 5)
+        store.remove(token, 3)
+
+        self.assertEqual(store.redis.hgetall(store._key(token)), {b'1': b'3'})
+        self.assertGreater(store.redis.ttl(store._key(token)), 5)
+        self.assertEqual(store.pop(token), {1: 3})
+        self.assertFalse(store.redis.exists(store._key(token)))
+
+    def test_forged_cookie_ignored(self):
+        self.client.cookies[AnonymousBasketStore.cookie_name] = 'forged'
+        response = self.client.get(reverse('products:baskets'))
+        self.assertFalse(response.context['baskets'])
+
+    def test_merged_on_login(self):
+        self.add(1)
+        self.add(3)
+
+        response = self.client.post(reverse('users:login'), {'username': 'shopper', 'password': 'password'})
+
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertEqual(
+            dict(Basket.objects.filter(user=self.user).values_list('product_id', 'quantity')), {1: 2, 3: 1},
+        )
+        # The anonymous basket is gone once merged.
+        self.client.logout()
+        self.assertFalse(self.client.get(reverse('products:baskets')).context['baskets'])
+
+    def test_merged_on_token_obtain(self):
+        self.add(3)
+
+        response = self.client.post(reverse('api:token_obtain_pair'), {'username': 'shopper', 'password': 'password'})
+
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            dict(Basket.objects.filter(user=self.user).values_list('product_id', 'quantity')), {1: 1, 3: 1},
+        )
+
+
+class StaleBasketTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.users = [User.objects.create_user(username=f'shopper{index}') for index in range(3)]
+        for user, age in zip(self.users, (0, 2, 40)):
+            for product_id in (1, 3, 4):
+                Basket.objects.create(user=user, product_id=product_id, quantity=2)
+            Basket.objects.filter(user=user).update(updated_at=now - timedelta(days=age))
+
+    def test_delete_in_chunks(self):
+        # One select and one delete per chunk, plus the empty select that ends the loop.
+        with self.assertNumQueries(5):
+            deleted = delete_stale_baskets(timezone.now() - timedelta(days=30), chunk_size=2)
+
+        self.assertEqual(deleted, 3)
+        self.assertFalse(Basket.objects.filter(user=self.users[2]).exists())
+        self.assertEqual(Basket.objects.count(), 6)
+
+    def test_upsert_keeps_basket_fresh(self):
+        Basket.objects.add(self.users[2], 1)
+        Basket.objects.merge(self.users[2], {3: 1})
+
+        delete_stale_baskets(timezone.now() - timedelta(days=30))
+
+        self.assertEqual(
+            sorted(Basket.objects.filter(user=self.users[2]).values_list('product_id', 'quantity')), [(1, 3), (3, 3)],
+        )
+
+    def test_task_reports_abandoned_baskets(self):
+        report = purge_stale_baskets()
+
+        self.assertEqual(report['deleted'], 3)
+        self.assertEqual(report['carts'], 1)
+        self.assertEqual(report['total_quantity'], 6)
+        self.assertEqual(report['total_sum'], Decimal('23640.00'))
+
+
+class BasketContextTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='shopper', password='password')
+        Basket.objects.create(user=self.user, product_id=1, quantity=2)
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+
+    def test_not_evaluated_unless_used(self):
+        with self.assertNumQueries(0):
+            baskets(self.request)
+
+    def test_totals_cached_until_basket_write(self):
+        self.assertEqual(baskets(self.request)['baskets'].total_quantity, 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(baskets(self.request)['baskets'].total_sum, Decimal('12180.00'))
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            get_basket_store().add(self.user, 3)
+            # Dropped only on commit, a summary computed before that would hold the old rows.
+            self.assertEqual(baskets(self.request)['baskets'].total_quantity, 2)
+        for callback in callbacks:
+            callback()
+
+        self.assertEqual(baskets(self.request)['baskets'].total_quantity, 3)
+
+    def test_expired_totals_served_while_another_worker_recomputes(self):
+        store = get_basket_store()
+        key = store._summary_key(self.user.pk)
+        cache.set(key, ({'total_quantity': 1, 'total_sum': Decimal('6090.00')}, time.time() - 1, 0.1))
+
+        with cache_lock(key), self.assertNumQueries(0):
+            self.assertEqual(store.summary(self.user)['total_quantity'], 1)
+
+    def test_items_loaded_with_products(self):
+        Basket.objects.create(user=self.user, product_id=3, quantity=1)
+        with self.assertNumQueries(1):
+            self.assertEqual([basket.sum() for basket in baskets(self.request)['baskets']],
+                             [Decimal('12180.00'), Decimal('3390.00')])
+
+
+@skipUnless(redis_available(), 'Redis is not available')
+@override_settings(BASKET_STORE='products.baskets.RedisBasketStore')
+class RedisBasketStoreTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+        self.store = RedisBasketStore()
+        self.user = User.objects.create_user(username='shopper', password='password')
+        Basket.objects.create(user=self.user, product_id=1, quantity=2)
+        self.addCleanup(self.store.redis.delete, self.store._key(self.user.pk), self.store.dirty_key)
+
+    def test_writes_stay_in_redis_until_flushed(self):
+        self.store.add(self.user, 1)
+        self.store.add(self.user, 3, 4)
+        self.store.get(self.user)
+
+        with self.assertNumQueries(0):
+            baskets = self.store.get(self.user)
+            self.assertEqual([(basket.product_id, basket.quantity) for basket in baskets], [(1, 3), (3, 4)])
+            self.assertEqual(baskets.total_quantity(), 7)
+        self.assertEqual(list(Basket.objects.filter(user=self.user).values_list('quantity', flat=True)), [2])
+
+        self.store.remove(self.user, 1)
+        self.store.flush()
+
+        self.assertEqual(list(Basket.objects.filter(user=self.user).values_list('product_id', 'quantity')), [(3, 4)])
+
+    def test_checkout_does_not_bring_ordered_products_back(self):
+        self.store.add(self.user, 1)
+        reserve = reservations.reserve
+
+        def added_meanwhile(order, quantities):
+            reserve(order, quantities)
+            self.store.add(self.user, 4)
+
+        with mock.patch.object(reservations, 'reserve', side_effect=added_meanwhile):
+            checkout(self.user, first_name='Ivan', last_name='Ivanov', email='ivan@example.com', address='Moscow')
+        self.store.flush()
+
+        self.assertEqual(list(Basket.objects.filter(user=self.user).values_list('product_id', 'quantity')), [(4, 1)])
+        self.assertEqual([basket.product_id for basket in self.store.get(self.user)], [4])
+
+    def test_views_use_store(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('products:basket_add', kwargs={'product_id': 3}), HTTP_REFERER='/')
+        self.client.get(reverse('products:basket_remove', kwargs={'product_id': 1}), HTTP_REFERER='/')
+
+        self.store.flush(self.user)
+
+        self.assertEqual(list(Basket.objects.filter(user=self.user).values_list('product_id', 'quantity')), [(3, 1)])
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class BasketConcurrencyTestCase(TransactionTestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def test_parallel_adds_are_not_lost(self):
+        user = User.objects.create_user(username='shopper', password='password')
+
+        def add():
+            try:
+                for _ in range(5):
+                    Basket.objects.add(user, 1)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(list(Basket.objects.filter(user=user).values_list('quantity', flat=True)), [40])
+
+
+class CategoryFacetTestCase(TestCase):
+    fixtures = ['categories.json', 'goods.json']
+
+    def setUp(self):
+        cache.clear()
+
+    def _counts(self):
+        facet_rows = CategoryFacet.objects.filter(product_count__gt=0)
+        return set(facet_rows.values_list('category_id', 'price_bucket', 'product_count', 'in_stock_count'))
+
+    def test_facets_follow_product_writes(self):
+        product = Product.objects.get(id=4)
+        product.price = 25000
+        product.quantity = 0
+        product.stripe_product_price_id = 'price_test'
+        product.save()
+        Product.objects.create(name='Кеды', price=500, quantity=3, category_id=1, stripe_product_price_id='price_test')
+
+        maintained = self._counts()
+        call_command('rebuild_facets', stdout=StringIO())
+        self.assertEqual(maintained, self._counts())
+        self.assertIn((4, facets.price_bucket(25000), 1, 0), maintained)
+        self.assertEqual(facets.get_facets()[1]['product_count'], 2)
+
+    def test_save_uses_loaded_values(self):
+        product = Product.objects.get(id=4)
+        other = Product.objects.get(id=4)
+        other.category_id = 1
+        other.stripe_product_price_id = 'price_test'
+        other.save()
+        product.refresh_from_db()
+        product.price = 25000
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT "products_product"')])
+        maintained = self._counts()
+        call_command('rebuild_facets', stdout=StringIO())
+        self.assertEqual(maintained, self._counts())
+
+    def test_sidebar_counts(self):
+        response = self.client.get(reverse('products:category', kwargs={'category_id': 2}))
+
+        self.assertEqual(response.context_data['facets']['product_count'], 2)
+        counts = {category.id: category.product_count for category in response.context_data['categories']}
+        self.assertEqual(counts, {1: 1, 2: 2, 3: 2, 4: 1, 5: 0})
+
+
+class FlakyStripeClient(FakeStripeClient):
+    def create_price(self, product_id, unit_amount, currency):
+        raise stripe.error.APIConnectionError('Stripe is down')
+
+
+class StripeSyncTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stripe = FakeStripeClient()
+        category = ProductCategory.objects.create(name='Обувь')
+        self.product = Product.objects.create(name='Кеды', price=500, quantity=3, category=category)
+
+    def test_new_product_is_synced(self):
+        self.assertEqual(self.product.stripe_sync_status, StripeSyncStatus.PENDING)
+
+        self.assertEqual(sync_pending(self.stripe), 1)
+
+        product = Product.objects.get(id=self.product.id)
+        self.assertEqual(product.stripe_sync_status, StripeSyncStatus.SYNCED)
+        self.assertEqual(self.stripe.prices[product.stripe_product_price_id],
+                         {'product': product.stripe_product_id, 'unit_amount': 50000, 'currency': 'rub'})
+        self.assertEqual(sync_pending(self.stripe), 0)
+
+    def test_price_change_creates_new_price(self):
+        sync_pending(self.stripe)
+        product = Product.objects.get(id=self.product.id)
+        old_price_id = product.stripe_product_price_id
+        product.quantity = 1
+        product.save()
+        self.assertEqual(product.stripe_sync_status, StripeSyncStatus.SYNCED)
+
+        product.price = 700
+        product.save(update_fields=['price'])
+        sync_pending(self.stripe)
+
+        product = Product.objects.get(id=self.product.id)
+        self.assertNotEqual(product.stripe_product_price_id, old_price_id)
+        self.assertEqual(self.stripe.prices[product.stripe_product_price_id]['unit_amount'], 70000)
+        self.assertEqual(len(self.stripe.products), 1)
+
+    def test_one_run_at_a_time(self):
+        with cache_lock('stripe-sync'):
+            self.assertEqual(sync_pending(self.stripe), 0)
+        self.assertFalse(self.stripe.products)
+
+    def test_fixture_loads_queue_no_sync(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            call_command('loaddata', 'categories.json', 'goods.json', verbosity=0)
+        self.assertNotIn(sync_stripe_products.delay, callbacks)
+
+    @override_settings(STRIPE_SYNC_MAX_ATTEMPTS=2)
+    def test_failed_sync_is_retried_then_given_up(self):
+        client = FlakyStripeClient()
+
+        self.assertEqual(sync_pending(client), 0)
+        product = Product.objects.get(id=self.product.id)
+        self.assertEqual((product.stripe_sync_status, product.stripe_sync_attempts), (StripeSyncStatus.PENDING, 1))
+        # The Stripe product is kept, the retry only creates the price.
+        self.assertEqual(list(client.products), [product.stripe_product_id])
+
+        sync_pending(client)
+        self.assertEqual(Product.objects.get(id=self.product.id).stripe_sync_status, StripeSyncStatus.FAILED)
+
+
+class GetOrComputeTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_computes_once(self):
+        self.assertEqual(get_or_compute('key', self.compute), 1)
+        self.assertEqual(get_or_compute('key', self.compute), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_refreshes_expired_entry(self):
+        cache.set('key', ('old', time.time() - 1, 0.1))
+        self.assertEqual(get_or_compute('key', self.compute), 1)
+
+    def test_serves_stale_while_another_worker_refreshes(self):
+        cache.set('key', ('old', time.time() - 1, 0.1))
+        with cache_lock('key') as acquired:
+            self.assertTrue(acquired)
+            self.assertEqual(get_or_compute('key', self.compute), 'old')
+        self.assertEqual(self.calls, 0)
+
+
+class LocalLRUTestCase(SimpleTestCase):
+    def setUp(self):
+        self.lru = LocalLRU(max_entries=2, timeout=60)
+
+    def test_entries_expire(self):
+        self.lru.set('key', 1)
+        with mock.patch('common.cache_backends.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIs(self.lru.get('key'), _MISSING)
+        self.assertEqual(len(self.lru), 0)
+
+    def test_evicts_least_recently_used(self):
+        self.lru.set('a', 1)
+        self.lru.set('b', 2)
+        self.lru.get('a')
+        self.lru.set('c', 3)
+
+        self.assertIs(self.lru.get('b'), _MISSING)
+        self.assertEqual((self.lru.get('a'), self.lru.get('c')), (1, 3))
+
+    def test_returns_copies(self):
+        self.lru.set('key', [1])
+        self.lru.get('key').append(2)
+        self.assertEqual(self.lru.get('key'), [1])
+
+    def test_fill_after_invalidation_is_dropped(self):
+        generation = self.lru.generation
+        self.lru.delete('key')
+
+        self.assertFalse(self.lru.set('key', 'old', generation))
+        self.assertIs(self.lru.get('key'), _MISSING)
+        self.assertTrue(self.lru.set('key', 'new', self.lru.generation))
+
+    def test_counts_hits_and_misses_from_many_threads(self):
+        self.lru.set('key', 1)
+
+        def read():
+            for _ in range(1000):
+                self.lru.get('key')
+                self.lru.get('missing')
+
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual((self.lru.hits, self.lru.misses), (8000, 8000))
+
+
+@skipUnless(hasattr(cache, 'local_stats') and redis_available(), 'The two-tier Redis cache is not configured')
+class TwoTierRedisCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        params = settings.CACHES['default']
+        # A channel of its own gives the test a local tier and listener of its own.
+        self.cache = TwoTierRedisCache(params['LOCATION'], {
+            **params, 'OPTIONS': {**params['OPTIONS'], 'INVALIDATION_CHANNEL': f'cache:invalidate:{uuid.uuid4().hex}'},
+        })
+        self.key = f'catalog:test:{uuid.uuid4().hex}'
+        self.addCleanup(RedisCache.delete, self.cache, self.key)
+
+    def test_counts_hits_and_misses(self):
+        self.cache.set(self.key, 1)
+        self.assertEqual(self.cache.get(self.key), 1)
+        self.assertEqual(self.cache.get(self.key), 1)
+        self.assertEqual(self.cache.get_many([self.key]), {self.key: 1})
+
+        stats = self.cache.local_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (2, 1, 1))
+
+    def test_nothing_kept_locally_before_listener_subscribes(self):
+        self.cache.set(self.key, 1)
+        with mock.patch.object(TwoTierRedisCache, '_listen'), \
+                mock.patch('common.cache_backends.SUBSCRIBE_TIMEOUT', 0):
+            self.assertEqual(self.cache.get(self.key), 1)
+            self.assertEqual(self.cache.get_many([self.key]), {self.key: 1})
+
+        # A bump published now would never reach this process, so it must not hold a copy.
+        self.assertEqual(self.cache.local_stats()['entries'], 0)
+
+    def test_other_workers_writes_invalidate_local_copy(self):
+        self.cache.set(self.key, 'old')
+        self.assertEqual(self.cache.get(self.key), 'old')
+        redis = self.cache.client.get_client(write=True)
+        deadline = time.monotonic() + 5
+        while not redis.pubsub_numsub(self.cache._channel)[0][1] and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # Another worker's write reaches Redis and the channel, not this process' local tier.
+        RedisCache.set(self.cache, self.key, 'new')
+        self.assertEqual(self.cache.get(self.key), 'old')
+        redis.publish(self.cache._channel, self.cache._local_key(self.key, None))
+        while self.cache.get(self.key) == 'old' and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(self.cache.get(self.key), 'new')
+
+    def test_read_racing_a_write_is_not_kept_locally(self):
+        self.cache.set(self.key, 1)
+        read = RedisCache.get
+
+        def bumped_while_reading(cache_, *args, **kwargs):
+            value = read(cache_, *args, **kwargs)
+            self.cache.incr(self.key)
+            return value
+
+        with mock.patch.object(RedisCache, 'get', autospec=True, side_effect=bumped_while_reading):
+            self.assertEqual(self.cache.get(self.key), 1)
+
+        self.assertEqual(self.cache.get(self.key), 2)
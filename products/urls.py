@@ -1,16 +1,17 @@
 from django.urls import path
 
-from products.views import ProductListView, basket_add, basket_remove
-
-# from django.views.decorators.cache import cache_page
+from products.decorators import cache_catalog_page
+from products.views import (ProductListView, basket_add, basket_remove,
+                            basket_sidebar, user_menu)
 
 app_name = 'products'
 
 urlpatterns = [
-    path('', ProductListView.as_view(), name='index'),
-    # path('', cache_page(30)(ProductListView.as_view()), name='index') - cache_page example
+    path('', cache_catalog_page(ProductListView.as_view()), name='index'),
+    path('baskets/', basket_sidebar, name='baskets'),
+    path('user-menu/', user_menu, name='user_menu'),
     path('baskets/add/<int:product_id>/', basket_add, name='basket_add'),
-    path('baskets/remove/<int:basket_id>/', basket_remove, name='basket_remove'),
-    path('category/<int:category_id>/', ProductListView.as_view(), name='category'),
-    path('page/<int:page>/', ProductListView.as_view(), name='paginator'),
+    path('baskets/remove/<int:product_id>/', basket_remove, name='basket_remove'),
+    path('category/<int:category_id>/', cache_catalog_page(ProductListView.as_view()), name='category'),
+    path('page/<int:page>/', cache_catalog_page(ProductListView.as_view()), name='paginator'),
 ]
@@ -1,11 +1,17 @@
-from django.contrib.auth.decorators import login_required
-from django.core.cache import cache
-from django.shortcuts import HttpResponseRedirect
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import Http404
+from django.shortcuts import HttpResponseRedirect, render
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.cache import never_cache
 from django.views.generic.base import TemplateView
 from django.views.generic.list import ListView
 
+from common.pagination import KeysetPaginationMixin
 from common.views import TitleMixin
-from products.models import Basket, Product, ProductCategory
+from products import catalog, facets
+from products.baskets import AnonymousBasketStore, get_basket_store
+from products.models import Product
 
 
 class IndexView(TitleMixin, TemplateView):
@@ -13,44 +19,78 @@ class IndexView(TitleMixin, TemplateView):
     title = 'Store | Main Page'
 
 
-class ProductListView(TitleMixin, ListView):
+class ProductListView(TitleMixin, KeysetPaginationMixin, ListView):
     model = Product
     template_name = 'products/products.html'
     title = 'Store | Products'
     paginate_by = 3
+    keyset_ordering = ('id',)
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        category_id = self.kwargs.get('category_id')
-        return queryset.filter(category_id=category_id).order_by('id') if category_id else queryset
+        return catalog.get_product_ids(self.kwargs.get('category_id'))
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, is_paginated = super().paginate_queryset(queryset, page_size)
+        self.page_ids = list(object_list)
+        # Products are only loaded when the grid fragment is not cached yet.
+        page.object_list = SimpleLazyObject(lambda: catalog.get_products(object_list))
+        return paginator, page, page.object_list, is_paginated
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data(**kwargs)
-        categories = cache.get('categories')
-        if not categories:
-            context['categories'] = ProductCategory.objects.all()
-            cache.set('categories', context['categories'], 30)
-        else:
-            context['categories'] = categories
+        # Only evaluated when the sidebar fragment is not cached yet.
+        context['categories'] = SimpleLazyObject(self.get_categories)
+        context['facets'] = SimpleLazyObject(lambda: facets.get_facets().get(self.kwargs.get('category_id'), {}))
+        context['category_id'] = self.kwargs.get('category_id')
+        # The grid fragment is keyed by the products it shows, not by the request's cursor or page,
+        # so any number of ways to ask for one page share one entry.
+        context['page_key'] = '-'.join(map(str, self.page_ids))
+        context['catalog_version'] = catalog.get_version()
+        context['catalog_cache_timeout'] = settings.CATALOG_CACHE_TIMEOUT
         return context
 
+    @staticmethod
+    def get_categories():
+        category_facets = facets.get_facets()
+        categories = catalog.get_categories()
+        for category in categories:
+            category.product_count = category_facets.get(category.id, {}).get('product_count', 0)
+        return categories
 
-@login_required
-def basket_add(request, product_id):
-    product = Product.objects.get(id=product_id)
-    baskets = Basket.objects.filter(user=request.user, product=product)
 
-    if not baskets.exists():
-        Basket.objects.create(user=request.user, product=product, quantity=1)
-    else:
-        basket = baskets.first()
-        basket.quantity += 1
-        basket.save()
+@never_cache
+def basket_sidebar(request):
+    return render(request, 'products/baskets.html')
 
-    return HttpResponseRedirect(request.META['HTTP_REFERER'])
+
+@never_cache
+def user_menu(request):
+    return render(request, 'products/user_menu.html')
 
 
-@login_required
-def basket_remove(request, basket_id):
-    Basket.objects.get(id=basket_id).delete()
+def basket_add(request, product_id):
+    if not catalog.product_exists(product_id):
+        raise Http404('Product not found')
+    response = HttpResponseRedirect(request.META['HTTP_REFERER'])
+    if request.user.is_authenticated:
+        try:
+            # The cached ids can still hold a product deleted a moment ago, its foreign key fails then.
+            with transaction.atomic():
+                get_basket_store().add(request.user, product_id)
+        except IntegrityError:
+            raise Http404('Product not found')
+    else:
+        anonymous = AnonymousBasketStore()
+        token = anonymous.get_token(request) or anonymous.new_token()
+        anonymous.add(token, product_id)
+        anonymous.set_token(response, token)
+    return response
+
+
+def basket_remove(request, product_id):
+    if request.user.is_authenticated:
+        get_basket_store().remove(request.user, product_id)
+    else:
+        anonymous = AnonymousBasketStore()
+        anonymous.remove(anonymous.get_token(request), product_id)
     return HttpResponseRedirect(request.META['HTTP_REFERER'])
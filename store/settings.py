@@ -284,26 +284,113 @@ REDIS_PORT = env("REDIS_PORT", default="6379")
 
 CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
+        "BACKEND": "common.cache_backends.TwoTierRedisCache",
         "LOCATION": f"redis://{REDIS_HOST}:{REDIS_PORT}/1",
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # Hot, rarely changing keys are also kept in a per-process LRU in front of Redis.
+            "LOCAL_KEY_PREFIXES": ["catalog:", "template.cache."],
+            "LOCAL_MAX_ENTRIES": 2048,
+            "LOCAL_TIMEOUT": 60,
+        },
+        # Used instead by `manage.py test` (see common.testing), whose tests flush the cache.
+        "TEST": {
+            "LOCATION": f"redis://{REDIS_HOST}:{REDIS_PORT}/2",
+            "KEY_PREFIX": "test",
+            "OPTIONS": {"INVALIDATION_CHANNEL": "test:cache:invalidate"},
         },
     }
 }
 
+TEST_RUNNER = "common.testing.TestRunner"
+
+# Catalog entries are keyed by catalog version and never go stale; the timeout only
+# reclaims entries orphaned by version bumps.
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Upper bounds of the price histogram buckets in products.facets; the last bucket is open-ended.
+# Run `manage.py rebuild_facets` after changing them.
+CATALOG_PRICE_BUCKETS = [1000, 3000, 5000, 10000, 20000]
+
 # Celery
 
 CELERY_BROKER_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
 CELERY_RESULT_BACKEND = f"redis://{REDIS_HOST}:{REDIS_PORT}/0"
 CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
+CELERY_BEAT_SCHEDULE = {
+    'flush-baskets': {
+        'task': 'products.tasks.flush_baskets',
+        'schedule': 30.0,
+    },
+    'purge-stale-baskets': {
+        'task': 'products.tasks.purge_stale_baskets',
+        'schedule': 60.0 * 60,
+    },
+    'release-expired-reservations': {
+        'task': 'orders.tasks.release_expired_reservations',
+        'schedule': 60.0,
+    },
+    'sync-stripe-products': {
+        'task': 'products.tasks.sync_stripe_products',
+        'schedule': 60.0,
+    },
+    # The webhook queues processing itself; this catches events whose task was lost.
+    'process-stripe-events': {
+        'task': 'orders.tasks.process_stripe_events',
+        'schedule': 60.0,
+    },
+}
+
+# Baskets: products.baskets.DatabaseBasketStore, or products.baskets.RedisBasketStore to keep
+# them in Redis and write them back to the database from products.tasks.flush_baskets.
+BASKET_STORE = env('BASKET_STORE', default='products.baskets.DatabaseBasketStore')
+# Also how long anonymous baskets (products.baskets.AnonymousBasketStore) are kept in Redis.
+BASKET_STORE_TIMEOUT = 60 * 60 * 24 * 7
+# products.tasks.purge_stale_baskets reports baskets not updated for BASKET_ABANDONED_AFTER as
+# abandoned and deletes those not updated for BASKET_STALE_AFTER (seconds), in chunks.
+BASKET_ABANDONED_AFTER = 60 * 60 * 24
+BASKET_STALE_AFTER = 60 * 60 * 24 * 30
+BASKET_PURGE_CHUNK_SIZE = 1000
+
+# How long checkout holds stock for an unpaid order (seconds), also the lifetime of its Stripe
+# Checkout session, which cannot be shorter than 30 minutes. orders.tasks.release_expired_reservations
+# gives the stock back STOCK_RESERVATION_GRACE seconds after that.
+STOCK_RESERVATION_TIMEOUT = 60 * 30
+STOCK_RESERVATION_GRACE = 60 * 10
 
 # Stripe
 
 STRIPE_PUBLIC_KEY = env("STRIPE_PUBLIC_KEY")
 STRIPE_SECRET_KEY = env("STRIPE_SECRET_KEY")
 STRIPE_WEBHOOK_SECRET = env("STRIPE_WEBHOOK_SECRET")
+# Stored webhook events are handled this many at a time (orders.events), and given up
+# on after this many failed attempts.
+STRIPE_EVENT_BATCH_SIZE = 100
+STRIPE_EVENT_MAX_ATTEMPTS = 5
+# Client of the Stripe catalog and checkout calls, common.stripe_client.FakeStripeClient keeps
+# them in memory.
+STRIPE_CLIENT = env('STRIPE_CLIENT', default='common.stripe_client.StripeClient')
+# Seconds; idempotent requests are retried on network errors this many times.
+STRIPE_CONNECT_TIMEOUT = 3
+STRIPE_READ_TIMEOUT = 15
+STRIPE_MAX_NETWORK_RETRIES = 2
+
+# products.stripe_sync syncs pending products this many at a time, with at most
+# STRIPE_SYNC_CONCURRENCY Stripe calls in flight, and gives up after this many failed attempts.
+STRIPE_SYNC_BATCH_SIZE = 50
+STRIPE_SYNC_CONCURRENCY = 8
+STRIPE_SYNC_MAX_ATTEMPTS = 5
+# Only one sync runs at a time; a run stops starting batches after half of this (seconds).
+STRIPE_SYNC_LOCK_TIMEOUT = 60 * 15
+
+# common.idempotency: how long responses to requests with an Idempotency-Key are replayed, and
+# how long a duplicate waits for the first request (seconds). The first request holds its key
+# for twice the longest its Stripe call can take, every attempt timing out, so a slow request
+# cannot lose the key to its duplicate halfway through.
+IDEMPOTENCY_KEY_TIMEOUT = 60 * 60 * 24
+IDEMPOTENCY_WAIT_TIMEOUT = 30
+IDEMPOTENCY_LOCK_TIMEOUT = 2 * (STRIPE_CONNECT_TIMEOUT + STRIPE_READ_TIMEOUT) * (STRIPE_MAX_NETWORK_RETRIES + 1)
 
 SOCIAL_GITHUB_CLIENT_ID = env("SOCIAL_GITHUB_CLIENT_ID", default="")
 SOCIAL_GITHUB_SECRET = env("SOCIAL_GITHUB_SECRET", default="")
@@ -312,7 +399,7 @@ SOCIAL_GITHUB_SECRET = env("SOCIAL_GITHUB_SECRET", default="")
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
+    "DEFAULT_PAGINATION_CLASS": "common.pagination.KeysetPagination",
     "PAGE_SIZE": 3,
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
@@ -22,6 +22,7 @@ from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, Sp
 from rest_framework.authtoken.views import obtain_auth_token
 
 from orders.views import stripe_webhook_view
+from products.decorators import cache_catalog_page
 from products.views import IndexView
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -31,7 +32,7 @@ from rest_framework_simplejwt.views import (
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('', IndexView.as_view(), name='index'),
+    path('', cache_catalog_page(IndexView.as_view()), name='index'),
     path('products/', include('products.urls', namespace='products')),
     path('users/', include('users.urls', namespace='users')),
     path('accounts/', include('allauth.urls')),